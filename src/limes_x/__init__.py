@@ -1,5 +1,7 @@
 from .workflow import Workflow, InputGroup
-from .execution.modules import ModuleBuilder, ComputeModule, Item, JobContext, JobResult, Params, LoadComputeModules
-from .execution.executors import Job, Executor, HpcExecutor
+from .execution.modules import ModuleBuilder, ComputeModule, Item, JobContext, JobResult, Params, RetryPolicy, LoadComputeModules
+from .execution.executors import Job, Executor, HpcExecutor, TokenBucket
+from .execution.scheduler import ResourceBudget
+from .execution.runners import JobRunner, ThreadPerJobRunner, ThreadPoolRunner, AsyncioRunner
 from .cli import main
 
@@ -34,6 +34,7 @@ def help():
 
         Where COMMAND is one of:
         setup
+        state
 
         for additional help, use:
         {CMD} COMMAND -h
@@ -92,6 +93,25 @@ def setup(args):
 
     print("done")
 
+def state(args):
+    parser = ArgumentParser(prog=f'{CMD} state')
+
+    parser.add_argument('--workspace', "-w", metavar='PATH', help="workspace of a workflow", required=True)
+    parser.add_argument(
+        '--to', "-t", choices=["json", "sqlite"],
+        help="convert the saved workflow state to workflow_state.json or workflow_state.db", required=True
+    )
+    pargs = parser.parse_args(args)
+
+    from .workflow import WorkflowState
+    from .execution.state_store import SqliteStateStore
+    ws = Path(pargs.workspace)
+    source = ws.joinpath(WorkflowState._FILE_NAME if pargs.to == "sqlite" else SqliteStateStore.FILE_NAME)
+    assert source.exists(), f"can't find {source}"
+
+    converted = WorkflowState.ConvertSave(ws, pargs.to)
+    print(f"converted {source} to {converted}")
+
 # def local(args):
 #     sys.argv = ["python"]+args
 #     from .execution.executor_presets import local
@@ -111,6 +131,7 @@ def main():
     
     { # switch
         "setup": setup,
+        "state": state,
         # "local": local,
         # "slurm": slurm,
         # "pbs": pbs,
@@ -0,0 +1,106 @@
+from __future__ import annotations
+import os
+import time
+import gzip
+import shutil
+from pathlib import Path
+from threading import Condition, Thread
+from typing import TextIO
+
+class LogSink:
+    """appends lines to a log file through one open handle, instead of opening the file for every line
+    - lines are written out once [flush_sec] has passed or [flush_bytes] are waiting, whichever is first,
+    a background thread makes sure quiet stretches don't hold back the last lines, so tail -f keeps up
+    - with [rotate_bytes] > 0, a file that grew past that is moved to <name>.1, older ones to <name>.2 and so on,
+    up to [keep] of them, gzipped if [compress]. tail -F follows the name across rotations
+    - the file is opened on the first write, so a job with nothing to say leaves no empty log
+    - safe to share between threads, Close flushes what is left
+    """
+    def __init__(self, path: str|Path, flush_sec: float=1, flush_bytes: int=1<<16, rotate_bytes: int=0, keep: int=3, compress: bool=False) -> None:
+        assert keep > 0
+        self.path = Path(path)
+        self.flush_sec = flush_sec
+        self.flush_bytes = flush_bytes
+        self.rotate_bytes = rotate_bytes
+        self.keep = keep
+        self.compress = compress
+        self._file: TextIO|None = None
+        self._buffer: list[str] = []
+        self._waiting = 0
+        self._last_flush = time.monotonic()
+        self._cv = Condition()
+        self._closed = False
+        self._thread: Thread|None = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.Close()
+
+    def Write(self, line: str):
+        if not line.endswith("\n"): line += "\n"
+        with self._cv:
+            if self._closed: return
+            self._buffer.append(line)
+            self._waiting += len(line)
+            if self._waiting >= self.flush_bytes or time.monotonic()-self._last_flush >= self.flush_sec:
+                self._flush()
+            elif self._thread is None:
+                self._thread = Thread(target=self._flush_later, daemon=True, name="lx-log-sink")
+                self._thread.start()
+            else:
+                self._cv.notify()
+
+    def _flush_later(self):
+        with self._cv:
+            while not self._closed:
+                if self._waiting == 0:
+                    self._cv.wait()
+                    continue
+                due = self._last_flush+self.flush_sec-time.monotonic()
+                if due > 0:
+                    self._cv.wait(due)
+                    continue
+                self._flush()
+
+    def _flush(self):
+        # with the lock held
+        self._last_flush = time.monotonic()
+        if self._waiting == 0: return
+        if self._file is None: self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write("".join(self._buffer))
+        self._file.flush()
+        self._buffer.clear()
+        self._waiting = 0
+        if self.rotate_bytes > 0 and self._file.tell() >= self.rotate_bytes: self._rotate()
+
+    def _rotated(self, i: int):
+        return self.path.with_name(f"{self.path.name}.{i}{'.gz' if self.compress else ''}")
+
+    def _rotate(self):
+        assert self._file is not None
+        self._file.close()
+        self._file = None # a new one is opened by the next write
+        oldest = self._rotated(self.keep)
+        if oldest.exists(): os.remove(oldest)
+        for i in range(self.keep-1, 0, -1):
+            if self._rotated(i).exists(): os.replace(self._rotated(i), self._rotated(i+1))
+        if self.compress:
+            with open(self.path, "rb") as src, gzip.open(self._rotated(1), "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(self.path)
+        else:
+            os.replace(self.path, self._rotated(1))
+
+    def Flush(self):
+        with self._cv:
+            if not self._closed: self._flush()
+
+    def Close(self):
+        with self._cv:
+            if self._closed: return
+            self._flush()
+            self._closed = True
+            if self._file is not None: self._file.close()
+            self._cv.notify_all()
@@ -1,5 +1,7 @@
 import os
 import uuid
+import codecs
+import asyncio
 from typing import IO, Callable
 from inspect import signature
 import subprocess
@@ -36,7 +38,7 @@ def CurrentTimeMillis():
 def Timestamp():
     return f"{dt.now().strftime('%H:%M:%S')}>"
 
-def LiveShell(cmd: str, onOut: Callable[[str], None]|None=None, onErr: Callable[[str], None]|None=None, echo_cmd: bool=True):
+def LiveShell(cmd: str, onOut: Callable[[str], None]|None=None, onErr: Callable[[str], None]|None=None, echo_cmd: bool=True, pass_fds: tuple[int, ...]=()):
     class _Pipe:
         def __init__(self, io:IO[bytes]|None, lock: Condition=Condition(), q: Queue=Queue()) -> None:
             assert io is not None
@@ -61,6 +63,7 @@ def LiveShell(cmd: str, onOut: Callable[[str], None]|None=None, onErr: Callable[
         stdin=subprocess.PIPE,
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
+        pass_fds=pass_fds,
         **kwargs,
     )
 
@@ -93,6 +96,50 @@ def LiveShell(cmd: str, onOut: Callable[[str], None]|None=None, onErr: Callable[
     if code is None: code = 1
     return code
 
+async def LiveShellAsync(cmd: str, onOut: Callable[[str], None]|None=None, onErr: Callable[[str], None]|None=None, echo_cmd: bool=True, pass_fds: tuple[int, ...]=()):
+    """LiveShell as a coroutine, the process is awaited by the event loop instead of a blocked thread"""
+    def callback(cb, msg):
+        if cb is None:
+            print(msg, end='\r')
+        else:
+            cb(msg)
+
+    kwargs = {}
+    bash = "/bin/bash"
+    if os.path.exists(bash):
+        kwargs["executable"] = bash
+    ENCODING = 'utf-8'
+    MAX_LINE = 1<<20
+    process = await asyncio.create_subprocess_shell(
+        cmd,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        pass_fds=pass_fds,
+        **kwargs,
+    )
+
+    if echo_cmd: callback(onOut, f'{cmd}\n')
+    async def reader(stream: asyncio.StreamReader|None, cb: Callable[[str], None]|None):
+        # in chunks, readline fails on lines longer than the stream's 64 KiB limit and drops them.
+        # A line longer than MAX_LINE is passed on in pieces, so a tool that never writes a newline can't fill memory
+        assert stream is not None
+        decoder = codecs.getincrementaldecoder(ENCODING)()
+        pending = ""
+        while True:
+            chunk = await stream.read(1<<16)
+            *lines, pending = (pending+decoder.decode(chunk, final=chunk == b'')).split("\n")
+            for line in lines: callback(cb, line+"\n")
+            if chunk == b'' or len(pending) >= MAX_LINE:
+                if pending != "": callback(cb, pending)
+                pending = ""
+            if chunk == b'': break
+
+    await asyncio.gather(reader(process.stdout, onOut), reader(process.stderr, onErr))
+    code = await process.wait()
+    if code is None: code = 1
+    return code
+
 #######################################################################################################
 # https://github.com/dmfrey/FileLock/blob/master/filelock/filelock.py
 # with modification of using sqlite3 to prevent repeated deleting of lock file
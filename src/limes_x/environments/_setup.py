@@ -8,15 +8,16 @@ def ParseArgs(python_path: list[str]|None=None):
         sys.path = python_path
     VERBOSE = sys.argv.pop() == "True"
     _paths: list = list(sys.argv[1:])
-    assert len(_paths) == 3, f"bad receive {_paths}"
-    MODULE_PATH, WORKSPACE, RELATIVE_OUTPUT_PATH = [Path(p) for p in _paths[:3]]
+    assert len(_paths) >= 3, f"bad receive {_paths}"
+    MODULE_PATH, WORKSPACE = [Path(p) for p in _paths[:2]]
+    RELATIVE_OUTPUT_PATHS = [Path(p) for p in _paths[2:]] # more than 1 for a batch of jobs
 
     from limes_x.execution.modules import ComputeModule, JobContext
     # from limes_x.telemetry import ResourceMonitor
 
     _here = os.getcwd()
     os.chdir(WORKSPACE) # to keep relative output path
-    CONTEXT = JobContext.LoadFromDisk(RELATIVE_OUTPUT_PATH)
+    CONTEXTS = [JobContext.LoadFromDisk(p) for p in RELATIVE_OUTPUT_PATHS]
     THIS_MODULE = ComputeModule._load(MODULE_PATH)
     os.chdir(_here)
 
@@ -25,15 +26,19 @@ def ParseArgs(python_path: list[str]|None=None):
         module_path: Path
         module: ComputeModule
         workspace: Path
-        relative_output_path: Path
+        relative_output_path: Path # the first job's
         context: JobContext
+        relative_output_paths: list[Path]
+        contexts: list[JobContext]
         verbose: bool
         
     return ExecutionEssentials(
         module_path=MODULE_PATH,
         module=THIS_MODULE,
         workspace=WORKSPACE,
-        relative_output_path=RELATIVE_OUTPUT_PATH,
-        context=CONTEXT,
+        relative_output_path=RELATIVE_OUTPUT_PATHS[0],
+        context=CONTEXTS[0],
+        relative_output_paths=RELATIVE_OUTPUT_PATHS,
+        contexts=CONTEXTS,
         verbose=VERBOSE,
     )
\ No newline at end of file
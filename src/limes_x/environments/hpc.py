@@ -36,6 +36,7 @@ if __name__ == '__main__':
     cmd_history = []
     err_log, out_log = [], []
     realtime_log = WORKSPACE.joinpath(RELATIVE_OUTPUT_PATH).joinpath('realtime.log')
+    sink = env._open_log(realtime_log, CONTEXT.params)
 
     def _timestamp():
         return f"{dt.now().strftime('%H:%M:%S')}>"
@@ -43,9 +44,9 @@ if __name__ == '__main__':
     def _on_io(s: str, log: list, is_child: bool):
         if s.endswith('\n'): s = s[:-1]
         line = f'{_timestamp()} {s}'
-        if not is_child: log.append(line)
-        with open(realtime_log, 'a') as f:
-            if not is_child: f.write(line+NEWLINE)
+        if not is_child: # local.py keeps its own log on the node
+            log.append(line)
+            sink.Write(line)
 
     def _shell(cmd: str, is_child: bool):
         cmd = " ".join([tok for tok in cmd.split(" ") if tok != ""])
@@ -115,6 +116,7 @@ if __name__ == '__main__':
             break
     _shell(f"ls -lh {HPC_REF}", is_child=False)
     CONTEXT.params.reference_folder = HPC_REF
+    CONTEXT.params.log_rotate_mb = 0 # local.py's log on the node isn't copied back, rotated parts of it would be lost the same way
     CONTEXT.ref = HPC_LIB
     CONTEXT.Save(HPC_WS)
 
@@ -163,6 +165,7 @@ if __name__ == '__main__':
         else:
             return {}
 
+    sink.Close()
     # todo: consolidate shell def with local
     # todo: get exectutor cmd,out,err and use with local
     res = _get_result_json()
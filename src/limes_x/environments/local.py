@@ -1,20 +1,35 @@
 import sys, os
 from pathlib import Path
 import json
+import time
+import resource
 from datetime import datetime as dt
 
-if __name__ == '__main__':
-    SRC = os.path.abspath(Path(__file__).joinpath('../../..'))
-    sys.path = list(set([SRC]+sys.path))
-    from _setup import ParseArgs
-    e = ParseArgs()
-    MODULE_PATH, WORKSPACE, RELATIVE_OUTPUT_PATH, CONTEXT, THIS_MODULE, VERBOSE = e.module_path, e.workspace, e.relative_output_path, e.context, e.module, e.verbose
+def _usage():
+    # cpu seconds and max rss in MB of this process and its finished children
+    usage = [resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)]
+    return sum(u.ru_utime+u.ru_stime for u in usage), max(u.ru_maxrss for u in usage)/1024 # KB on linux
+
+def _open_log(path: Path, params):
+    # one handle for every line of the job's tools, see Params for the settings
+    from limes_x.common.log_sink import LogSink
+    return LogSink(
+        path, flush_sec=params.log_flush_sec,
+        rotate_bytes=int(params.log_rotate_mb*2**20), compress=params.log_compress,
+    )
+
+def RunJob(module, workspace: Path, relative_output_path: Path, context, verbose: bool, send=None):
+    """runs one job's procedure in this process, writes its result.json and returns it as a dict, the working directory must be [workspace]
+    - jobs of a batch each get their own call, cpu time is only exact for jobs that didn't run at the same time as others
+    - [send] is given the output path and the result before result.json is written, which is then only kept for the record
+    """
     from limes_x.common.utils import LiveShell
     from limes_x.execution.modules import JobResult
 
     cmd_history = []
     err_log, out_log = [], []
-    realtime_log = WORKSPACE.joinpath(RELATIVE_OUTPUT_PATH).joinpath('realtime.log')
+    realtime_log = workspace.joinpath(relative_output_path).joinpath('realtime.log')
+    sink = _open_log(realtime_log, context.params)
     def _on_io(s: str, log: list):
         timestamp = f"{dt.now().strftime('%H:%M:%S')}>"
         if s.endswith('\n'): s = s[:-1]
@@ -23,9 +38,8 @@ if __name__ == '__main__':
             log.append(line)
         else:
             line = line[:-1]
-        with open(realtime_log, 'a') as f:
-            f.write(line+'\n')
-        if VERBOSE: print(line)
+        sink.Write(line)
+        if verbose: print(line)
     def _shell(cmd: str):
         lines = cmd.split('\n')
         code = 0
@@ -43,18 +57,18 @@ if __name__ == '__main__':
         )
         return code
 
-    CONTEXT.shell = _shell
-    CONTEXT.output_folder = RELATIVE_OUTPUT_PATH
+    context.shell = _shell
+    context.output_folder = relative_output_path
 
-    os.chdir(WORKSPACE)
     # monitor = ResourceMonitor(relative_output_path)
     result = None
     err = ""
+    start = time.time()
+    cpu_start, _ = _usage()
     try:
-        sys.path = list(set([str(CONTEXT.params.reference_folder)] + sys.path))
-        result = THIS_MODULE._procedure(CONTEXT)
+        result = module._procedure(context)
     except Exception as e:
-        err = str(e)
+        err = f"{type(e).__name__}: {e}" # so retry policies can match on the error's class
     finally:
         # res_log = monitor.Stop()
         if result is None:
@@ -63,14 +77,18 @@ if __name__ == '__main__':
             result.error_message = err
     # result.resource_log = res_log
     result.resource_log = []
+    cpu_end, max_rss = _usage()
+    result.wall_sec = time.time()-start
+    result.cpu_sec = cpu_end-cpu_start
+    result.max_rss_mb = max_rss
     result.commands = cmd_history
     result.out_log = out_log
     result.err_log = err_log
 
     def _rectify_if_path(v):
         if isinstance(v, Path) and os.path.isabs(v):
-            if v.is_relative_to(WORKSPACE):
-                return Path(os.path.abspath(v)).relative_to(WORKSPACE)
+            if v.is_relative_to(workspace):
+                return Path(os.path.abspath(v)).relative_to(workspace)
             else:
                 _shell(f'echo " ! warning: output path isn\'t relative: {v}"')
                 return v
@@ -100,7 +118,49 @@ if __name__ == '__main__':
     else:
         result.error_message = f'no manifest'
 
-    result_path = RELATIVE_OUTPUT_PATH.joinpath('result.json')
+    sink.Close()
+    result.exit_code = 0 if result.error_message is None else 1
+    result_path = relative_output_path.joinpath('result.json')
+    d = result.ToDict()
+    if send is not None: send(relative_output_path, d)
     with open(result_path, 'w') as j:
-        d = result.ToDict()
         json.dump(d, j, indent=4)
+    if send is not None and result.manifest is not None and os.path.exists(realtime_log):
+        os.remove(realtime_log) # as the executor would after reading result.json
+    return d
+
+def _result_sender():
+    # results go back over the pipe the executor passed on, if it did, see ResultPipe
+    fd = os.environ.pop("LIMES_X_RESULT_FD", None) # not for the job's own commands
+    if fd is None: return None
+    from threading import Lock
+    pipe = os.fdopen(int(fd), 'w')
+    lock = Lock()
+    def _send(relative_output_path: Path, d: dict):
+        line = json.dumps([str(relative_output_path), d])
+        with lock:
+            pipe.write(line+'\n')
+            pipe.flush()
+    return _send
+
+if __name__ == '__main__':
+    SRC = os.path.abspath(Path(__file__).joinpath('../../..'))
+    sys.path = list(set([SRC]+sys.path))
+    from _setup import ParseArgs
+    e = ParseArgs()
+    WORKSPACE, THIS_MODULE, VERBOSE = e.workspace, e.module, e.verbose
+
+    os.chdir(WORKSPACE)
+    # modules are imported from the reference folder, which is the same for every job of a run
+    sys.path = list(set([str(e.context.params.reference_folder)] + sys.path))
+    jobs = list(zip(e.relative_output_paths, e.contexts))
+    send = _result_sender()
+    parallel = min(len(jobs), THIS_MODULE.batch_parallel)
+    if parallel <= 1:
+        for relative_output_path, context in jobs:
+            RunJob(THIS_MODULE, WORKSPACE, relative_output_path, context, VERBOSE, send)
+    else:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=parallel) as pool:
+            for f in [pool.submit(RunJob, THIS_MODULE, WORKSPACE, p, c, VERBOSE, send) for p, c in jobs]:
+                f.result()
@@ -0,0 +1,54 @@
+import sys, os
+import importlib.util
+from pathlib import Path
+from multiprocessing.connection import Connection
+
+# a long lived process of a WorkerPool, runs jobs one after the other as local.py would
+
+def _load_module(location: Path):
+    # each module's definition.py gets its own name, so that loading another module
+    # can't replace the globals its procedure uses, as reloading a shared "definition" would
+    from limes_x.execution.modules import ComputeModule
+    lib = location.joinpath(ComputeModule.LIB_FOLDER)
+    name = f"limes_x_definition_{abs(hash(str(location)))}"
+    spec = importlib.util.spec_from_file_location(name, lib.joinpath(ComputeModule.DEFINITION_FILE_NAME))
+    assert spec is not None and spec.loader is not None, f"module at [{location}] appears to be corrupted"
+    mo = importlib.util.module_from_spec(spec)
+    sys.modules[name] = mo
+    original_path = sys.path
+    sys.path = [str(lib)]+sys.path
+    try:
+        spec.loader.exec_module(mo)
+    finally:
+        sys.path = original_path
+    module: ComputeModule = mo.MODULE
+    return module
+
+def _serve(conn_in: Connection, conn_out: Connection):
+    # a worker's loop: (module location, workspace, relative output path, reference folder) in, result as a dict out
+    from local import RunJob
+    from limes_x.execution.modules import JobContext, JobResult
+    modules = {}
+    while True:
+        try:
+            request = conn_in.recv()
+        except EOFError:
+            return
+        if request is None: return
+        location, workspace, relative_output_path, reference_folder = request
+        try:
+            module = modules.get(location)
+            if module is None:
+                module = _load_module(location)
+                modules[location] = module
+            os.chdir(workspace)
+            if reference_folder not in sys.path: sys.path.insert(0, reference_folder) # as local.py does
+            context = JobContext.LoadFromDisk(relative_output_path)
+            reply = RunJob(module, workspace, relative_output_path, context, verbose=False)
+        except Exception as e:
+            reply = JobResult(error_message=f"{type(e).__name__}: {e}", exit_code=1).ToDict()
+        conn_out.send(reply)
+
+if __name__ == '__main__':
+    sys.path = [os.path.dirname(os.path.abspath(__file__))]+sys.path # for local.py
+    _serve(Connection(int(sys.argv[1]), writable=False), Connection(int(sys.argv[2]), readable=False))
@@ -3,26 +3,38 @@ import os, sys
 import time
 import json
 from pathlib import Path
-from typing import Callable, Iterable
+from typing import Any, Awaitable, Callable, Iterable
+import re
 import inspect
-from threading import Condition
+import asyncio
+from threading import Condition, Thread, Lock
 
 from .modules import ComputeModule, JobContext, JobResult, Params, Item
 from .instances import JobInstance
 from .comms import FileSyncedDictionary, CommsObject
-from ..common.utils import LiveShell, Timestamp, CurrentTimeMillis
+from .workers import WorkerPool
+from .watcher import ResultWatcher
+from ..common.utils import LiveShell, LiveShellAsync, Timestamp, CurrentTimeMillis
 
 class Job:
     instance: JobInstance
     context: JobContext
     run_command: str
     workspace: Path
+    started: float
+    accounting: dict[str, Any]|None # set by procedures that know it, see JobResult
+    submission_limit: TokenBucket|None # given by executors that submit to a cluster's scheduler, see HpcExecutor
     _verbose: bool
+    _results: ResultPipe|None
 
     def __init__(self, instance: JobInstance, workspace: Path, params: Params, _save=True) -> None:
         self.instance = instance
         self.workspace = workspace
+        self.started = time.time()
+        self.accounting = None
+        self.submission_limit = None
         self._verbose = True
+        self._results = None
 
         c = JobContext()
         c.job_id = self.instance.GetID()
@@ -35,19 +47,151 @@ class Job:
     def SaveContext(self):
         self.context.Save(self.workspace)
 
+    def _pass_fds(self):
+        return () if self._results is None else (self._results.write_fd,)
+
     def Shell(self, cmd: str):
         err_log = []
         pr = lambda s: print(s, end="")
-        code=LiveShell(cmd, echo_cmd=False, onErr=lambda s: err_log.append(s), onOut=pr if self._verbose else lambda s: None)
+        code=LiveShell(cmd, echo_cmd=False, onErr=lambda s: err_log.append(s), onOut=pr if self._verbose else lambda s: None, pass_fds=self._pass_fds())
+        return code==0, "".join(err_log)
+
+    async def ShellAsync(self, cmd: str):
+        err_log = []
+        pr = lambda s: print(s, end="")
+        code = await LiveShellAsync(cmd, echo_cmd=False, onErr=lambda s: err_log.append(s), onOut=pr if self._verbose else lambda s: None, pass_fds=self._pass_fds())
         return code==0, "".join(err_log)
 
+class ResultPipe:
+    """carries results from local.py straight back, over a pipe its process inherits, instead of through result.json
+    - local.py sends a json line of [output folder, result] for each job, before it writes result.json
+    - read while the job runs, by a thread with Start or the event loop with StartAsync, so a large result can't fill the pipe
+    - Finish, once the job's process is done, gives the results by output folder
+    """
+    ENV_VAR = "LIMES_X_RESULT_FD"
+    def __init__(self) -> None:
+        self.read_fd, self.write_fd = os.pipe()
+        self._data = bytearray()
+        self._thread: Thread|None = None
+        self._eof: asyncio.Future|None = None
+
+    def _read(self):
+        # False at the end
+        chunk = os.read(self.read_fd, 1<<16)
+        self._data += chunk
+        return len(chunk) > 0
+
+    def Start(self):
+        def _drain():
+            while self._read(): pass
+        self._thread = Thread(target=_drain, daemon=True)
+        self._thread.start()
+
+    def StartAsync(self):
+        loop = asyncio.get_running_loop()
+        eof = loop.create_future()
+        os.set_blocking(self.read_fd, False)
+        def _on_readable():
+            try:
+                if self._read(): return
+            except BlockingIOError:
+                return
+            loop.remove_reader(self.read_fd)
+            if not eof.done(): eof.set_result(None)
+        loop.add_reader(self.read_fd, _on_readable)
+        self._eof = eof
+
+    def _close_writer(self):
+        # the job's process has its own copy, the pipe ends once that one is closed too
+        if self.write_fd >= 0: os.close(self.write_fd)
+        self.write_fd = -1
+
+    def _results(self) -> dict[str, dict]:
+        os.close(self.read_fd)
+        results = {}
+        for line in bytes(self._data).splitlines():
+            try:
+                folder, d = json.loads(line)
+            except ValueError:
+                continue # cut short
+            results[folder] = d
+        return results
+
+    def Finish(self):
+        self._close_writer()
+        if self._thread is not None: self._thread.join()
+        return self._results()
+
+    async def FinishAsync(self):
+        self._close_writer()
+        if self._eof is not None: await self._eof
+        return self._results()
+
 ExecutionHandler = Callable[[Job], tuple[bool, str]]
+AsyncExecutionHandler = Callable[[Job], Awaitable[tuple[bool, str]]]
 SetupHandler = Callable[[list[ComputeModule], Path, Params], None]
+
+def _in_own_thread(procedure: ExecutionHandler) -> AsyncExecutionHandler:
+    # a blocking procedure gets its own thread, so it can't hold up the event loop or queue behind other jobs
+    async def _run(job: Job):
+        loop = asyncio.get_running_loop()
+        done: asyncio.Future[tuple[bool, str]] = loop.create_future()
+        def _target():
+            try:
+                r = procedure(job)
+                loop.call_soon_threadsafe(lambda: done.done() or done.set_result(r))
+            except BaseException as e:
+                loop.call_soon_threadsafe(lambda: done.done() or done.set_exception(e))
+        Thread(target=_target, daemon=True).start()
+        return await done
+    return _run
+
+def _input_bytes(job: JobInstance):
+    # total size of the job's input files, and of the files directly in its input folders, for the runtime history.
+    # Folders aren't walked, that would go through a whole reference database for each job that uses it
+    total = 0
+    def _size(p: Path):
+        nonlocal total
+        try:
+            if p.is_dir():
+                with os.scandir(p) as entries:
+                    for e in entries:
+                        if e.is_file(): total += e.stat().st_size
+            elif p.exists():
+                total += p.stat().st_size
+        except OSError:
+            pass
+    for v in job.inputs.values():
+        for ii in v if isinstance(v, list) else [v]:
+            if isinstance(ii.value, Path): _size(ii.value)
+    return total
+
 class Executor:
-    def __init__(self, execute_procedure: ExecutionHandler|None=None, prepare_procedure: SetupHandler|None=None) -> None:
+    """runs jobs, given to Workflow.Run
+    - [execute_procedure] runs a prepared job and blocks until it is done
+    - [async_execute_procedure] does the same as a coroutine, used by RunAsync;
+    if not given, the shell command is awaited or, for a custom [execute_procedure], it is run in its own thread
+    - for a batch of jobs, the procedures are given the first job, whose command runs them all
+    - with [workers], jobs run in that many long lived python processes instead of a new one each, see WorkerPool,
+    the procedures aren't used and jobs aren't batched since there is no process start to share
+    - without custom procedures, results come back over a ResultPipe rather than being read from result.json,
+    unless pipe_results is turned off
+    """
+    CAN_BATCH = True
+    def __init__(self, execute_procedure: ExecutionHandler|None=None, prepare_procedure: SetupHandler|None=None,
+        async_execute_procedure: AsyncExecutionHandler|None=None, workers: int=0) -> None:
+        default_procedures = execute_procedure is None and async_execute_procedure is None
+        assert workers == 0 or default_procedures, "workers run jobs without procedures"
+        self._pool = WorkerPool(workers) if workers > 0 else None
+        self.result_watcher = ResultWatcher()
+        if self._pool is not None: self.CAN_BATCH = False
         self._execute_procedure: ExecutionHandler = execute_procedure if execute_procedure is not None else lambda j: j.Shell(j.run_command)
+        if async_execute_procedure is None:
+            async_execute_procedure = (lambda j: j.ShellAsync(j.run_command)) if execute_procedure is None else _in_own_thread(execute_procedure)
+        self._async_execute_procedure: AsyncExecutionHandler = async_execute_procedure
         self._prepare_run = (lambda x, y, z: None) if prepare_procedure is None else prepare_procedure
         self._sync = Condition()
+        self.pipe_results = default_procedures # the shell passes the pipe on
 
     # currently not used
     def PrepareRun(self, modules: list[ComputeModule], inputs_folder: Path, params: Params):
@@ -76,50 +220,154 @@ class Executor:
         if _save: job.context.Save(workspace=workspace)
         return job
 
-    def Run(self, instance: JobInstance, workspace: Path, params: Params) -> JobResult:
-        job = self._make_job(instance, workspace, params)
-
+    def _local_command(self, jobs: list[Job], workspace: Path):
+        # local.py runs every job given in the same process
         from ..environments import local
         entry_point = Path(os.path.abspath(inspect.getfile(local)))
         args = [
-            entry_point, job.instance.step.location, workspace, job.context.output_folder, False,
+            entry_point, jobs[0].instance.step.location, workspace, *[j.context.output_folder for j in jobs], False,
         ]
-        job.run_command = f"""\
+        results = jobs[0]._results
+        pipe = "" if results is None else f"{ResultPipe.ENV_VAR}={results.write_fd} "
+        return f"""\
             PYTHONPATH={':'.join(os.path.abspath(p) for p in sys.path)}
-            python {" ".join(f'"{a}"' for a in args)}
+            {pipe}python {" ".join(f'"{a}"' for a in args)}
         """[:-1].replace("  ", "")
+
+    def _prepare_job(self, instance: JobInstance, workspace: Path, params: Params):
+        job = self._make_job(instance, workspace, params)
+        if self.pipe_results and self._pool is None: job._results = ResultPipe()
+        job.run_command = self._local_command([job], workspace)
+        return job
+
+    def _prepare_batch(self, instances: list[JobInstance], workspace: Path, params: Params):
+        # the first job runs the command for all of them
+        jobs = [self._make_job(i, workspace, params) for i in instances]
+        if self.pipe_results: jobs[0]._results = ResultPipe()
+        jobs[0].run_command = self._local_command(jobs, workspace)
+        return jobs
+
+    def _execute(self, job: Job) -> tuple[bool, str, dict[str, dict]]:
+        # the procedure, and the results that came back over the job's pipe, by output folder
+        pipe = job._results
+        if pipe is None: return (*self._execute_procedure(job), {})
+        pipe.Start()
+        try:
+            success, msg = self._execute_procedure(job)
+        finally:
+            piped = pipe.Finish()
+        return success, msg, piped
+
+    async def _execute_async(self, job: Job) -> tuple[bool, str, dict[str, dict]]:
+        pipe = job._results
+        if pipe is None: return (*await self._async_execute_procedure(job), {})
+        pipe.StartAsync()
+        try:
+            success, msg = await self._async_execute_procedure(job)
+        finally:
+            piped = await pipe.FinishAsync()
+        return success, msg, piped
+
+    def Close(self):
+        """stops the worker processes, if any"""
+        if self._pool is not None: self._pool.Close()
+
+    def _run_in_worker(self, job: Job):
+        assert self._pool is not None
+        c = job.context
+        d = self._pool.Run(job.instance.step.location, job.workspace, c.output_folder, c.params.reference_folder)
+        return self._compile_result(job, True, "", _result=d)
+
+    def Run(self, instance: JobInstance, workspace: Path, params: Params) -> JobResult:
+        job = self._prepare_job(instance, workspace, params)
+        if self._pool is not None: return self._run_in_worker(job)
         # self._print_start(job)
-        success, msg = self._execute_procedure(job)
+        success, msg, piped = self._execute(job)
+
+        return self._compile_result(job, success, msg, _result=piped.get(str(job.context.output_folder)), _piped=True)
+
+    async def RunAsync(self, instance: JobInstance, workspace: Path, params: Params) -> JobResult:
+        """Run as a coroutine, for runners that keep many jobs in flight on one event loop"""
+        job = self._prepare_job(instance, workspace, params)
+        if self._pool is not None: return await asyncio.to_thread(self._run_in_worker, job)
+        success, msg, piped = await self._execute_async(job)
+        d = piped.get(str(job.context.output_folder))
+        if success and d is None: await self._wait_for_result_async(job.context, job.instance)
+        return self._compile_result(job, success, msg, _wait=False, _result=d, _piped=True)
+
+    def RunBatch(self, instances: list[JobInstance], workspace: Path, params: Params) -> list[JobResult]:
+        """Run for jobs of the same module, started by one process, see ModuleBuilder.BatchJobs"""
+        if len(instances) == 1: return [self.Run(instances[0], workspace, params)]
+        jobs = self._prepare_batch(instances, workspace, params)
+        success, msg, piped = self._execute(jobs[0])
+        results = []
+        for j in jobs:
+            d = piped.get(str(j.context.output_folder))
+            results.append(self._compile_result(j, self._batch_member_ok(j, success, d), msg, _wait=success, _result=d, _piped=True))
+        return results
 
-        return self._compile_result(job, success, msg)
+    async def RunBatchAsync(self, instances: list[JobInstance], workspace: Path, params: Params) -> list[JobResult]:
+        """RunBatch as a coroutine"""
+        if len(instances) == 1: return [await self.RunAsync(instances[0], workspace, params)]
+        jobs = self._prepare_batch(instances, workspace, params)
+        success, msg, piped = await self._execute_async(jobs[0])
+        results = []
+        for j in jobs:
+            d = piped.get(str(j.context.output_folder))
+            if success and d is None: await self._wait_for_result_async(j.context, j.instance)
+            results.append(self._compile_result(j, self._batch_member_ok(j, success, d), msg, _wait=False, _result=d, _piped=True))
+        return results
 
-    def _compile_result(self, job: Job, success: bool, msg: str):
+    def _batch_member_ok(self, job: Job, success: bool, piped: dict|None):
+        # a batch that failed part way still has the results of the jobs it got through,
+        # only those without one fail with the batch's message
+        return success or piped is not None or job.context.output_folder.joinpath('result.json').exists()
+
+    def _compile_result(self, job: Job, success: bool, msg: str, _wait: bool=True, _result: dict|None=None, _piped: bool=False):
         if not success:
-            return self._make_failed_result(job.instance, msg)
+            r = self._make_failed_result(job.instance, msg)
+        elif _result is not None: # sent back by a worker or over a pipe, local.py removes realtime.log of the latter itself
+            r = self._checked_result(_result, job.context, job.instance, remove_log=not _piped)
         else:
-            return self._get_result(job.context, job.instance)
+            r = self._get_result(job.context, job.instance, _wait=_wait)
+        # measurements from local.py are kept, they don't include time spent queued
+        a = job.accounting
+        if a is not None:
+            r.accounting = a
+            if r.wall_sec is None: r.wall_sec = a.get("elapsed_sec")
+            if r.cpu_sec is None: r.cpu_sec = a.get("cpu_sec")
+            if r.max_rss_mb is None: r.max_rss_mb = a.get("max_rss_mb")
+            if r.exit_code is None: r.exit_code = a.get("exit_code")
+        if r.wall_sec is None: r.wall_sec = time.time()-job.started
+        if r.exit_code is None: r.exit_code = 0 if r.error_message is None else 1
+        r.input_bytes = _input_bytes(job.instance)
+        return r
+
+    def _report_wait(self, latency: float|None, context: JobContext, job: JobInstance):
+        w = context.params.file_system_wait_sec
+        if latency is None and w > 0:
+            print(f"result of {job.step.name}:{job.GetID()} didn't show within {w} sec.")
+        elif latency is not None and latency >= 1:
+            print(f"result of {job.step.name}:{job.GetID()} took {latency:.1f} sec. to show")
+
+    def _wait_for_result(self, context: JobContext, job: JobInstance):
+        # gives a shared file system up to file_system_wait_sec to show result.json
+        latency = self.result_watcher.Wait(context.output_folder.joinpath('result.json'), context.params.file_system_wait_sec)
+        self._report_wait(latency, context, job)
+
+    async def _wait_for_result_async(self, context: JobContext, job: JobInstance):
+        latency = await self.result_watcher.WaitAsync(context.output_folder.joinpath('result.json'), context.params.file_system_wait_sec)
+        self._report_wait(latency, context, job)
 
-    def _get_result(self, context: JobContext, job: JobInstance) -> JobResult:
+    def _get_result(self, context: JobContext, job: JobInstance, _wait: bool=True) -> JobResult:
         result_json = context.output_folder.joinpath('result.json')
-        if not os.path.exists(result_json):
-            w = context.params.file_system_wait_sec
-            if w > 0:
-                print(f"waiting {w} sec. for {job.step.name}:{job.GetID()}")
-                time.sleep(w)
+        if _wait: self._wait_for_result(context, job)
 
         if os.path.exists(result_json):
             err_msg = None
             try:
                 with open(result_json) as j:
-                    r = JobResult.FromDict(json.load(j))
-                    r.made_by = job.GetID()
-                    if r.manifest is None:
-                        r.error_message = f"no output created{'' if r.error_message is None else f', err: {r.error_message}'}"
-                        r.manifest = {}
-                    else:
-                        realtime_log = context.output_folder.joinpath("realtime.log")
-                        if os.path.exists(realtime_log): os.remove(realtime_log)
-                    return r
+                    return self._checked_result(json.load(j), context, job)
             except Exception as e:
                 err_msg = f'result manifest corrupted'
         else:
@@ -133,13 +381,124 @@ class Executor:
             r.error_message = err_msg
         return r
 
+    def _checked_result(self, d: dict, context: JobContext, job: JobInstance, remove_log: bool=True):
+        r = JobResult.FromDict(d)
+        r.made_by = job.GetID()
+        if r.manifest is None:
+            r.error_message = f"no output created{'' if r.error_message is None else f', err: {r.error_message}'}"
+            r.manifest = {}
+        elif remove_log:
+            realtime_log = context.output_folder.joinpath("realtime.log")
+            if os.path.exists(realtime_log): os.remove(realtime_log)
+        return r
+
     def _make_failed_result(self, job: JobInstance, msg: str):
         r = JobResult()
         r.made_by = job.GetID()
         r.error_message = f"executor failed:\n{msg}"
         return r
 
+class TokenBucket:
+    """keeps submissions, from any number of threads and coroutines, under [rate] per second with bursts of up to [burst]
+    - a submission that finds a token goes without waiting
+    - PushBack, for when the scheduler refuses a submission, halves the rate down to [min_rate] and holds all submissions
+    for [backoff_sec], doubling with each push back in a row up to [max_backoff_sec]
+    - each accepted submission after that raises the rate by a twentieth of [rate] until it is back to [rate]
+    - Submit and SubmitAsync do all of this around one call to the scheduler
+    """
+    # sbatch's complaints when the controller is too busy or the user has too many jobs queued
+    PUSH_BACK_PATTERN = r"submission failed|temporarily unavailable|timed out|try again|Unable to contact slurm controller|MaxSubmit|AssocGrpSubmitJobsLimit"
+
+    def __init__(self, rate: float=10, burst: int=20, min_rate: float=0.1, backoff_sec: float=5, max_backoff_sec: float=300) -> None:
+        self.push_back_pattern = self.PUSH_BACK_PATTERN
+        self.max_push_backs = 10
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.backoff_sec = backoff_sec
+        self.max_backoff_sec = max_backoff_sec
+        self.push_backs = 0
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._held_until = 0.0
+        self._in_a_row = 0
+        self._lock = Lock()
+
+    def _take(self) -> float:
+        # 0 if a token was taken, otherwise the seconds until one might be there
+        with self._lock:
+            now = time.monotonic()
+            if now < self._held_until: return self._held_until-now
+            self._tokens = min(self.burst, self._tokens+max(0, now-self._last)*self.rate)
+            self._last = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1-self._tokens)/self.rate
+
+    def Acquire(self) -> float:
+        """blocks until a submission may go, returns the seconds waited"""
+        waited = 0.0
+        while (wait := self._take()) > 0:
+            time.sleep(wait)
+            waited += wait
+        return waited
+
+    async def AcquireAsync(self) -> float:
+        waited = 0.0
+        while (wait := self._take()) > 0:
+            await asyncio.sleep(wait)
+            waited += wait
+        return waited
+
+    def PushBack(self):
+        with self._lock:
+            now = time.monotonic()
+            if now < self._held_until: return # submissions that were already on their way when the first was refused
+            self.push_backs += 1
+            self._in_a_row += 1
+            self.rate = max(self.min_rate, self.rate/2)
+            self._held_until = now+min(self.max_backoff_sec, self.backoff_sec*2**(self._in_a_row-1))
+            self._tokens = 0
+            self._last = self._held_until
+
+    def Accepted(self):
+        with self._lock:
+            self._in_a_row = 0
+            self.rate = min(self.max_rate, self.rate+self.max_rate/20)
+
+    def _pushed_back(self, accepted: bool, msg: str, tries: int):
+        if accepted:
+            self.Accepted()
+            return False
+        if tries > self.max_push_backs or re.search(self.push_back_pattern, msg, re.IGNORECASE) is None: return False
+        self.PushBack()
+        return True
+
+    def Submit(self, submit: Callable[[], tuple[bool, str]]) -> tuple[bool, str]:
+        """takes a token for each call of [submit], which asks the scheduler to queue something and returns
+        whether it was accepted and the scheduler's message
+        - a refusal matching the push_back_pattern attribute pushes back and is tried again, up to max_push_backs times
+        - [submit] should return as soon as the scheduler has answered, not when the job is done
+        """
+        tries = 0
+        while True:
+            tries += 1
+            self.Acquire()
+            accepted, msg = submit()
+            if not self._pushed_back(accepted, msg, tries): return accepted, msg
+
+    async def SubmitAsync(self, submit: Callable[[], Awaitable[tuple[bool, str]]]) -> tuple[bool, str]:
+        tries = 0
+        while True:
+            tries += 1
+            await self.AcquireAsync()
+            accepted, msg = await submit()
+            if not self._pushed_back(accepted, msg, tries): return accepted, msg
+
 class HpcExecutor(Executor):
+    CAN_BATCH = False # hpc.py stages the inputs of one job
     _EXT = 'tgz'
     _SRC_FOLDER_NAME = 'limesx_src'
     _NO_ZIP = ['tgz', 'tar.gz', 'sif']
@@ -149,7 +508,14 @@ class HpcExecutor(Executor):
         logistical_procedure: ExecutionHandler|None=None,
         prerun: Callable[[Path], None] | None = None,
         tmp_dir_name: str="TMP",
+        hpc_async_procedure: AsyncExecutionHandler|None=None,
+        submission_limit: TokenBucket|None=None,
     ) -> None:
+        """[hpc_procedure] submits a job to the cluster's scheduler and returns when it is done
+        - [submission_limit], a TokenBucket with its defaults if not given, is given to the procedures as
+        job.submission_limit. They submit through its Submit or SubmitAsync, or slurm.SubmitAndWait and SlurmPoller,
+        so that only the call to the scheduler takes a token and is tried again when pushed back, not the wait for the job
+        """
 
         def _prepare_run(modules: list[ComputeModule], inputs_dir: Path, params: Params):
             _shell = lambda cmd: LiveShell(cmd=cmd.replace('  ', ''), echo_cmd=False)
@@ -169,7 +535,9 @@ class HpcExecutor(Executor):
             
         super().__init__(execute_procedure=logistical_procedure, prepare_procedure=_prepare_run)
         self._hpc_procedure = hpc_procedure
+        self._hpc_async_procedure = hpc_async_procedure if hpc_async_procedure is not None else _in_own_thread(hpc_procedure)
         self._tmp_dir_name = tmp_dir_name
+        self.submission_limit = submission_limit if submission_limit is not None else TokenBucket()
         self.max_active_io_jobs: int = 5
         self.update_frequency: int|float = 5
         self._num_active_io: int = 0
@@ -197,7 +565,7 @@ class HpcExecutor(Executor):
             self._last_check = CurrentTimeMillis()
         return permission
 
-    def Run(self, instance: JobInstance, workspace: Path, params: Params) -> JobResult:
+    def _prepare_job(self, instance: JobInstance, workspace: Path, params: Params):
         job = self._make_job(instance, workspace, params, _override=True)
 
         from ..environments import hpc
@@ -210,7 +578,11 @@ class HpcExecutor(Executor):
             python {" ".join(f'"{a}"' for a in args)}\
         """.replace("  ", "")
         job._verbose = False # since non local
+        job.submission_limit = self.submission_limit
+        return job
 
+    def Run(self, instance: JobInstance, workspace: Path, params: Params) -> JobResult:
+        job = self._prepare_job(instance, workspace, params)
         success, msg = False, ""
         try:
             me = job.context.job_id
@@ -228,9 +600,35 @@ class HpcExecutor(Executor):
             success, msg = False, "force stopped"
             print(f"force stopped")
         finally:
-            with FileSyncedDictionary(workspace) as com:
-                com.RemoveIoTask(job.context.job_id)
+            self._release_io(workspace, job.context.job_id)
 
         result = self._compile_result(job, success, msg)
         return result
 
+    def _release_io(self, workspace: Path, key: str):
+        with FileSyncedDictionary(workspace) as com:
+            com.RemoveIoTask(key)
+
+    async def RunAsync(self, instance: JobInstance, workspace: Path, params: Params) -> JobResult:
+        # the io task list is a file locked database and preparing a job writes its folder,
+        # so these run in threads, a job waiting on the lock would otherwise hold up every job on the loop
+        job = await asyncio.to_thread(self._prepare_job, instance, workspace, params)
+        success, msg = False, ""
+        try:
+            me = job.context.job_id
+            if not await asyncio.to_thread(self._can_run, workspace, me, True):
+                while not await asyncio.to_thread(self._can_run, workspace, me):
+                    await asyncio.sleep(self.update_frequency)
+            success, msg = await self._hpc_async_procedure(job)
+        except Exception as e:
+            success, msg = False, str(e)
+            print(f"ERROR: in executor: {e}")
+            sys.stdout.flush()
+        except asyncio.CancelledError:
+            print(f"force stopped")
+            self._release_io(workspace, job.context.job_id) # the loop is stopping, a thread's result would never be awaited
+            raise
+        await asyncio.to_thread(self._release_io, workspace, job.context.job_id)
+
+        if success: await self._wait_for_result_async(job.context, job.instance)
+        return await asyncio.to_thread(self._compile_result, job, success, msg, False)
@@ -0,0 +1,106 @@
+from __future__ import annotations
+import time
+import math
+import sqlite3
+from pathlib import Path
+
+from .modules import JobResult
+from .state_store import _Connection
+
+class RuntimeHistory:
+    """runtime and resource use of finished jobs, kept across runs in an sqlite database
+    - one row per job: module, input size, wall and cpu time, max memory and exit code
+    - percentiles and a linear fit on input size, by module, for estimating the next run
+    """
+    FILE_NAME = 'limes_x_history.db'
+    FIELDS = ["wall_sec", "cpu_sec", "max_rss_mb"]
+
+    def __init__(self, path: str|Path) -> None:
+        self.path = Path(path)
+        with self._connect() as con:
+            con.executescript("""
+                create table if not exists jobs (
+                    module text not null, job_id text not null, finished real not null,
+                    input_bytes integer, wall_sec real, cpu_sec real, max_rss_mb real, exit_code integer
+                );
+                create index if not exists jobs_by_module on jobs(module);
+            """)
+
+    def _connect(self):
+        con = sqlite3.connect(self.path, timeout=600)
+        # a rollback journal rather than wal, which needs shared memory that network file systems don't have
+        con.execute("pragma journal_mode=delete")
+        con.execute("pragma synchronous=normal") # losing the last few rows in a crash is fine
+        return _Connection(con)
+
+    def Record(self, finished: list[tuple[str, JobResult]]):
+        """add (module name, result) of finished jobs"""
+        if len(finished) == 0: return
+        now = time.time()
+        with self._connect() as con:
+            con.executemany(
+                "insert into jobs (module, job_id, finished, input_bytes, wall_sec, cpu_sec, max_rss_mb, exit_code) values (?, ?, ?, ?, ?, ?, ?, ?)",
+                ((m, r.made_by, now, r.input_bytes, r.wall_sec, r.cpu_sec, r.max_rss_mb, r.exit_code) for m, r in finished),
+            )
+
+    def _values(self, module: str, field: str, successful_only: bool):
+        assert field in self.FIELDS, f"[{field}] isn't one of {self.FIELDS}"
+        ok = " and exit_code = 0" if successful_only else ""
+        with self._connect() as con:
+            return [v for v, in con.execute(f"select {field} from jobs where module = ? and {field} is not null{ok} order by {field}", (module,))]
+
+    def Modules(self) -> list[str]:
+        with self._connect() as con:
+            return [m for m, in con.execute("select distinct module from jobs order by module")]
+
+    def Count(self, module: str) -> int:
+        with self._connect() as con:
+            return con.execute("select count(*) from jobs where module = ?", (module,)).fetchone()[0]
+
+    def FailureRate(self, module: str) -> float|None:
+        with self._connect() as con:
+            n, failed = con.execute("select count(*), sum(exit_code != 0) from jobs where module = ? and exit_code is not null", (module,)).fetchone()
+        return None if n == 0 else failed/n
+
+    def Percentiles(self, module: str, field: str="wall_sec", percentiles: list[float]=[50, 90, 99], successful_only: bool=True) -> dict[float, float]|None:
+        """nearest rank percentiles of [field] for the module's jobs, None if there are none"""
+        values = self._values(module, field, successful_only)
+        if len(values) == 0: return None
+        # the smallest value with at least p% of values at or below it, p*n before /100 so it isn't rounded up past an integer
+        return dict((p, values[min(len(values)-1, max(0, math.ceil(p*len(values)/100)-1))]) for p in percentiles)
+
+    def Regression(self, module: str, field: str="wall_sec", successful_only: bool=True) -> tuple[float, float, int]|None:
+        """least squares fit of [field] against input bytes as (per byte, intercept, number of jobs)
+        - None with fewer than 2 jobs or if all had the same input size
+        """
+        assert field in self.FIELDS, f"[{field}] isn't one of {self.FIELDS}"
+        ok = " and exit_code = 0" if successful_only else ""
+        with self._connect() as con:
+            n, sx, sy, sxx, sxy = con.execute(f"""
+                select count(*), sum(input_bytes), sum({field}), sum(1.0*input_bytes*input_bytes), sum(1.0*input_bytes*{field})
+                from jobs where module = ? and input_bytes is not null and {field} is not null{ok}
+            """, (module,)).fetchone()
+        if n < 2: return None
+        denominator = n*sxx - sx*sx
+        if denominator == 0: return None
+        slope = (n*sxy - sx*sy)/denominator
+        return slope, (sy - slope*sx)/n, n
+
+    def Estimate(self, module: str, field: str="wall_sec", input_bytes: int|None=None, percentile: float=50) -> float|None:
+        """expected [field] for a job of the module, from the fit on input size if possible, otherwise a percentile"""
+        if input_bytes is not None:
+            fit = self.Regression(module, field)
+            if fit is not None:
+                slope, intercept, _ = fit
+                estimate = slope*input_bytes + intercept
+                if estimate > 0: return estimate
+        ps = self.Percentiles(module, field, [percentile])
+        return None if ps is None else ps[percentile]
+
+    def RuntimeEstimates(self, percentile: float=50) -> dict[str, float]:
+        """wall time in seconds by module name, for modules with history"""
+        estimates = {}
+        for m in self.Modules():
+            e = self.Estimate(m, percentile=percentile)
+            if e is not None: estimates[m] = e
+        return estimates
@@ -1,34 +1,76 @@
 from __future__ import annotations
-from typing import Callable, Any
+from typing import Callable, Any, Iterable
 from pathlib import Path
+import sys
 
 from.modules import ComputeModule, Item
 
 class _with_hashable_id:
+    """ids are kept as integers and only formatted as hex when asked for, since most are never read"""
+    __slots__ = ["_id", "_id_width", "_handle"]
     __last_hash = 0
     def __init__(self, id: str) -> None:
-        self.__id = id
+        try:
+            self._id: int|str = int(id, 16)
+            self._id_width = len(id)
+        except ValueError:
+            self._id = id # not made by this library, kept as is
+            self._id_width = 0
         _with_hashable_id.__last_hash +=1
-        self.__hash_val = _with_hashable_id.__last_hash
+        self._handle = _with_hashable_id.__last_hash # unique within this process
 
     def __hash__(self) -> int:
-        return self.__hash_val
+        return self._handle
+
+    def GetID(self) -> str:
+        if self._id_width == 0: return str(self._id)
+        return f"{self._id:0{self._id_width}x}"
+
+class JobSignature:
+    """a module and the instances given to it as inputs, used to find duplicate jobs
+    - input instances are kept as their integer handles, sorted, so order doesn't matter
+    - only valid within this process, rebuilt from input ids when a state is loaded
+    """
+    __slots__ = ["module", "inputs", "_hash"]
+    _module_ids: dict[str, int] = {}
+
+    def __init__(self, module_name: str, inputs: Iterable[ItemInstance|list[ItemInstance]]) -> None:
+        module = JobSignature._module_ids.get(module_name)
+        if module is None:
+            module = len(JobSignature._module_ids)
+            JobSignature._module_ids[module_name] = module
+        handles: list[int] = []
+        for g in inputs:
+            if isinstance(g, list):
+                handles += [ii._handle for ii in g]
+            else:
+                handles.append(g._handle)
+        handles.sort()
+        self.module = module
+        self.inputs = tuple(handles)
+        self._hash = hash((module, self.inputs))
+
+    def __hash__(self) -> int:
+        return self._hash
 
-    def GetID(self):
-        return self.__id
+    def __eq__(self, __o: object) -> bool:
+        if not isinstance(__o, JobSignature): return False
+        return self._hash == __o._hash and self.module == __o.module and self.inputs == __o.inputs
+
+    def __repr__(self) -> str:
+        return f"<sig: {self.module}:{len(self.inputs)}>"
 
 class JobInstance(_with_hashable_id):
-    __ID_LENGTH = 6
+    __slots__ = ["step", "inputs", "outputs", "complete", "attempts"]
+    ID_WIDTH = 8 # 6 before ids were counted
     def __init__(self, id_gen: Callable[[int], str], step: ComputeModule,
         inputs: dict[str, ItemInstance|list[ItemInstance]]) -> None:
-        super().__init__(id_gen(JobInstance.__ID_LENGTH))
+        super().__init__(id_gen(JobInstance.ID_WIDTH))
         self.step = step
         self.inputs = inputs
-        self._input_instances = self._flatten_values(self.inputs)
-
         self.outputs: dict[str, ItemInstance|list[ItemInstance]]|None = None
-        self._output_instances: list[ItemInstance]|None = None
         self.complete = False
+        self.attempts: list[dict]|None = None # failed attempts, see WorkflowState.RegisterJobFailed
 
     def __repr__(self) -> str:
         return f"<ji: {self.step.name}>"
@@ -43,20 +85,20 @@ class JobInstance(_with_hashable_id):
         return insts
 
     def ListInputInstances(self):
-        return self._input_instances
+        # flattened when asked for rather than stored, jobs rarely have more than a few inputs
+        return self._flatten_values(self.inputs)
 
     def Invalidate(self):
         self.outputs = None
-        self._output_instances = None
         self.complete = False
 
     def MarkAsComplete(self, outs: dict[str, ItemInstance|list[ItemInstance]]):
-        self.outputs = dict((i, v) for i, v in outs.items())
-        self._output_instances = self._flatten_values(outs)
+        self.outputs = outs
         self.complete = True
 
     def ListOutputInstances(self):
-        return self._output_instances
+        if self.outputs is None: return None
+        return self._flatten_values(self.outputs)
 
     def GetFolderName(self):
         return f"{self.step.name}--{self.GetID()}"
@@ -71,6 +113,8 @@ class JobInstance(_with_hashable_id):
         }
         if self.outputs is not None:
             self_dict["outputs"] = _dictify(self.outputs)
+        if self.attempts is not None:
+            self_dict["attempts"] = self.attempts
         return self_dict
 
     @classmethod
@@ -94,19 +138,22 @@ class JobInstance(_with_hashable_id):
         inputs = _load(data["inputs"])
         if inputs is None: return None
         inst = JobInstance(get_id, step, inputs)
-        raw_outs = data.get("outputs")
-        if raw_outs is not None:
-            inst.outputs = _load(raw_outs)
-        inst.complete = data["complete"]
+        inst.complete = data["complete"] # outputs are made by this job, so they are linked with MarkAsComplete once loaded
+        inst.attempts = data.get("attempts")
         return inst
 
 class ItemInstance(_with_hashable_id):
+    __slots__ = ["item_name", "value", "made_by"]
+    ID_WIDTH = 10 # 12 before ids were counted
     def __init__(self, id_gen: Callable[[int], str], item:Item, value: str|Path, made_by: JobInstance|ItemInstance|None=None) -> None:
-        super().__init__(id_gen(12))
-        self.item_name = item.key
+        super().__init__(id_gen(ItemInstance.ID_WIDTH))
+        self.item_name = sys.intern(item.key) # one copy of each name, however many instances
         self.value = value
-        self.type = type(value)
         self.made_by = made_by
+
+    @property
+    def type(self):
+        return type(self.value)
     
     def __repr__(self) -> str:
         return f"<ii: {self.item_name}:{self.GetID()}>"
@@ -5,6 +5,8 @@ import shutil
 import importlib
 from typing import Callable, Iterable, Any, Literal
 import json
+import re
+import random
 
 from limes_x.common.utils import LiveShell
 
@@ -41,11 +43,18 @@ class Params:
         threads: int=4,
         mem_gb: int=8,
         reference_folder: Path=Path(''),
+        log_flush_sec: float=1,
+        log_rotate_mb: int=0,
+        log_compress: bool=False,
     ) -> None:
+        """the log_ params are for each job's realtime.log, see LogSink, rotation is off with 0"""
         self.file_system_wait_sec = file_system_wait_sec
         self.threads = threads
         self.mem_gb = mem_gb
         self.reference_folder = reference_folder
+        self.log_flush_sec = log_flush_sec
+        self.log_rotate_mb = log_rotate_mb
+        self.log_compress = log_compress
 
     def Copy(self):
         cp = Params(**self.__dict__)
@@ -62,6 +71,9 @@ class Params:
                 'reference_folder': lambda: Path(val),
                 'threads': lambda: int(val),
                 'mem_gb': lambda: int(val), 
+                'log_flush_sec': lambda: float(val),
+                'log_rotate_mb': lambda: int(val),
+                'log_compress': lambda: val == "True",
             }.get(k, lambda: val)()
             setattr(p, k, val)
         return p
@@ -157,6 +169,13 @@ class JobResult(AutoPopulate):
     resource_log: list[str]
     err_log: list[str]
     out_log: list[str]
+    # measured for the runtime history, None if unknown
+    exit_code: int|None
+    input_bytes: int|None
+    wall_sec: float|None
+    cpu_sec: float|None
+    max_rss_mb: float|None
+    accounting: dict[str, Any]|None # from the cluster's scheduler, if it was asked
 
     def __init__(self, **kwargs) -> None:
         super().__init__(**kwargs)
@@ -191,6 +210,42 @@ def LoadComputeModules(folder: Path|str):
     folder = Path(folder)
     return ComputeModule.LoadSet(folder)
 
+class RetryPolicy:
+    """when and how often failed jobs of a module are run again within the same Workflow.Run
+    - [max_attempts] includes the first
+    - the first retry waits [backoff_sec], each one after waits [backoff_factor] times longer, up to [max_backoff_sec],
+    give or take [jitter] as a fraction so that jobs failing together don't all come back at once
+    - only failures with an error message matching one of the regular expressions in [on_errors]
+    or with an exit code in [on_exit_codes] are retried, or any failure if neither is given.
+    Errors raised by a module's procedure start with the exception's class name, ex. "TimeoutError: ..."
+    """
+    def __init__(self, max_attempts: int=3, backoff_sec: float=30, backoff_factor: float=2, max_backoff_sec: float=600,
+        on_errors: list[str]=list(), on_exit_codes: list[int]=list(), jitter: float=0.1) -> None:
+        assert max_attempts >= 1
+        self.max_attempts = max_attempts
+        self.backoff_sec = backoff_sec
+        self.backoff_factor = backoff_factor
+        self.max_backoff_sec = max_backoff_sec
+        self.on_errors = [re.compile(e) for e in on_errors]
+        self.on_exit_codes = set(on_exit_codes)
+        self.jitter = jitter
+
+    def __repr__(self) -> str:
+        return f"<retry: {self.max_attempts} attempts>"
+
+    def ShouldRetry(self, result: JobResult, attempts: int) -> bool:
+        """whether a job that failed with [result] after [attempts] attempts should run again"""
+        if attempts >= self.max_attempts: return False
+        if len(self.on_errors) == 0 and len(self.on_exit_codes) == 0: return True
+        if result.exit_code in self.on_exit_codes: return True
+        msg = "" if result.error_message is None else result.error_message
+        return any(e.search(msg) for e in self.on_errors)
+
+    def Delay(self, attempts: int) -> float:
+        """seconds to wait before running again after [attempts] failed attempts"""
+        d = min(self.backoff_sec*self.backoff_factor**(attempts-1), self.max_backoff_sec)
+        return max(0, d*(1+random.uniform(-self.jitter, self.jitter)))
+
 class ComputeModule(PrivateInit):
     DEFINITION_FILE_NAME = 'definition.py'
     LIB_FOLDER = 'lib'
@@ -206,6 +261,9 @@ class ComputeModule(PrivateInit):
         threads: int|None = None,
         memory_gb: int|None = None,
         requirements: set[str] = set(),
+        retry: RetryPolicy|None = None,
+        batch_size: int = 1,
+        batch_parallel: int = 1,
         **kwargs
     ) -> None:
 
@@ -222,6 +280,9 @@ class ComputeModule(PrivateInit):
         self.threads = threads
         self.memory_gb = memory_gb
         self.requirements = requirements
+        self.retry = retry
+        self.batch_size = batch_size
+        self.batch_parallel = batch_parallel
 
     def Setup(self, reference_folder: Path, install_type: str):
         snakefile = f"{self.location}/setup/setup.smk"
@@ -310,6 +371,9 @@ class ModuleBuilder(AutoPopulate):
     _threads: int
     _memory_gb: int
     _requirements: set[str]
+    _retry: RetryPolicy
+    _batch_size: int
+    _batch_parallel: int
 
     def __init__(self, **kwargs) -> None:
         super().__init__(**kwargs)
@@ -357,6 +421,18 @@ class ModuleBuilder(AutoPopulate):
         self._requirements.update(requirements)
         return self
 
+    def RetryOnFailure(self, policy: RetryPolicy=RetryPolicy()):
+        self._retry = policy
+        return self
+
+    def BatchJobs(self, max_jobs: int, parallel: int=1):
+        """for light modules, up to [max_jobs] ready jobs are run by one process, [parallel] at a time"""
+        assert max_jobs>0
+        assert parallel>0
+        self._batch_size = max_jobs
+        self._batch_parallel = parallel
+        return self
+
     def Build(self):
         assert len(self._outputs) > 0, f"module has no outputs and so is not useful"
         cm = ComputeModule(
@@ -370,6 +446,9 @@ class ModuleBuilder(AutoPopulate):
             threads=self._threads,
             memory_gb=self._memory_gb,
             requirements=self._requirements,
+            retry=self._retry,
+            batch_size=1 if self._batch_size is None else self._batch_size,
+            batch_parallel=1 if self._batch_parallel is None else self._batch_parallel,
         )
         return cm
 
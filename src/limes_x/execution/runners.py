@@ -0,0 +1,136 @@
+from __future__ import annotations
+import asyncio
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from threading import Thread
+from typing import Callable
+
+from .modules import JobResult, Params
+from .instances import JobInstance
+from .executors import Executor
+
+ResultHandler = Callable[[JobResult], None]
+class JobRunner(ABC):
+    """runs jobs given by Workflow.Run with its executor
+    - each result is given to [on_done], from whichever thread the job ran on
+    - a job that raises is reported as a failed result
+    """
+    def Start(self, executor: Executor, on_done: ResultHandler):
+        self._executor = executor
+        self._on_done = on_done
+
+    @abstractmethod
+    def Submit(self, job: JobInstance, workspace: Path, params: Params):
+        pass
+
+    def SubmitBatch(self, jobs: list[JobInstance], workspace: Path, params: Params):
+        """jobs of one module to run together with Executor.RunBatch, or each on its own if not overridden"""
+        for job in jobs: self.Submit(job, workspace, params)
+
+    def Stop(self):
+        """stop accepting jobs, jobs still running are abandoned"""
+        pass
+
+    def _failed(self, job: JobInstance, e: BaseException):
+        return JobResult(
+            exit_code = 1,
+            error_message = str(e),
+            made_by = job.GetID(),
+        )
+
+    def _run(self, job: JobInstance, workspace: Path, params: Params):
+        try:
+            result = self._executor.Run(job, workspace, params)
+        except Exception as e:
+            result = self._failed(job, e)
+        self._on_done(result)
+
+    def _run_batch(self, jobs: list[JobInstance], workspace: Path, params: Params):
+        try:
+            results = self._executor.RunBatch(jobs, workspace, params)
+        except Exception as e:
+            results = [self._failed(job, e) for job in jobs]
+        for result in results: self._on_done(result)
+
+class ThreadPerJobRunner(JobRunner):
+    """a new thread for each job, simple but each waiting job holds a thread"""
+    def Submit(self, job: JobInstance, workspace: Path, params: Params):
+        th = Thread(target=self._run, args=(job, workspace, params), daemon=True)
+        th.start()
+
+    def SubmitBatch(self, jobs: list[JobInstance], workspace: Path, params: Params):
+        th = Thread(target=self._run_batch, args=(jobs, workspace, params), daemon=True)
+        th.start()
+
+class ThreadPoolRunner(JobRunner):
+    """a fixed number of threads, jobs beyond that wait for a free thread"""
+    def __init__(self, workers: int=32) -> None:
+        self.workers = workers
+        self._pool: ThreadPoolExecutor|None = None
+
+    def Start(self, executor: Executor, on_done: ResultHandler):
+        super().Start(executor, on_done)
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="lx-job")
+
+    def Submit(self, job: JobInstance, workspace: Path, params: Params):
+        assert self._pool is not None, "runner not started"
+        self._pool.submit(self._run, job, workspace, params)
+
+    def SubmitBatch(self, jobs: list[JobInstance], workspace: Path, params: Params):
+        assert self._pool is not None, "runner not started"
+        self._pool.submit(self._run_batch, jobs, workspace, params)
+
+    def Stop(self):
+        if self._pool is None: return
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = None
+
+class AsyncioRunner(JobRunner):
+    """one event loop on one thread runs every job with Executor.RunAsync
+    - subprocesses and waits are awaited, so in-flight jobs don't each need a thread. Before python 3.12,
+    asyncio's default child watcher still waits on each running subprocess from a thread, it is left as is
+    since replacing it would affect every event loop in the process
+    """
+    def __init__(self) -> None:
+        self._loop: asyncio.AbstractEventLoop|None = None
+        self._thread: Thread|None = None
+
+    def Start(self, executor: Executor, on_done: ResultHandler):
+        super().Start(executor, on_done)
+        loop = asyncio.new_event_loop()
+        self._loop = loop
+        self._thread = Thread(target=loop.run_forever, daemon=True, name="lx-jobs")
+        self._thread.start()
+
+    async def _run_async(self, job: JobInstance, workspace: Path, params: Params):
+        try:
+            result = await self._executor.RunAsync(job, workspace, params)
+        except Exception as e:
+            result = self._failed(job, e)
+        self._on_done(result)
+
+    def Submit(self, job: JobInstance, workspace: Path, params: Params):
+        assert self._loop is not None, "runner not started"
+        asyncio.run_coroutine_threadsafe(self._run_async(job, workspace, params), self._loop)
+
+    async def _run_batch_async(self, jobs: list[JobInstance], workspace: Path, params: Params):
+        try:
+            results = await self._executor.RunBatchAsync(jobs, workspace, params)
+        except Exception as e:
+            results = [self._failed(job, e) for job in jobs]
+        for result in results: self._on_done(result)
+
+    def SubmitBatch(self, jobs: list[JobInstance], workspace: Path, params: Params):
+        assert self._loop is not None, "runner not started"
+        asyncio.run_coroutine_threadsafe(self._run_batch_async(jobs, workspace, params), self._loop)
+
+    def Stop(self):
+        loop, thread = self._loop, self._thread
+        if loop is None or thread is None: return
+        def _stop():
+            for task in asyncio.all_tasks(loop): task.cancel()
+            loop.call_soon(loop.stop)
+        loop.call_soon_threadsafe(_stop)
+        thread.join(timeout=10)
+        self._loop, self._thread = None, None
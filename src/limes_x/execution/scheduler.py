@@ -0,0 +1,345 @@
+from __future__ import annotations
+import os
+import time
+from collections import deque
+import heapq
+from typing import Callable, Hashable, Iterable
+
+from .instances import JobInstance
+from .modules import ComputeModule, Item
+
+class ResourceBudget:
+    """cores and memory that running jobs may use at once, detected from this machine if not given"""
+    def __init__(self, cores: int|None=None, memory_gb: float|None=None) -> None:
+        if cores is None:
+            cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+            assert cores is not None, "couldn't detect the number of cores, please give it"
+        if memory_gb is None:
+            memory_gb = os.sysconf('SC_PAGE_SIZE')*os.sysconf('SC_PHYS_PAGES')/2**30
+        self.cores = cores
+        self.memory_gb = memory_gb
+
+    def __repr__(self) -> str:
+        return f"<budget: {self.cores} cores, {self.memory_gb:.1f} GB>"
+
+class Scheduler:
+    """decides which pending jobs to start next
+    - jobs wait in a queue per module, a module is only looked at when it has jobs and is under its limit
+    - starting a job and finishing one are constant time regardless of how many jobs are waiting
+    - with a [budget], jobs also have to fit in the cores and memory left, using the threads and memory_gb
+    declared by their module or [default_demand] as (cores, memory in GB). When the next module's jobs don't fit,
+    smaller jobs from other modules are started in the meantime (backfill), but only [backfill_limit] times
+    before waiting for enough to free up, so large jobs aren't starved
+    - with a [priority] for each module name, ready modules with a higher priority go first,
+    otherwise jobs start in the order they were added (fifo), or with [round_robin], modules take turns
+    in the order they became ready, so a module with many jobs waiting doesn't hold back the others
+    - jobs given to AddLater, such as retries, join their queue once their delay has passed
+    - TakeBatch gives waiting jobs of a started job's module to run along with it, in its slot and with its resources
+    - with [max_open_groups], [group_of] gives each job its group, ex. the sample it descends from, or None.
+    Jobs of at most that many groups are started, other groups wait in the order they were first seen until
+    an open group has no jobs left, so each group is driven to the end before the next begins.
+    Jobs without a group are never held back
+    """
+    def __init__(self, max_concurrent: int=256, max_per_module: dict[str, int]=dict(),
+        budget: ResourceBudget|None=None, default_demand: tuple[int, float]=(1, 1), backfill_limit: int=64,
+        clock: Callable[[], float]=time.monotonic, priority: dict[str, float]|None=None,
+        max_open_groups: int|None=None, group_of: Callable[[JobInstance], Hashable|None]|None=None, round_robin: bool=False) -> None:
+        assert max_open_groups is None or (max_open_groups > 0 and group_of is not None), "open groups need to be limited to at least 1, by [group_of]"
+        self.max_concurrent = max_concurrent
+        self.max_per_module = max_per_module
+        self.budget = budget
+        self.default_demand = default_demand
+        self.backfill_limit = backfill_limit
+        self.priority = priority
+        self.round_robin = round_robin
+        self._queues: dict[str, deque[JobInstance]] = {}
+        self._running: dict[str, int] = {} # module name to number of jobs started but not done
+        self._total_running = 0
+        self._waiting = 0
+        self._order = 0
+        self._arrival: dict[JobInstance, int] = {} # waiting job to when it joined its queue
+        self._ready: list[tuple[float, int, str]] = [] # heap of (-priority, order, module name) of modules that can start a job
+        self._is_ready: set[str] = set()
+        self._passed_over: dict[str, int] = {} # module name to times it was backfilled past
+        self._later: list[tuple[float, int, JobInstance]] = [] # heap of (time, order, job) added with a delay
+        self._riders: set[JobInstance] = set() # started with another job by TakeBatch
+
+        self.max_open_groups = max_open_groups
+        self._group_of = group_of
+        self._open: dict[Hashable, int] = {} # open group to its jobs waiting or running
+        self._held: dict[Hashable, list[JobInstance]] = {} # groups not yet open, in the order they were first seen
+        self._held_count = 0
+        self._maybe_finished: set[Hashable] = set()
+
+        self._used = [0, 0.0] # cores, memory
+        self._clock = clock
+        self._usage = _UsageTracker(clock)
+
+    def _can_start(self, module_name: str):
+        limit = self.max_per_module.get(module_name)
+        return limit is None or self._running.get(module_name, 0) < limit
+
+    def _wake(self, module_name: str):
+        # modules of the same priority go by the arrival of their next job, or in the order they became ready with round_robin
+        if module_name in self._is_ready: return
+        q = self._queues.get(module_name)
+        if q is None or len(q) == 0: return
+        if not self._can_start(module_name): return
+        self._order += 1
+        p = 0 if self.priority is None else self.priority.get(module_name, 0)
+        heapq.heappush(self._ready, (-p, self._order if self.round_robin else self._arrival[q[0]], module_name))
+        self._is_ready.add(module_name)
+
+    def Demand(self, job: JobInstance) -> tuple[int, float]:
+        """cores and memory in GB the job is given, no more than the whole budget"""
+        step = job.step
+        cores = step.threads if step.threads is not None else self.default_demand[0]
+        mem = step.memory_gb if step.memory_gb is not None else self.default_demand[1]
+        if self.budget is not None:
+            cores, mem = min(cores, self.budget.cores), min(mem, self.budget.memory_gb)
+        return cores, mem
+
+    def _fits(self, module_name: str):
+        if self.budget is None: return True
+        cores, mem = self.Demand(self._queues[module_name][0])
+        return self._used[0]+cores <= self.budget.cores and self._used[1]+mem <= self.budget.memory_gb
+
+    def _pick(self):
+        # the first ready module, or the first after it that fits if it doesn't
+        passed: list[tuple[float, int, str]] = []
+        picked = None
+        while len(self._ready)>0:
+            entry = heapq.heappop(self._ready)
+            name = entry[2]
+            if len(self._queues[name]) == 0: # emptied by TakeBatch
+                self._is_ready.remove(name)
+                continue
+            if self._fits(name):
+                picked = name
+                break
+            passed.append(entry)
+            if self._passed_over.get(name, 0) >= self.backfill_limit: break # drain until it fits
+        for entry in passed:
+            heapq.heappush(self._ready, entry)
+            if picked is not None: self._passed_over[entry[2]] = self._passed_over.get(entry[2], 0)+1
+        return picked
+
+    def _group(self, job: JobInstance):
+        return None if self.max_open_groups is None or self._group_of is None else self._group_of(job)
+
+    def _enqueue(self, job: JobInstance):
+        name = job.step.name
+        q = self._queues.get(name)
+        if q is None:
+            q = deque()
+            self._queues[name] = q
+        q.append(job)
+        self._order += 1
+        self._arrival[job] = self._order
+        self._waiting += 1
+        self._wake(name)
+
+    def Add(self, jobs: Iterable[JobInstance]):
+        for job in jobs:
+            g = self._group(job)
+            if g is not None:
+                if g in self._open:
+                    self._open[g] += 1
+                elif g not in self._held and len(self._held) == 0 and len(self._open) < self.max_open_groups:
+                    self._open[g] = 1
+                else:
+                    held = self._held.get(g, [])
+                    held.append(job)
+                    self._held[g] = held
+                    self._held_count += 1
+                    continue
+            self._enqueue(job)
+
+    def _open_groups(self):
+        # open groups finish once they have no jobs left after the jobs made by their last finished ones were added
+        for g in self._maybe_finished:
+            if self._open.get(g) == 0: del self._open[g]
+        self._maybe_finished.clear()
+        while len(self._held)>0 and len(self._open) < self.max_open_groups:
+            g = next(iter(self._held))
+            jobs = self._held.pop(g)
+            self._held_count -= len(jobs)
+            self._open[g] = len(jobs)
+            for job in jobs: self._enqueue(job)
+
+    def AddLater(self, job: JobInstance, delay: float):
+        """adds the job once [delay] seconds have passed, its group stays open in the meantime"""
+        g = self._group(job)
+        if g is not None: self._open[g] = self._open.get(g, 0)+1
+        self._order += 1
+        heapq.heappush(self._later, (self._clock()+delay, self._order, job))
+
+    def _add_due(self):
+        if len(self._later) == 0: return
+        now = self._clock()
+        while len(self._later)>0 and self._later[0][0] <= now:
+            self._enqueue(heapq.heappop(self._later)[2])
+
+    def SecondsUntilDue(self) -> float|None:
+        """until the next job given to AddLater can start, None if there are none"""
+        if len(self._later) == 0: return None
+        return max(0, self._later[0][0]-self._clock())
+
+    def Next(self) -> JobInstance|None:
+        """the next job to start, counted as running, or None if nothing can start now"""
+        self._add_due()
+        if self.max_open_groups is not None: self._open_groups()
+        if self._total_running >= self.max_concurrent: return None
+        name = self._pick()
+        if name is None: return None
+        self._is_ready.remove(name)
+        self._passed_over.pop(name, None)
+        job = self._queues[name].popleft()
+        del self._arrival[job]
+        self._waiting -= 1
+        self._running[name] = self._running.get(name, 0)+1
+        self._total_running += 1
+        self._use(job, 1)
+        self._wake(name)
+        return job
+
+    def TakeBatch(self, job: JobInstance, size: int) -> list[JobInstance]:
+        """up to [size]-1 more waiting jobs of the module of [job], which was just started, to run with it"""
+        q = self._queues.get(job.step.name)
+        batch: list[JobInstance] = []
+        while q is not None and len(q)>0 and len(batch) < size-1:
+            batch.append(q.popleft())
+        for j in batch: del self._arrival[j]
+        self._waiting -= len(batch)
+        self._riders.update(batch)
+        return batch
+
+    def Done(self, job: JobInstance):
+        """frees the job's slot and resources, only its own module is woken"""
+        name = job.step.name
+        if job in self._riders:
+            self._riders.remove(job)
+        else:
+            self._running[name] -= 1
+            self._total_running -= 1
+            self._use(job, -1)
+            self._wake(name)
+        g = self._group(job)
+        if g is not None:
+            self._open[g] -= 1
+            if self._open[g] == 0: self._maybe_finished.add(g)
+
+    def _use(self, job: JobInstance, sign: int):
+        if self.budget is None: return
+        cores, mem = self.Demand(job)
+        self._used[0] += sign*cores
+        self._used[1] += sign*mem
+        self._usage.Record(self._used[0], self._used[1])
+
+    def CountRunning(self):
+        return self._total_running+len(self._riders)
+
+    def CountWaiting(self):
+        return self._waiting+len(self._later)+self._held_count
+
+    def CountOpenGroups(self):
+        return len(self._open)
+
+    def IsIdle(self):
+        return self._total_running == 0 and len(self._riders) == 0 and self._waiting == 0 and len(self._later) == 0 and self._held_count == 0
+
+    def UtilizationReport(self):
+        """how much of the budget running jobs used over time"""
+        if self.budget is None: return "no resource budget"
+        u = self._usage
+        elapsed = u.Elapsed()
+        if elapsed == 0: return "no jobs ran"
+        cores, mem = u.core_seconds/elapsed, u.memory_gb_seconds/elapsed
+        return ", ".join([
+            f"cores {cores:.1f}/{self.budget.cores} on average ({100*cores/self.budget.cores:.0f}%), peak {u.peak_cores}",
+            f"memory {mem:.1f}/{self.budget.memory_gb:.1f} GB on average ({100*mem/self.budget.memory_gb:.0f}%), peak {u.peak_memory_gb:.1f} GB",
+            f"over {elapsed:.0f}s",
+        ])
+
+class _UsageTracker:
+    # time weighted sums of resources in use, from the first job started to the last one done
+    def __init__(self, clock: Callable[[], float]) -> None:
+        self._clock = clock
+        self.core_seconds = 0.0
+        self.memory_gb_seconds = 0.0
+        self.peak_cores = 0
+        self.peak_memory_gb = 0.0
+        self._start: float|None = None
+        self._last = 0.0
+        self._cores = 0
+        self._mem = 0.0
+
+    def Record(self, cores: int, memory_gb: float):
+        now = self._clock()
+        if self._start is None: self._start = now
+        else:
+            self.core_seconds += self._cores*(now-self._last)
+            self.memory_gb_seconds += self._mem*(now-self._last)
+        self._last, self._cores, self._mem = now, cores, memory_gb
+        self.peak_cores = max(self.peak_cores, cores)
+        self.peak_memory_gb = max(self.peak_memory_gb, memory_gb)
+
+    def Elapsed(self):
+        return 0 if self._start is None else self._last-self._start
+
+def CriticalPathPriority(modules: list[ComputeModule], targets: Iterable[Item], estimates: dict[str, float]=dict()):
+    """for each module, the longest estimated runtime from the start of its jobs to the end of a job making a target
+    - [estimates] are runtimes by module name, modules without one are given the median of the others, or 1
+    - modules that don't lead to a target get 0
+    - modules in a cycle all get the same priority, counting each of their runtimes once
+    """
+    known = sorted(estimates[m.name] for m in modules if m.name in estimates)
+    default = known[len(known)//2] if len(known)>0 else 1
+    runtime = dict((m.name, estimates.get(m.name, default)) for m in modules)
+    consumers: dict[Item, list[ComputeModule]] = {}
+    for m in modules:
+        for i in m.inputs:
+            consumers[i] = consumers.get(i, [])+[m]
+    targets = set(targets)
+
+    successors = dict((m.name, [c.name for o in m.GetUnmaskedOutputs() for c in consumers.get(o, [])]) for m in modules)
+    makes_target = dict((m.name, len(m.GetUnmaskedOutputs().intersection(targets))>0) for m in modules)
+
+    # modules in a cycle are one step, so their priority doesn't depend on where the cycle is entered.
+    # tarjan's strongly connected components, each is found after every component it leads to
+    components: list[list[str]] = []
+    component_of: dict[str, int] = {}
+    index: dict[str, int] = {}
+    low: dict[str, int] = {}
+    stack: list[str] = []
+    def _connect(n: str):
+        index[n] = low[n] = len(index)
+        stack.append(n)
+        for c in successors[n]:
+            if c not in index:
+                _connect(c)
+                low[n] = min(low[n], low[c])
+            elif c not in component_of: # still on the stack
+                low[n] = min(low[n], index[c])
+        if low[n] != index[n]: return
+        members = []
+        while True:
+            x = stack.pop()
+            component_of[x] = len(components)
+            members.append(x)
+            if x == n: break
+        components.append(members)
+    for m in modules:
+        if m.name not in index: _connect(m.name)
+
+    remaining: list[float] = []
+    for k, members in enumerate(components):
+        after = [remaining[component_of[c]] for n in members for c in successors[n] if component_of[c] != k]
+        after = [r for r in after if r > 0]
+        runtime_of_step = sum(runtime[n] for n in members) # around the cycle once
+        if len(after) > 0:
+            r = runtime_of_step+max(after)
+        else:
+            r = runtime_of_step if any(makes_target[n] for n in members) else 0
+        remaining.append(r)
+    return dict((m.name, remaining[component_of[m.name]]) for m in modules)
@@ -0,0 +1,344 @@
+from __future__ import annotations
+import os
+import getpass
+import time
+import asyncio
+import subprocess
+from pathlib import Path
+from threading import Thread, Condition, Event, Lock
+from typing import Any, Callable
+
+from .executors import TokenBucket
+
+def _run(cmd: list[str]):
+    p = subprocess.run(cmd, capture_output=True, text=True)
+    return p.returncode, p.stdout, p.stderr
+
+def _unlimited(submit: Callable[[], tuple[bool, str]]):
+    return submit()
+
+def SubmitAndWait(sbatch_args: list[str], submission_limit: TokenBucket|None=None) -> tuple[bool, str]:
+    """sbatch --wait, returns whether the job exited with 0 and sbatch's errors
+    - only the submission, up to sbatch saying the job was queued, goes through [submission_limit]
+    """
+    done: list[subprocess.Popen] = []
+    def _submit():
+        p = subprocess.Popen(["sbatch", "--wait", *sbatch_args], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        assert p.stdout is not None
+        for line in p.stdout:
+            if line.startswith("Submitted batch job"):
+                done.append(p)
+                return True, ""
+        _, err = p.communicate() # sbatch ended without queueing the job
+        return False, err.strip()
+    accepted, msg = (_unlimited if submission_limit is None else submission_limit.Submit)(_submit)
+    if not accepted: return False, f"sbatch failed: {msg}"
+    _, err = done[0].communicate()
+    return done[0].returncode == 0, err
+
+class SlurmJob:
+    """a submitted job being tracked, Wait blocks a thread and WaitAsync awaits in a coroutine until it is done
+    - both give the job's accounting: slurm_id, state, exit_code, elapsed_sec, cpu_sec and max_rss_mb,
+    any of which are None if sacct doesn't know them
+    """
+    def __init__(self, slurm_id: str) -> None:
+        self.slurm_id = slurm_id
+        self.accounting: dict[str, Any]|None = None
+        self._done = Event()
+        self._lock = Lock()
+        self._callbacks: list[Callable[[dict[str, Any]], None]] = []
+        self._gone_since: float|None = None
+
+    def OnDone(self, callback: Callable[[dict[str, Any]], None]):
+        """calls [callback] with the accounting once done, from the poller's thread"""
+        with self._lock:
+            if self.accounting is None:
+                self._callbacks.append(callback)
+                return
+        callback(self.accounting)
+
+    def _finish(self, accounting: dict[str, Any]):
+        with self._lock:
+            self.accounting = accounting
+            callbacks, self._callbacks = self._callbacks, []
+        self._done.set()
+        for cb in callbacks: cb(accounting)
+
+    def Wait(self) -> dict[str, Any]:
+        self._done.wait()
+        assert self.accounting is not None
+        return self.accounting
+
+    async def WaitAsync(self) -> dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        done: asyncio.Future[dict[str, Any]] = loop.create_future()
+        self.OnDone(lambda a: loop.call_soon_threadsafe(lambda: done.done() or done.set_result(a)))
+        return await done
+
+def _accounting(slurm_id: str|None, state: str|None, **kwargs):
+    a: dict[str, Any] = {"slurm_id": slurm_id, "state": state, "exit_code": None, "elapsed_sec": None, "cpu_sec": None, "max_rss_mb": None}
+    a.update(kwargs)
+    return a
+
+def _seconds(duration: str) -> float|None:
+    # [D-][HH:]MM:SS[.mmm] as sacct gives it
+    if duration == "" or duration.upper() in {"UNKNOWN", "INVALID"}: return None
+    days = 0
+    if "-" in duration:
+        d, duration = duration.split("-", 1)
+        days = int(d)
+    total = 0.0
+    for part in duration.split(":"):
+        total = total*60+float(part)
+    return days*86400+total
+
+def _megabytes(rss: str) -> float|None:
+    if rss == "": return None
+    units = {"K": 1/1024, "M": 1, "G": 1024, "T": 1024**2}
+    if rss[-1].upper() in units: return float(rss[:-1])*units[rss[-1].upper()]
+    return float(rss)/2**20 # bytes
+
+class SlurmPoller:
+    """tracks every submitted slurm job from one thread, with one squeue call for all of them
+    and one sacct call for those that left the queue, so no thread or process waits on a job
+    - the interval between calls starts at [min_interval_sec] and grows by [backoff] while nothing finishes,
+    up to [max_interval_sec]
+    - a job that left the queue but that sacct doesn't know after [lost_after_sec] is done with state UNKNOWN,
+    as are all jobs if accounting isn't enabled
+    - a failed poll is tried again next interval, unless squeue or sacct can't be found, then every tracked job
+    is done with state UNKNOWN and the error
+    - Submit and SubmitAsync go through [submission_limit] if given, one token per sbatch call
+    """
+    FIELDS = ["JobID", "State", "ExitCode", "Elapsed", "TotalCPU", "MaxRSS"]
+    _ACTIVE = {"PENDING", "RUNNING", "REQUEUED", "RESIZING", "SUSPENDED", "COMPLETING"}
+    def __init__(self, min_interval_sec: float=5, max_interval_sec: float=120, backoff: float=1.5, lost_after_sec: float=120,
+        max_ids_per_call: int=500, submission_limit: TokenBucket|None=None) -> None:
+        self.submission_limit = submission_limit
+        self.min_interval_sec = min_interval_sec
+        self.max_interval_sec = max_interval_sec
+        self.backoff = backoff
+        self.lost_after_sec = lost_after_sec
+        self.max_ids_per_call = max_ids_per_call
+        self.interval = min_interval_sec
+        self.calls = 0 # to squeue and sacct
+        self._cv = Condition()
+        self._jobs: dict[str, SlurmJob] = {}
+        self._thread: Thread|None = None
+
+    def Track(self, slurm_id: str) -> SlurmJob:
+        job = SlurmJob(slurm_id)
+        with self._cv:
+            self._jobs[slurm_id] = job
+            if self._thread is None:
+                self._thread = Thread(target=self._loop, daemon=True, name="lx-slurm-poller")
+                self._thread.start()
+            self._cv.notify()
+        return job
+
+    def Submit(self, sbatch_args: list[str]) -> tuple[SlurmJob|None, str]:
+        """sbatch without waiting, then tracks the job, or None and sbatch's error"""
+        def _submit():
+            code, out, err = _run(["sbatch", "--parsable", *sbatch_args])
+            return code == 0, out if code == 0 else err.strip()
+        accepted, msg = (_unlimited if self.submission_limit is None else self.submission_limit.Submit)(_submit)
+        if not accepted: return None, msg
+        return self.Track(msg.strip().split(";")[0]), "" # "id;cluster" on multi-cluster setups
+
+    async def SubmitAsync(self, sbatch_args: list[str]) -> tuple[SlurmJob|None, str]:
+        async def _submit():
+            p = await asyncio.create_subprocess_exec("sbatch", "--parsable", *sbatch_args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+            out, err = await p.communicate()
+            return p.returncode == 0, out.decode() if p.returncode == 0 else err.decode().strip()
+        if self.submission_limit is None:
+            accepted, msg = await _submit()
+        else:
+            accepted, msg = await self.submission_limit.SubmitAsync(_submit)
+        if not accepted: return None, msg
+        return self.Track(msg.strip().split(";")[0]), ""
+
+    def CountTracked(self):
+        return len(self._jobs)
+
+    def _loop(self):
+        while True:
+            with self._cv:
+                while len(self._jobs) == 0:
+                    self._cv.wait()
+                jobs = list(self._jobs.values())
+            try:
+                finished = self._poll(jobs)
+            except FileNotFoundError as e:
+                finished = [(j, _accounting(j.slurm_id, "UNKNOWN", error=f"failed to poll slurm: {e}")) for j in jobs]
+            except Exception as e:
+                print(f"warning: failed to poll slurm, will try again: {e}")
+                finished = []
+            with self._cv:
+                for j, _ in finished: del self._jobs[j.slurm_id]
+                self.interval = self.min_interval_sec if len(finished)>0 else min(self.interval*self.backoff, self.max_interval_sec)
+            for j, a in finished: j._finish(a)
+            time.sleep(self.interval)
+
+    def _poll(self, jobs: list[SlurmJob]):
+        # by user rather than by job id, since squeue fails for ids that slurm no longer remembers
+        self.calls += 1
+        code, out, err = _run(["squeue", "-h", "-r", "-o", "%i", "-u", getpass.getuser()])
+        if code != 0: return [] # try again next time
+        queued = set(out.split())
+        left = [j for j in jobs if j.slurm_id not in queued]
+        if len(left) == 0: return []
+
+        accounting: dict[str, dict[str, Any]] = {}
+        ids = [j.slurm_id for j in left]
+        for i in range(0, len(ids), self.max_ids_per_call):
+            self.calls += 1
+            code, out, err = _run(["sacct", "-n", "-P", "-o", ",".join(self.FIELDS), "-j", ",".join(ids[i:i+self.max_ids_per_call])])
+            if code != 0: continue
+            for line in out.splitlines():
+                values = dict(zip(self.FIELDS, line.split("|")))
+                if len(values) < len(self.FIELDS): continue
+                base, step = (values["JobID"].split(".", 1)+[""])[:2]
+                a = accounting.get(base, _accounting(base, None))
+                try:
+                    if step == "":
+                        a["state"] = values["State"].split(" ")[0] # ex. "CANCELLED by 123"
+                        code_signal = values["ExitCode"].split(":")
+                        a["exit_code"] = int(code_signal[0]) if code_signal[0].isdigit() else None
+                        if len(code_signal)>1 and code_signal[1] not in {"", "0"}: a["exit_code"] = 128+int(code_signal[1])
+                        a["elapsed_sec"] = _seconds(values["Elapsed"])
+                        a["cpu_sec"] = _seconds(values["TotalCPU"])
+                    rss = _megabytes(values["MaxRSS"])
+                    if rss is not None: a["max_rss_mb"] = max(rss, a["max_rss_mb"] or 0)
+                except ValueError:
+                    pass # keeps what was parsed, the rest stays unknown
+                accounting[base] = a
+
+        now = time.monotonic()
+        finished: list[tuple[SlurmJob, dict[str, Any]]] = []
+        for j in left:
+            a = accounting.get(j.slurm_id)
+            if a is not None and a["state"] is not None and a["state"] not in self._ACTIVE:
+                finished.append((j, a))
+            elif j._gone_since is None:
+                j._gone_since = now # sacct can lag behind squeue
+            elif now-j._gone_since >= self.lost_after_sec:
+                finished.append((j, _accounting(j.slurm_id, "UNKNOWN")))
+        return finished
+
+class _Task:
+    __slots__ = ["job_id", "command", "done"]
+    def __init__(self, job_id: str, command: str) -> None:
+        self.job_id = job_id
+        self.command = command
+        self.done = SlurmJob("") # finished with the accounting of its array task
+
+class SlurmArraySubmitter:
+    """groups jobs with the same resource request into sbatch --array submissions
+    - Submit blocks the calling thread until the job's array task is done, like sbatch --wait, SubmitAsync awaits it
+    - jobs are gathered for up to [gather_sec], or until [max_array_size] are waiting, before they are submitted
+    - each array task finds its job's command in the array's index file by SLURM_ARRAY_TASK_ID
+    and writes its exit code next to it, which is used if sacct doesn't have it. Tasks are tracked by [poller]
+    - each array's sbatch call goes through the poller's submission_limit, one token for the whole array
+    """
+    INDEX_FILE = "index"
+    def __init__(self, folder: str|Path, sbatch_args: list[str]=list(), gather_sec: float=5, max_array_size: int=1000,
+        poller: SlurmPoller|None=None) -> None:
+        self.folder = Path(os.path.abspath(folder))
+        self.sbatch_args = sbatch_args
+        self.gather_sec = gather_sec
+        self.max_array_size = max_array_size
+        self.poller = poller if poller is not None else SlurmPoller()
+        self.submissions = 0
+        self._cv = Condition()
+        self._gathering: dict[tuple, tuple[float, list[_Task]]] = {} # resources to (first added, tasks)
+        self._thread: Thread|None = None
+
+    def _add(self, job_id: str, command: str, cores: int, mem_gb: int, time_limit: str):
+        task = _Task(job_id, command)
+        key = (cores, mem_gb, time_limit)
+        with self._cv:
+            if self._thread is None:
+                self._thread = Thread(target=self._loop, daemon=True, name="lx-slurm-arrays")
+                self._thread.start()
+            started, tasks = self._gathering.get(key, (time.monotonic(), []))
+            tasks.append(task)
+            self._gathering[key] = (started, tasks)
+            self._cv.notify_all()
+        return task
+
+    def _result(self, accounting: dict[str, Any]):
+        if accounting.get("exit_code") == 0: return True, "", accounting
+        msg = accounting.get("error", f"array task {accounting.get('slurm_id')} ended as {accounting.get('state')}, exit code {accounting.get('exit_code')}")
+        return False, msg, accounting
+
+    def Submit(self, job_id: str, command: str, cores: int, mem_gb: int, time_limit: str) -> tuple[bool, str, dict[str, Any]]:
+        """runs [command] as a task of an array, returns whether it exited with 0, a message and its accounting"""
+        return self._result(self._add(job_id, command, cores, mem_gb, time_limit).done.Wait())
+
+    async def SubmitAsync(self, job_id: str, command: str, cores: int, mem_gb: int, time_limit: str) -> tuple[bool, str, dict[str, Any]]:
+        return self._result(await self._add(job_id, command, cores, mem_gb, time_limit).done.WaitAsync())
+
+    def _loop(self):
+        while True:
+            with self._cv:
+                while len(self._gathering) == 0:
+                    self._cv.wait()
+                now = time.monotonic()
+                ready = [(k, tasks) for k, (started, tasks) in self._gathering.items() if len(tasks) >= self.max_array_size or now-started >= self.gather_sec]
+                for k, _ in ready: del self._gathering[k]
+                if len(ready) == 0:
+                    self._cv.wait(max(0.05, min(started+self.gather_sec-now for started, _ in self._gathering.values())))
+                    continue
+            for (cores, mem_gb, time_limit), tasks in ready:
+                for i in range(0, len(tasks), self.max_array_size):
+                    array = tasks[i:i+self.max_array_size]
+                    try:
+                        self._submit(array, cores, mem_gb, time_limit)
+                    except Exception as e:
+                        for t in array:
+                            if t.done.accounting is None: t.done._finish(_accounting(None, "NOT SUBMITTED", error=f"failed to submit array: {e}"))
+
+    def _submit(self, tasks: list[_Task], cores: int, mem_gb: int, time_limit: str):
+        self.submissions += 1
+        folder = self.folder.joinpath(f"array-{self.submissions:05}")
+        os.makedirs(folder, exist_ok=True)
+        with open(folder.joinpath(self.INDEX_FILE), "w") as index:
+            for i, t in enumerate(tasks):
+                script = folder.joinpath(f"task-{i}.sh")
+                with open(script, "w") as f: f.write(t.command+"\n")
+                index.write(f"{t.job_id} {script}\n")
+        batch_script = folder.joinpath("array.sh")
+        with open(batch_script, "w") as f:
+            f.write("\n".join([
+                "#!/bin/bash",
+                f"cd {os.getcwd()}",
+                f'line=$(sed -n "$((SLURM_ARRAY_TASK_ID+1))p" {folder.joinpath(self.INDEX_FILE)})',
+                'sh "${line#* }"',
+                "code=$?",
+                f"echo $code > {folder}/exit-$SLURM_ARRAY_TASK_ID",
+                "exit $code",
+            ])+"\n")
+        def _sbatch():
+            code, out, err = _run([
+                "sbatch", "--parsable", f"--array=0-{len(tasks)-1}", *self.sbatch_args,
+                f"--cpus-per-task={cores}", f"--mem={mem_gb}G", f"--time={time_limit}",
+                f"--output={folder}/slurm-%A_%a.out", str(batch_script),
+            ])
+            return code == 0, out if code == 0 else err.strip()
+        limit = self.poller.submission_limit
+        accepted, msg = (_unlimited if limit is None else limit.Submit)(_sbatch)
+        if not accepted:
+            for t in tasks: t.done._finish(_accounting(None, "NOT SUBMITTED", error=f"sbatch failed: {msg}"))
+            return
+        array_id = msg.strip().split(";")[0] # "id;cluster" on multi-cluster setups
+        for i, t in enumerate(tasks):
+            exit_file = folder.joinpath(f"exit-{i}")
+            self.poller.Track(f"{array_id}_{i}").OnDone(lambda a, t=t, exit_file=exit_file: t.done._finish(self._with_exit_code(a, exit_file)))
+
+    def _with_exit_code(self, accounting: dict[str, Any], exit_file: Path):
+        if accounting.get("exit_code") is None and exit_file.exists():
+            try:
+                with open(exit_file) as f: text = f.read().strip()
+            except OSError:
+                return accounting
+            accounting = dict(accounting, exit_code=int(text) if text.lstrip("-").isdigit() else 1)
+        return accounting
@@ -0,0 +1,155 @@
+import os
+import json
+import sqlite3
+from pathlib import Path
+
+class SqliteStateStore:
+    """workflow state in an sqlite database, an alternative to workflow_state.json
+    - reads and writes the same serialized form as the json file, so the two can be converted
+    - items, jobs and reservations are rows, so saving changes is a small transaction
+    - items are indexed by name and made_by, jobs by module and pending, for the Read* lookups of part of a state
+    without loading all of it
+    - resuming a run still reads the whole state into memory, Workflow.Run's Update and scheduler need every instance,
+    so this makes saving large states cheaper but not resuming them
+    """
+    FILE_NAME = 'workflow_state.db'
+    _META_KEYS = ["modules", "parent_map", "completed_modules", "given"]
+    _OPTIONAL_META_KEYS = ["id_counters"]
+
+    def __init__(self, path: str|Path) -> None:
+        self.path = Path(path)
+        with self._connect() as con:
+            con.executescript("""
+                create table if not exists meta (key text primary key, value text not null);
+                create table if not exists items (id text primary key, name text not null, made_by text, data text not null);
+                create table if not exists jobs (id text primary key, module text not null, pending integer not null, data text not null);
+                create table if not exists reservations (item text not null, job text not null, primary key (item, job));
+                create index if not exists items_by_name on items(name);
+                create index if not exists items_by_made_by on items(made_by);
+                create index if not exists jobs_by_module on jobs(module);
+                create index if not exists jobs_by_pending on jobs(pending);
+            """)
+
+    def _connect(self):
+        con = sqlite3.connect(self.path, timeout=600)
+        con.execute("pragma journal_mode=wal")
+        con.execute("pragma synchronous=full")
+        return _Connection(con)
+
+    @classmethod
+    def Exists(cls, path: str|Path):
+        return os.path.exists(path)
+
+    def Write(self, items: list[tuple[str, str, dict]], jobs: list[tuple[str, str, dict, bool]], meta: dict|None=None):
+        """upsert items as (item name, id, data) and jobs as (module name, id, data, is pending) in one transaction"""
+        with self._connect() as con:
+            self._write(con, items, jobs, meta)
+
+    def Replace(self, serialized_state: dict):
+        """overwrite everything with the serialized form of a state"""
+        items = [(name, id, data) for name, insts in serialized_state["item_instances"].items() for id, data in insts.items()]
+        pending = set(serialized_state["pending_jobs"])
+        jobs = [(name, id, data, id in pending) for name, jis in serialized_state["module_executions"].items() for id, data in jis.items()]
+        with self._connect() as con:
+            con.execute("delete from meta")
+            con.execute("delete from items")
+            con.execute("delete from jobs")
+            con.execute("delete from reservations")
+            self._write(con, items, jobs, serialized_state)
+            con.executemany(
+                "insert or ignore into reservations (item, job) values (?, ?)",
+                ((ik, jk) for ik, jks in serialized_state["item_instance_reservations"].items() for jk in jks),
+            )
+
+    def _write(self, con: sqlite3.Connection, items: list[tuple[str, str, dict]], jobs: list[tuple[str, str, dict, bool]], meta: dict|None):
+        if meta is not None:
+            con.executemany(
+                "insert or replace into meta (key, value) values (?, ?)",
+                ((k, json.dumps(meta[k])) for k in self._META_KEYS+self._OPTIONAL_META_KEYS if k in meta),
+            )
+        con.executemany(
+            "insert or replace into items (id, name, made_by, data) values (?, ?, ?, ?)",
+            ((id, name, data.get("made_by"), json.dumps(data, separators=(',', ':'))) for name, id, data in items),
+        )
+        con.executemany(
+            "insert or replace into jobs (id, module, pending, data) values (?, ?, ?, ?)",
+            ((id, name, int(pending), json.dumps(data, separators=(',', ':'))) for name, id, data, pending in jobs),
+        )
+        def _reservations():
+            for _, id, data, _ in jobs:
+                for v in data["inputs"].values():
+                    for ik in [v] if isinstance(v, str) else v:
+                        yield ik, id
+        con.executemany("insert or ignore into reservations (item, job) values (?, ?)", _reservations())
+
+    def Read(self) -> dict:
+        """the serialized form of the stored state, same as the contents of workflow_state.json"""
+        with self._connect() as con:
+            meta = dict((k, json.loads(v)) for k, v in con.execute("select key, value from meta"))
+            assert all(k in meta for k in self._META_KEYS), f"state database at [{self.path}] is incomplete"
+
+            item_instances: dict[str, dict[str, dict]] = {}
+            for id, name, data in con.execute("select id, name, data from items"):
+                insts = item_instances.get(name, {})
+                insts[id] = json.loads(data)
+                item_instances[name] = insts
+
+            module_executions: dict[str, dict[str, dict]] = {}
+            pending_jobs = []
+            for id, name, pending, data in con.execute("select id, module, pending, data from jobs"):
+                jis = module_executions.get(name, {})
+                jis[id] = json.loads(data)
+                module_executions[name] = jis
+                if pending: pending_jobs.append(id)
+
+            reservations: dict[str, list[str]] = {}
+            for ik, jk in con.execute("select item, job from reservations"):
+                jks = reservations.get(ik, [])
+                jks.append(jk)
+                reservations[ik] = jks
+
+        return {
+            "modules": meta["modules"],
+            "parent_map": meta["parent_map"],
+            "module_executions": module_executions,
+            "completed_modules": meta["completed_modules"],
+            "item_instances": item_instances,
+            "given": meta["given"],
+            "item_instance_reservations": reservations,
+            "pending_jobs": pending_jobs,
+            "id_counters": meta.get("id_counters", {}),
+        }
+
+    def ReadItems(self, name: str) -> dict[str, dict]:
+        """serialized instances of item [name] by id"""
+        return self._select("select id, data from items where name = ?", (name,))
+
+    def ReadItemsMadeBy(self, job_id: str) -> dict[str, dict]:
+        """serialized item instances made by job [job_id] by id"""
+        return self._select("select id, data from items where made_by = ?", (job_id,))
+
+    def ReadJobs(self, module: str) -> dict[str, dict]:
+        """serialized jobs of [module] by id"""
+        return self._select("select id, data from jobs where module = ?", (module,))
+
+    def ReadPendingJobs(self) -> dict[str, dict]:
+        """serialized jobs that haven't completed by id"""
+        return self._select("select id, data from jobs where pending = 1", ())
+
+    def _select(self, query: str, args: tuple):
+        with self._connect() as con:
+            return dict((id, json.loads(data)) for id, data in con.execute(query, args))
+
+class _Connection:
+    # sqlite3's own context manager commits but leaves the connection open
+    def __init__(self, con: sqlite3.Connection) -> None:
+        self._con = con
+
+    def __enter__(self):
+        return self._con.__enter__()
+
+    def __exit__(self, type, value, traceback):
+        try:
+            return self._con.__exit__(type, value, traceback)
+        finally:
+            self._con.close()
@@ -0,0 +1,186 @@
+from __future__ import annotations
+import os
+import time
+import struct
+import asyncio
+import ctypes, ctypes.util
+from pathlib import Path
+from threading import Event, Lock, Thread
+from typing import Callable
+
+_IN_CLOSE_WRITE = 0x8
+_IN_MOVED_TO = 0x80
+_EVENT = struct.Struct("iIII") # wd, mask, cookie, length of the name that follows
+
+class _Inotify:
+    # one inotify instance and reading thread for all waits, since closing an instance is slow,
+    # the kernel waits out a grace period. Callbacks are called from the thread when a watched folder
+    # has a file written and closed, or moved in
+    def __init__(self, libc) -> None:
+        self._libc = libc
+        self.fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0: raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._lock = Lock()
+        self._callbacks: dict[int, list[Callable[[], None]]] = {}
+        Thread(target=self._read, daemon=True, name="lx-inotify").start()
+
+    def Add(self, folder: Path, callback: Callable[[], None]) -> int|None:
+        """watch id, or None if the folder can't be watched"""
+        with self._lock:
+            wd = self._libc.inotify_add_watch(self.fd, str(folder).encode(), _IN_CLOSE_WRITE | _IN_MOVED_TO)
+            if wd < 0: return None
+            callbacks = self._callbacks.get(wd, [])
+            callbacks.append(callback)
+            self._callbacks[wd] = callbacks
+        return wd
+
+    def Remove(self, wd: int, callback: Callable[[], None]):
+        with self._lock:
+            callbacks = self._callbacks.get(wd, [])
+            if callback in callbacks: callbacks.remove(callback)
+            if len(callbacks) > 0: return
+            if wd in self._callbacks: del self._callbacks[wd]
+            self._libc.inotify_rm_watch(self.fd, wd)
+
+    def _read(self):
+        while True:
+            data = os.read(self.fd, 1<<16)
+            woken = set()
+            i = 0
+            while i+_EVENT.size <= len(data):
+                wd, _, _, name_len = _EVENT.unpack_from(data, i)
+                woken.add(wd)
+                i += _EVENT.size+name_len
+            with self._lock:
+                callbacks = [cb for wd in woken for cb in self._callbacks.get(wd, [])]
+            for cb in callbacks:
+                try:
+                    cb()
+                except Exception:
+                    pass # ex. the loop of a finished wait was closed
+
+_inotify: _Inotify|None = None
+_inotify_tried = False
+_inotify_lock = Lock()
+
+def _get_inotify():
+    global _inotify, _inotify_tried
+    with _inotify_lock:
+        if not _inotify_tried:
+            _inotify_tried = True
+            try:
+                libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+                _inotify = _Inotify(libc)
+            except (OSError, AttributeError, TypeError):
+                _inotify = None # not linux
+        return _inotify
+
+class ResultWatcher:
+    """waits for a job's result file to show up, which can take a while on shared file systems
+    - checks again with an interval that starts at [min_interval_sec] and doubles up to [max_interval_sec],
+    and as soon as inotify sees the file written, if the file system supports it. Writes from other nodes
+    over NFS don't make inotify events, so the checks go on either way
+    - keeps how long results took to show, see Report
+    """
+    def __init__(self, min_interval_sec: float=0.005, max_interval_sec: float=1) -> None:
+        self.min_interval_sec = min_interval_sec
+        self.max_interval_sec = max_interval_sec
+        self.checked = 0
+        self.timed_out = 0
+        self.latencies: list[float] = [] # of results that weren't there at first
+        self._lock = Lock()
+
+    def _visible(self, path: Path):
+        # stat of the folder gets NFS to look again instead of trusting its cache that the file isn't there
+        try:
+            os.stat(path.parent)
+        except OSError:
+            pass
+        return path.exists()
+
+    def _watch(self, path: Path, callback: Callable[[], None]):
+        inotify = _get_inotify()
+        if inotify is None: return None
+        wd = inotify.Add(path.parent, callback)
+        return None if wd is None else (inotify, wd)
+
+    def _unwatch(self, watch, callback: Callable[[], None]):
+        if watch is None: return
+        inotify, wd = watch
+        inotify.Remove(wd, callback)
+
+    def _record(self, latency: float|None, waited: bool):
+        with self._lock:
+            self.checked += 1
+            if latency is None:
+                self.timed_out += 1
+            elif waited:
+                self.latencies.append(latency)
+
+    def Wait(self, path: Path, timeout_sec: float) -> float|None:
+        """seconds until [path] was seen, 0 if it was already there or None if it didn't show within [timeout_sec]"""
+        if self._visible(path):
+            self._record(0, False)
+            return 0
+        if timeout_sec <= 0:
+            self._record(None, True)
+            return None
+        start = time.monotonic()
+        written = Event()
+        watch = self._watch(path, written.set)
+        interval = self.min_interval_sec
+        latency = None
+        try:
+            while True:
+                remaining = start+timeout_sec-time.monotonic()
+                if remaining <= 0: break
+                written.wait(min(interval, remaining))
+                written.clear()
+                if self._visible(path):
+                    latency = time.monotonic()-start
+                    break
+                interval = min(interval*2, self.max_interval_sec)
+        finally:
+            self._unwatch(watch, written.set)
+        self._record(latency, True)
+        return latency
+
+    async def WaitAsync(self, path: Path, timeout_sec: float) -> float|None:
+        if self._visible(path):
+            self._record(0, False)
+            return 0
+        if timeout_sec <= 0:
+            self._record(None, True)
+            return None
+        loop = asyncio.get_running_loop()
+        start = time.monotonic()
+        written = asyncio.Event()
+        on_written = lambda: loop.call_soon_threadsafe(written.set)
+        watch = self._watch(path, on_written)
+        interval = self.min_interval_sec
+        latency = None
+        try:
+            while True:
+                remaining = start+timeout_sec-time.monotonic()
+                if remaining <= 0: break
+                try:
+                    await asyncio.wait_for(written.wait(), min(interval, remaining))
+                except asyncio.TimeoutError:
+                    pass
+                written.clear()
+                if self._visible(path):
+                    latency = time.monotonic()-start
+                    break
+                interval = min(interval*2, self.max_interval_sec)
+        finally:
+            self._unwatch(watch, on_written)
+        self._record(latency, True)
+        return latency
+
+    def Report(self):
+        with self._lock:
+            latencies = sorted(self.latencies)
+            checked, timed_out = self.checked, self.timed_out
+        if len(latencies) == 0: return f"{checked} results, none had to be waited for, {timed_out} never showed"
+        median, worst = latencies[len(latencies)//2], latencies[-1]
+        return f"{checked} results, {len(latencies)} had to be waited for, median {1000*median:.0f}ms, max {1000*worst:.0f}ms, {timed_out} never showed"
@@ -0,0 +1,75 @@
+from __future__ import annotations
+import os, sys
+import inspect
+import subprocess
+from multiprocessing.connection import Connection
+from pathlib import Path
+from queue import Queue
+from typing import Any
+
+class _Worker:
+    # a plain python process rather than multiprocessing's, which would import the workflow's own script again,
+    # jobs come and results go over a pair of pipes kept apart from the job's stdout
+    def __init__(self) -> None:
+        to_worker, from_worker = os.pipe(), os.pipe()
+        from ..environments import worker
+        entry_point = os.path.abspath(inspect.getfile(worker))
+        env = dict(os.environ, PYTHONPATH=":".join(os.path.abspath(p) for p in sys.path))
+        self.process = subprocess.Popen(
+            [sys.executable, entry_point, str(to_worker[0]), str(from_worker[1])],
+            pass_fds=(to_worker[0], from_worker[1]), env=env,
+        )
+        os.close(to_worker[0]); os.close(from_worker[1])
+        self.conn_out = Connection(to_worker[1], readable=False)
+        self.conn_in = Connection(from_worker[0], writable=False)
+        self.jobs = 0
+
+    def Close(self):
+        try:
+            self.conn_out.send(None)
+        except OSError:
+            pass
+        self.conn_out.close()
+        self.conn_in.close()
+
+class WorkerPool:
+    """long lived python processes that run jobs of the local Executor, instead of a new local.py process each
+    - a worker loads each module's definition once and keeps it, so module level state lasts between its jobs
+    - workers are started on first use and replaced if one dies during a job
+    """
+    def __init__(self, size: int) -> None:
+        assert size > 0
+        self.size = size
+        self._idle: Queue[_Worker|None] = Queue()
+        for _ in range(size): self._idle.put(None) # started when first taken
+
+    def Run(self, location: Path, workspace: Path, relative_output_path: Path, reference_folder: str|Path) -> dict[str, Any]:
+        """runs a job whose context is saved in its output folder, returns its result as written to result.json,
+        or a failed result if the worker couldn't
+        """
+        worker = self._idle.get()
+        try:
+            if worker is None: worker = _Worker()
+            worker.conn_out.send((Path(location), Path(workspace), Path(relative_output_path), str(reference_folder)))
+            reply = worker.conn_in.recv()
+            worker.jobs += 1
+            return reply
+        except (EOFError, OSError):
+            code = None
+            if worker is not None:
+                worker.Close()
+                code = worker.process.wait()
+            worker = None
+            from .modules import JobResult
+            return JobResult(error_message=f"worker process died, exit code {code}", exit_code=1).ToDict()
+        finally:
+            self._idle.put(worker)
+
+    def Close(self):
+        """stops the workers once their jobs are done, new ones are started if the pool is used again"""
+        workers = [self._idle.get() for _ in range(self.size)]
+        for w in workers:
+            if w is not None:
+                w.Close()
+                w.process.wait()
+            self._idle.put(None)
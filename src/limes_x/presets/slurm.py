@@ -1,8 +1,6 @@
 import os, sys
 import uuid
 from pathlib import Path
-import time
-import random
 from datetime import datetime
 from typing import Any, Iterable
 import json
@@ -61,6 +59,8 @@ if (len(sys.argv)>1 and sys.argv[1] == _INNER):
     
     run_id: str = CONTEXT["run_id"]
     allocation: str = CONTEXT["allocation"]
+    use_arrays: bool = CONTEXT.get("array", False)
+    use_poller: bool = CONTEXT.get("poll", False)
     module_locations = CONTEXT["modules"]
     modules = [lx.ComputeModule._load(p) for p in module_locations]
     reference_folder: Path = CONTEXT["reference_folder"]
@@ -109,27 +109,78 @@ if (len(sys.argv)>1 and sys.argv[1] == _INNER):
         _time_str = f"{_hrs:02}:{_mins:02}:00"
         return (_cores, _time_str, _mem)
 
+    # every sbatch call, but not the wait for its job, takes a token from the executor's
+    # submission limit and backs off when the controller is busy
+    from limes_x.execution.slurm import SlurmArraySubmitter, SlurmPoller, SubmitAndWait
+
     def slurm(job: lx.Job) -> tuple[bool, str]:
         p = job.context.params
-        time.sleep(10*random.random())
         cores, time_str, mem = get_res(job.instance.step.name, job.context.manifest, p.threads, p.mem_gb)
         p.threads = cores
         p.mem_gb = mem
         job.SaveContext()
-        return job.Shell(f"""\
-            sbatch --wait --account={allocation} \
-                --job-name="{run_id}-{job.instance.step.name}:{job.instance.GetID()}" \
-                --nodes=1 --ntasks=1 \
-                --cpus-per-task={cores} --mem={mem}G --time={time_str} \
-                --wrap="{job.run_command}"\
-        """)
+        return SubmitAndWait([
+            f"--account={allocation}",
+            f"--job-name={run_id}-{job.instance.step.name}:{job.instance.GetID()}",
+            "--nodes=1", "--ntasks=1",
+            f"--cpus-per-task={cores}", f"--mem={mem}G", f"--time={time_str}",
+            f"--wrap={job.run_command}",
+        ], job.submission_limit)
+
+    # one thread follows every submitted job with squeue and sacct, it is given the executor's submission limit below
+    poller = SlurmPoller()
+
+    # polled jobs are submitted without --wait and awaited on one event loop, instead of a thread each
+    async def slurm_polled(job: lx.Job) -> tuple[bool, str]:
+        p = job.context.params
+        cores, time_str, mem = get_res(job.instance.step.name, job.context.manifest, p.threads, p.mem_gb)
+        p.threads = cores
+        p.mem_gb = mem
+        job.SaveContext()
+        submitted, err = await poller.SubmitAsync([
+            f"--account={allocation}",
+            f"--job-name={run_id}-{job.instance.step.name}:{job.instance.GetID()}",
+            "--nodes=1", "--ntasks=1",
+            f"--cpus-per-task={cores}", f"--mem={mem}G", f"--time={time_str}",
+            f"--wrap={job.run_command}",
+        ])
+        if submitted is None: return False, f"sbatch failed: {err}"
+        job.accounting = await submitted.WaitAsync()
+        code = job.accounting["exit_code"]
+        # without accounting, result.json decides
+        if code is None or code == 0: return True, ""
+        return False, f"slurm job {submitted.slurm_id} ended as {job.accounting['state']}, exit code {code}"
+
+    # jobs asking for the same resources are submitted together as job arrays
+    submitter = SlurmArraySubmitter(WS.joinpath("slurm_arrays"), sbatch_args=[
+        f"--account={allocation}", f"--job-name={run_id}-array", "--nodes=1", "--ntasks=1",
+    ], poller=poller)
+    def _array_request(job: lx.Job):
+        p = job.context.params
+        cores, time_str, mem = get_res(job.instance.step.name, job.context.manifest, p.threads, p.mem_gb)
+        p.threads = cores
+        p.mem_gb = mem
+        job.SaveContext()
+        return job.instance.GetID(), job.run_command, cores, mem, time_str
+
+    def slurm_array(job: lx.Job) -> tuple[bool, str]:
+        ok, msg, job.accounting = submitter.Submit(*_array_request(job))
+        return ok, msg
+
+    async def slurm_array_async(job: lx.Job) -> tuple[bool, str]:
+        ok, msg, job.accounting = await submitter.SubmitAsync(*_array_request(job))
+        return ok, msg
     
     #------------------------------------------------------------------------------------------
     # run workflow
 
     now = datetime.now() 
     start_date = now.strftime("%Y-%m-%d")
-    ex = lx.HpcExecutor(hpc_procedure=slurm, tmp_dir_name="SLURM_TMPDIR")
+    ex = lx.HpcExecutor(
+        hpc_procedure=slurm_array if use_arrays else slurm, tmp_dir_name="SLURM_TMPDIR",
+        hpc_async_procedure=(slurm_array_async if use_arrays else slurm_polled) if use_poller else None,
+    )
+    poller.submission_limit = ex.submission_limit
     ex.max_active_io_jobs = 128
     wf.Run(
         workspace=WS,
@@ -137,6 +188,7 @@ if (len(sys.argv)>1 and sys.argv[1] == _INNER):
         given=given,
         executor=ex,
         max_per_module={"download_sra": 10},
+        runner=lx.AsyncioRunner() if use_poller else None,
     )
 
     #------------------------------------------------------------------------------------------
@@ -186,7 +238,14 @@ def Run(
     time: str="48:00:00",
     name: str|None=None,
     continue_from: str|None=None,
+    array: bool=False,
+    poll: bool=False,
 ):
+    """submits the workflow to slurm, which then submits its jobs
+    - with [array], jobs asking for the same resources are submitted together with sbatch --array
+    - with [poll], jobs are submitted without waiting and one thread follows them all with squeue and sacct,
+    their accounting is kept in each job's result
+    """
     def _ok_for_path(c: str):
         return c.isalpha() or c.isdigit() or c in "-_"
     if name is not None: name = "".join([c if _ok_for_path(c) else "_" for c in name])
@@ -232,6 +291,8 @@ def Run(
             reference_folder = reference_folder,
             given = [_parse_given(g) for g in given],
             targets = [t if isinstance(t, str) else t.key for t in  targets],
+            array = array,
+            poll = poll,
         )
         json.dump(context, f, indent=4)
 
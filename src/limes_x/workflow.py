@@ -4,18 +4,23 @@ import shutil
 from pathlib import Path
 from typing import Any, Callable, Iterable, Literal
 import json
-import uuid
-from threading import Thread, Condition
+import sqlite3
+from threading import Thread, Condition, Lock, RLock
+import time
 import signal
 from datetime import datetime as dt
 
 from .execution.solver import DependencySolver
 from .common.utils import PrivateInit, Timestamp
 # from .compute_module import Item, ComputeModule, Params, JobContext, JobResult
-from .execution.instances import JobInstance, ItemInstance
-from .execution.modules import ComputeModule, Item, JobContext, JobResult, Params
+from .execution.instances import JobInstance, ItemInstance, JobSignature
+from .execution.modules import ComputeModule, Item, JobContext, JobResult, Params, RetryPolicy
 from .execution.executors import Executor
 from .execution.comms import FileSyncedDictionary
+from .execution.state_store import SqliteStateStore
+from .execution.scheduler import Scheduler, ResourceBudget, CriticalPathPriority
+from .execution.runners import JobRunner, ThreadPerJobRunner
+from .execution.history import RuntimeHistory
 
 class JobError(Exception):
      def __init__(self, message=""):
@@ -24,16 +29,23 @@ class JobError(Exception):
 
 class WorkflowState(PrivateInit):
     _FILE_NAME = 'workflow_state.json'
+    _JOURNAL_NAME = 'workflow_state.journal'
+    _JOURNAL_MIN_COMPACT_BYTES = 2**20
     def __init__(self, workspace: Path, steps: list[ComputeModule], dependency_map: dict[str, set[str]]=dict(), **kwargs) -> None:
         super().__init__(_key=kwargs.get('_key'))
-        self._ids: set[str] = set()
+        self._id_counters: dict[int, int] = {} # id width to next id, widths of ids made by older versions are never used
         self._job_instances: dict[str, JobInstance] = {}
-        self._job_signatures: dict[str, JobInstance] = {} # key is "hash" of inputs
+        self._job_signatures: dict[JobSignature, JobInstance] = {}
         self._item_lookup: dict[str, list[ItemInstance]] = {}
         self._given_item_instances: list[str] = []
 
         self._pending_jobs: dict[str, JobInstance] = {}
+        self._new_pending_jobs: list[JobInstance] = []
         self._item_instance_reservations: dict[ItemInstance, set[JobInstance]] = {}
+        self._lineage: dict[ItemInstance|JobInstance, list[ItemInstance]] = {} # parent to item instances made_by parent
+        self._group_memo: dict[tuple[str, str], dict[ItemInstance, list[ItemInstance]]] = {} # (target, by) to complete groups
+        self._group_dependents: dict[ItemInstance|JobInstance, list[tuple[tuple[str, str], ItemInstance]]] = {} # instance to memoized groups that visited it
+        self._job_roots: dict[JobInstance, frozenset[ItemInstance]] = {} # job to the given roots its inputs descend from
 
         self._steps = steps
         self._finihsed_steps: set[str] = set()
@@ -52,16 +64,203 @@ class WorkflowState(PrivateInit):
                 assert group_by_path is not None, f"[{target.key}] group by [{start.key}] for [{s.name}] is invalid for this set of compute modules. No path between"
                 self._group_by_paths[(target.key, start.key)] = group_by_path
 
+        # names of items and modules that a module's candidate jobs depend on
+        self._module_watch: dict[str, set[str]] = {}
+        for s in steps:
+            watched = {i.key for i in s.inputs}
+            for target, start in s._group_by.items():
+                watched.update(self._group_by_paths[(target.key, start.key)])
+            self._module_watch[s.name] = watched
+
+        # changes since the last Update, used to only re-evaluate modules and namespaces that can be affected
+        self._dirty: set[str] = set() # item and module names
+        self._full_update = True
+        self._seen_groups: dict[str, dict[str, dict[ItemInstance, frozenset[ItemInstance]]]] = {} # module -> input -> root -> group
+
         self._changed = False
         self._workspace:Path = workspace
 
+        # persistence, "snapshot" rewrites the whole state on save, "journal" appends changes
+        # and only rewrites the snapshot when the journal grows larger than it, "sqlite" writes changes to a database
+        self._store: Literal["snapshot", "journal", "sqlite"] = "snapshot"
+        self._needs_snapshot = True
+        self._snapshot_bytes = 0
+        self._journal_bytes = 0
+        self._generation = 0 # of the last snapshot, journal records carry the generation they were appended on top of
+        self._unsaved_jobs: dict[str, JobInstance] = {} # registered or completed since last save
+        self._unsaved_items: list[ItemInstance] = []
+        self._replaced_saves: list[Path] = [] # of the store switched away from, moved aside once the new one has everything
+        self._serialized: dict|None = None # kept up to date at each snapshot save, see _serialized_copy
+        self._db: SqliteStateStore|None = None # opened on the first sqlite save, which creates the tables
+
     def _register_item_inst(self, ii: ItemInstance):
         ilst = self._item_lookup.get(ii.item_name, [])
         ilst.append(ii)
         self._item_lookup[ii.item_name] = ilst
+        if ii.made_by is not None:
+            children = self._lineage.get(ii.made_by, [])
+            children.append(ii)
+            self._lineage[ii.made_by] = children
+            self._forget_groups(ii.made_by)
+        self._dirty.add(ii.item_name)
+        self._unsaved_items.append(ii)
+        self._changed = True
+
+    def _forget_groups(self, changed: ItemInstance|JobInstance):
+        # memoized groups whose resolution passed through @changed may now be different
+        dependents = self._group_dependents.pop(changed, None)
+        if dependents is None: return
+        for key, root in dependents:
+            memo = self._group_memo.get(key)
+            if memo is not None and root in memo: del memo[root]
 
     def Save(self):
-        if not self._changed: return
+        write = self.CaptureSave()
+        if write is not None: write()
+
+    def SaveFailed(self):
+        """the changes of a captured save didn't reach the disk, the next save writes everything"""
+        self._needs_snapshot = True
+        self._changed = True
+
+    def CaptureSave(self) -> Callable[[], None]|None:
+        """takes the changes since the last save and returns a fn that writes them, or None if there is nothing to save
+        - the fn doesn't read the state, so it can run on another thread while the state keeps changing
+        - fns must be run in the order they were captured
+        """
+        if not self._changed: return None
+        items, jobs = self._unsaved_items, self._unsaved_jobs
+        self._unsaved_items, self._unsaved_jobs = [], {}
+        self._changed = False
+        workspace = self._workspace
+
+        if self._store == "sqlite":
+            self._serialized = None # the database is the copy on disk, don't keep another in memory
+            if self._db is None: self._db = SqliteStateStore(workspace.joinpath(SqliteStateStore.FILE_NAME))
+            db = self._db
+            if self._needs_snapshot:
+                self._needs_snapshot = False
+                serialized_state = self._serialize()
+                replaced, self._replaced_saves = self._replaced_saves, []
+                def _replace():
+                    db.Replace(serialized_state)
+                    self._move_aside(replaced)
+                return _replace
+            item_rows = [(ii.item_name, ii.GetID(), ii.ToDict()) for ii in items]
+            job_rows = [(ji.step.name, ji.GetID(), ji.ToDict(), ji.GetID() in self._pending_jobs) for ji in jobs.values()]
+            return lambda: db.Write(items=item_rows, jobs=job_rows)
+
+        if self._store == "journal" and not self._needs_snapshot:
+            # each record is the complete serialized form of an item or job, so replaying one twice is harmless
+            gen = self._generation
+            records = [{"item": [ii.item_name, ii.GetID(), ii.ToDict()], "gen": gen} for ii in items]
+            records += [{"job": [ji.step.name, ji.GetID(), ji.ToDict(), ji.GetID() in self._pending_jobs], "gen": gen} for ji in jobs.values()]
+            # compacting rebuilds the snapshot from the files, so the full state is never copied here
+            compact = self._journal_bytes > max(self._snapshot_bytes, self._JOURNAL_MIN_COMPACT_BYTES)
+            if len(records) == 0 and not compact: return None
+            if compact:
+                self._journal_bytes = 0
+                self._generation += 1
+            def _append():
+                if len(records) > 0:
+                    chunk = "".join(json.dumps(r, separators=(',', ':'))+"\n" for r in records)
+                    with open(workspace.joinpath(self._JOURNAL_NAME), 'a') as j:
+                        j.write(chunk)
+                        j.flush()
+                        os.fsync(j.fileno())
+                    self._journal_bytes += len(chunk)
+                if compact:
+                    compacted = self._read_serialized(workspace, "json")
+                    compacted["generation"] = gen+1
+                    self._snapshot_bytes = self._write_snapshot(workspace, compacted)
+                    self._journal_bytes = 0
+            return _append
+
+        if self._store == "snapshot":
+            serialized_state = self._serialized_copy(items, jobs)
+        else:
+            self._serialized = None # only snapshot saves keep a serialized copy
+            serialized_state = self._serialize()
+        self._generation += 1
+        serialized_state["generation"] = self._generation
+        self._needs_snapshot = False
+        self._journal_bytes = 0 # counts appends captured after this snapshot
+        replaced, self._replaced_saves = self._replaced_saves, []
+        def _snapshot():
+            self._snapshot_bytes = self._write_snapshot(workspace, serialized_state)
+            self._move_aside(replaced)
+        return _snapshot
+
+    def _serialized_copy(self, items: list[ItemInstance], jobs: dict[str, JobInstance]):
+        # keeps a serialized form up to date with the changes, so capturing a snapshot is a few shallow copies
+        # instead of serializing every instance. Nested values are replaced, never modified, so copies can be shared
+        cached = self._serialized
+        if cached is None:
+            cached = self._serialized = self._serialize()
+        else:
+            item_instances, module_executions = cached["item_instances"], cached["module_executions"]
+            reservations: dict[str, list[str]] = cached["item_instance_reservations"]
+            for ii in items:
+                d = item_instances.get(ii.item_name, {})
+                d[ii.GetID()] = ii.ToDict()
+                item_instances[ii.item_name] = d
+            for ji in jobs.values():
+                jid = ji.GetID()
+                d = module_executions.get(ji.step.name, {})
+                d[jid] = ji.ToDict()
+                module_executions[ji.step.name] = d
+                for ii in ji.ListInputInstances():
+                    reserved_by = reservations.get(ii.GetID(), [])
+                    if jid not in reserved_by: reservations[ii.GetID()] = reserved_by+[jid]
+
+        return {
+            "modules": cached["modules"],
+            "parent_map": cached["parent_map"],
+            "module_executions": dict((k, dict(v)) for k, v in cached["module_executions"].items()),
+            "completed_modules": list(self._completed_modules),
+            "item_instances": dict((k, dict(v)) for k, v in cached["item_instances"].items()),
+            "given": list(self._given_item_instances),
+            "item_instance_reservations": dict(cached["item_instance_reservations"]),
+            "pending_jobs": list(self._pending_jobs),
+            "id_counters": dict((str(w), n) for w, n in self._id_counters.items()),
+        }
+
+    @classmethod
+    def _write_snapshot(cls, workspace: Path, serialized_state: dict):
+        save = workspace.joinpath(cls._FILE_NAME)
+        tmp = workspace.joinpath(f"{cls._FILE_NAME}.tmp")
+        with open(tmp, 'w') as j:
+            json.dump(serialized_state, j, indent=4)
+            j.flush()
+            os.fsync(j.fileno())
+        # atomic, a crash leaves either the old or the new snapshot. A crash before the journal below is removed
+        # leaves records that are already in the snapshot, their generation is older so they are skipped on replay
+        os.replace(tmp, save)
+        folder = os.open(workspace, os.O_RDONLY)
+        try:
+            os.fsync(folder)
+        finally:
+            os.close(folder)
+
+        # journaled changes are now in the snapshot
+        journal = workspace.joinpath(cls._JOURNAL_NAME)
+        if journal.exists(): os.remove(journal)
+        return os.path.getsize(save)
+
+    @classmethod
+    def _save_files(cls, workspace: Path, source: Literal["json", "sqlite"]):
+        if source == "sqlite":
+            db = workspace.joinpath(SqliteStateStore.FILE_NAME)
+            return [db, db.with_name(f"{db.name}-wal"), db.with_name(f"{db.name}-shm")]
+        return [workspace.joinpath(cls._FILE_NAME), workspace.joinpath(cls._JOURNAL_NAME)]
+
+    @classmethod
+    def _move_aside(cls, paths: list[Path]):
+        # kept, but never loaded again
+        for p in paths:
+            if p.exists(): os.replace(p, p.with_name(f"{p.name}.replaced"))
+
+    def _serialize(self):
         jobs_by_step = {}
         for ji in self._job_instances.values():
             k = ji.step.name
@@ -97,95 +296,209 @@ class WorkflowState(PrivateInit):
             "given": self._given_item_instances,
             "item_instance_reservations": dict((ii.GetID(), [ji.GetID() for ji in jis]) for ii, jis in self._item_instance_reservations.items()),
             "pending_jobs": list(self._pending_jobs),
+            "id_counters": dict((str(w), n) for w, n in self._id_counters.items()),
         }
-        with open(self._workspace.joinpath(self._FILE_NAME), 'w') as j:
-            json.dump(state, j, indent=4)
+        return state
 
     @classmethod
-    def LoadFromDisk(cls, workspace: str|Path, steps: list[ComputeModule]):
-        cm_ref = dict((c.name, c) for c in steps)
-        workspace = Path(workspace)
-
-        def _flatten(instances_by_type: dict):
-            return [tup for g in [[(type, hash, data) for hash, data in insts.items()] for type, insts in instances_by_type.items()] for tup in g]
+    def _replay_journal(cls, workspace: Path, serialized_state: dict):
+        journal = workspace.joinpath(cls._JOURNAL_NAME)
+        if not journal.exists(): return 0
+        generation = serialized_state.get("generation", 0)
+        pending = dict.fromkeys(serialized_state["pending_jobs"])
+        reservations: dict[str, list[str]] = serialized_state["item_instance_reservations"]
+        with open(journal, 'rb') as j:
+            lines = j.readlines()
+        valid_bytes = 0
+        for i, line in enumerate(lines):
+            try:
+                if not line.endswith(b"\n"): raise ValueError()
+                record = json.loads(line)
+            except ValueError:
+                if i < len(lines)-1: raise ValueError(f"failed to load state, record {i+1} of the journal is corrupted")
+                # last record was cut off by a crash and never acknowledged, drop it so appends start on a new line
+                with open(journal, 'r+b') as j:
+                    j.truncate(valid_bytes)
+                break
+            valid_bytes += len(line)
+            if record.get("gen", 0) < generation: continue # left by a crash during compaction, the snapshot has it
+            if "item" in record:
+                item_name, id, data = record["item"]
+                insts = serialized_state["item_instances"].get(item_name, {})
+                insts[id] = data
+                serialized_state["item_instances"][item_name] = insts
+            elif "job" in record:
+                module_name, id, data, is_pending = record["job"]
+                jobs = serialized_state["module_executions"].get(module_name, {})
+                jobs[id] = data
+                serialized_state["module_executions"][module_name] = jobs
+                if is_pending:
+                    pending[id] = None
+                elif id in pending:
+                    del pending[id]
+                for v in data["inputs"].values():
+                    for ik in [v] if isinstance(v, str) else v:
+                        reserved_by = reservations.get(ik, [])
+                        if id not in reserved_by: reserved_by.append(id)
+                        reservations[ik] = reserved_by
+        serialized_state["pending_jobs"] = list(pending)
+        return os.path.getsize(journal)
 
+    @classmethod
+    def _read_serialized(cls, workspace: Path, source: Literal["json", "sqlite"]):
+        if source == "sqlite":
+            return SqliteStateStore(workspace.joinpath(SqliteStateStore.FILE_NAME)).Read()
         with open(workspace.joinpath(cls._FILE_NAME)) as j:
             serialized_state = json.load(j)
+        cls._replay_journal(workspace, serialized_state)
+        return serialized_state
 
-            for name, md in serialized_state["modules"].items():
-                # group_by from module definition
-                ins = {Item(i) for i in md["in"]}
-                outs = {Item(i) for i in md["out"]}
-                cm = cm_ref[name]
-                assert cm.inputs == ins
-                assert cm.outputs == outs
-                cm.output_mask = {Item(i) for i in md.get("unused_out", [])}
-
-            job_instances: dict[str, JobInstance] = {}
-            item_instances: dict[str, ItemInstance] = {}
-
-            todo_items = _flatten(serialized_state["item_instances"])
-            todo_jobs = _flatten(serialized_state["module_executions"])
-            job_outputs: dict[str, dict] = {}
-
-            while len(todo_items)>0 or len(todo_jobs)>0:
-                found = False
-                len_todo = len(todo_items)
-                for fi in range(len_todo):
-                    i = len_todo-fi-1 # back to front
-                    item_name, id, obj = todo_items[i]
-                    ii = ItemInstance.FromDict(item_name, id, obj, item_instances, job_instances)
-                    if ii is None: continue
-                    found = True
-                    todo_items.pop(i)
-                    item_instances[id] = ii
-                
-                len_todo = len(todo_jobs)
-                for fi in range(len_todo):
-                    i = len_todo-fi-1 # back to front
-                    module_name, id, obj = todo_jobs[i]
-                    ji = JobInstance.FromDict(cm_ref[module_name], id, obj, item_instances)
-                    if ji is None: continue
-                    found = True
-                    todo_jobs.pop(i)
-                    job_instances[id] = ji
-
-                    outs = obj.get("outputs")
-                    if outs is not None:
-                        job_outputs[id] = outs
-
-                if not found:
-                    raise ValueError("failed to load state, the save may be corrupted")
-
-            for jid, outs in job_outputs.items():
-                outs = dict((ik, item_instances[v] if isinstance(v, str) else [item_instances[iik] for iik in v]) for ik, v in outs.items())
-                job_instances[jid].MarkAsComplete(outs)
-
-            state = WorkflowState(workspace, steps,
-                dependency_map=dict((k, set(v)) for k, v in serialized_state["parent_map"].items()),
-                _key=cls._initializer_key)
-            state._completed_modules = serialized_state["completed_modules"]
-            state._given_item_instances = serialized_state["given"]
-            state._ids.update(item_instances)
-            state._ids.update(job_instances)
-            state._job_instances = job_instances
-            state._job_signatures = dict((state._get_signature(ji.step.name, list(ji.inputs.values())), ji) for ji in job_instances.values())
-            for k in serialized_state["pending_jobs"]:
-                ji = job_instances[k]
-                assert isinstance(ji, JobInstance)
-                state._pending_jobs[k] = ji
-            state._item_instance_reservations = dict(
-                (item_instances[ik], {job_instances[rk] for rk in jids})
-                for ik, jids in serialized_state["item_instance_reservations"].items()
-            )
+    @classmethod
+    def ConvertSave(cls, workspace: str|Path, to: Literal["json", "sqlite"]):
+        """rewrite the saved state of @workspace as workflow_state.json or workflow_state.db"""
+        workspace = Path(workspace)
+        source: Literal["json", "sqlite"] = "sqlite" if to == "json" else "json"
+        serialized_state = cls._read_serialized(workspace, source)
+        if to == "sqlite":
+            db = workspace.joinpath(SqliteStateStore.FILE_NAME)
+            SqliteStateStore(db).Replace(serialized_state)
+            return db
+        else:
+            # the database has everything, a journal left from an older json save would replay over it
+            journal = workspace.joinpath(cls._JOURNAL_NAME)
+            if journal.exists(): os.remove(journal)
+            cls._write_snapshot(workspace, serialized_state)
+            return workspace.joinpath(cls._FILE_NAME)
 
-            for ii in item_instances.values():
-                lst = state._item_lookup.get(ii.item_name, [])
-                lst.append(ii)
-                state._item_lookup[ii.item_name] = lst
+    @classmethod
+    def LoadFromDisk(cls, workspace: str|Path, steps: list[ComputeModule], source: Literal["json", "sqlite"]="json"):
+        cm_ref = dict((c.name, c) for c in steps)
+        workspace = Path(workspace)
 
-            state.Update()
-            return state
+        def _flatten(instances_by_type: dict):
+            return [tup for g in [[(type, hash, data) for hash, data in insts.items()] for type, insts in instances_by_type.items()] for tup in g]
+
+        serialized_state = cls._read_serialized(workspace, source)
+
+        for name, md in serialized_state["modules"].items():
+            # group_by from module definition
+            ins = {Item(i) for i in md["in"]}
+            outs = {Item(i) for i in md["out"]}
+            cm = cm_ref[name]
+            assert cm.inputs == ins
+            assert cm.outputs == outs
+            cm.output_mask = {Item(i) for i in md.get("unused_out", [])}
+
+        job_instances: dict[str, JobInstance] = {}
+        item_instances: dict[str, ItemInstance] = {}
+
+        # each record is built once, after everything it refers to
+        # items depend on what made them, jobs depend on their inputs
+        records: dict[str, tuple[bool, str, dict]] = {} # id to (is job, item or module name, data)
+        for item_name, id, obj in _flatten(serialized_state["item_instances"]):
+            if id in records: raise ValueError(f"failed to load state, item id [{id}] is used by both [{records[id][1]}] and [{item_name}]")
+            records[id] = (False, item_name, obj)
+        for module_name, id, obj in _flatten(serialized_state["module_executions"]):
+            if module_name not in cm_ref: raise ValueError(f"failed to load state, job [{id}] is of unknown module [{module_name}]")
+            if id in records: raise ValueError(f"failed to load state, job id [{id}] of [{module_name}] is also used by [{records[id][1]}]")
+            records[id] = (True, module_name, obj)
+
+        def _dependencies(is_job: bool, obj: dict) -> list[str]:
+            if not is_job:
+                made_by = obj.get("made_by")
+                return [] if made_by is None else [made_by]
+            return [ik for v in obj["inputs"].values() for ik in ([v] if isinstance(v, str) else v)]
+
+        def _summarize(ids: Iterable[str]):
+            ids = list(ids)
+            return ", ".join(ids[:10]) + (f" and {len(ids)-10} more" if len(ids)>10 else "")
+
+        waiting_on: dict[str, int] = {} # id to number of unbuilt dependencies
+        dependents: dict[str, list[str]] = {}
+        dangling: list[str] = []
+        ready: list[str] = []
+        for id, (is_job, _, obj) in records.items():
+            deps = set(_dependencies(is_job, obj))
+            missing = [d for d in deps if d not in records]
+            if len(missing)>0:
+                dangling.append(f"{id}->{'|'.join(missing)}")
+                continue
+            waiting_on[id] = len(deps)
+            for d in deps:
+                lst = dependents.get(d, [])
+                lst.append(id)
+                dependents[d] = lst
+            if len(deps) == 0: ready.append(id)
+        if len(dangling)>0:
+            raise ValueError(f"failed to load state, the save may be corrupted. references to missing instances: [{_summarize(dangling)}]")
+
+        while len(ready)>0:
+            id = ready.pop()
+            is_job, name, obj = records[id]
+            if is_job:
+                job_instances[id] = JobInstance.FromDict(cm_ref[name], id, obj, item_instances)
+            else:
+                ii = ItemInstance.FromDict(name, id, obj, item_instances, job_instances)
+                assert ii is not None
+                item_instances[id] = ii
+            for d in dependents.get(id, []):
+                waiting_on[d] -= 1
+                if waiting_on[d] == 0: ready.append(d)
+
+        unbuilt = [id for id in waiting_on if id not in job_instances and id not in item_instances]
+        if len(unbuilt)>0:
+            raise ValueError(f"failed to load state, the save may be corrupted. cyclic references between: [{_summarize(unbuilt)}]")
+
+        def _get_item(ref: str, by: str):
+            if ref not in item_instances: raise ValueError(f"failed to load state, the save may be corrupted. [{by}] refers to missing item instance [{ref}]")
+            return item_instances[ref]
+
+        for jid, ji in job_instances.items():
+            outs = records[jid][2].get("outputs")
+            if outs is None: continue
+            outs = dict((ik, _get_item(v, jid) if isinstance(v, str) else [_get_item(iik, jid) for iik in v]) for ik, v in outs.items())
+            ji.MarkAsComplete(outs)
+
+        state = WorkflowState(workspace, steps,
+            dependency_map=dict((k, set(v)) for k, v in serialized_state["parent_map"].items()),
+            _key=cls._initializer_key)
+        state._completed_modules = serialized_state["completed_modules"]
+        state._given_item_instances = serialized_state["given"]
+        # saved counters can be behind ids appended to a journal or written to the database since
+        counters: dict[int, int] = dict((int(w), n) for w, n in serialized_state.get("id_counters", {}).items())
+        for inst in [*item_instances.values(), *job_instances.values()]:
+            w = inst._id_width
+            if w in (JobInstance.ID_WIDTH, ItemInstance.ID_WIDTH) and isinstance(inst._id, int) and inst._id >= counters.get(w, 0):
+                counters[w] = inst._id+1
+        state._id_counters = counters
+        state._job_instances = job_instances
+        state._job_signatures = dict((state._get_signature(ji.step.name, ji.inputs.values()), ji) for ji in job_instances.values())
+        missing_jobs = [k for k in serialized_state["pending_jobs"] if k not in job_instances]
+        missing_jobs += [rk for jids in serialized_state["item_instance_reservations"].values() for rk in jids if rk not in job_instances]
+        if len(missing_jobs)>0:
+            raise ValueError(f"failed to load state, the save may be corrupted. pending or reserving jobs missing: [{_summarize(missing_jobs)}]")
+        for k in serialized_state["pending_jobs"]:
+            state._pending_jobs[k] = job_instances[k]
+        state._item_instance_reservations = dict(
+            (_get_item(ik, "reservations"), {job_instances[rk] for rk in jids})
+            for ik, jids in serialized_state["item_instance_reservations"].items()
+        )
+
+        for ii in item_instances.values():
+            state._register_item_inst(ii)
+
+        # everything loaded is already on disk
+        state._unsaved_items.clear()
+        state._changed = False
+        state._needs_snapshot = False
+        state._generation = serialized_state.get("generation", 0)
+        if source == "json":
+            state._snapshot_bytes = os.path.getsize(workspace.joinpath(cls._FILE_NAME))
+            journal = workspace.joinpath(cls._JOURNAL_NAME)
+            state._journal_bytes = os.path.getsize(journal) if journal.exists() else 0
+
+        state.Update()
+        return state
 
     @classmethod
     def MakeNew(cls, workspace: str|Path, steps: list[ComputeModule], given: list[InputGroup]):
@@ -203,13 +516,12 @@ class WorkflowState(PrivateInit):
         for grp in given:
             root_instance = ItemInstance(state._gen_id, grp.root_type, grp.root_value)
             children: dict[str, ItemInstance|list[ItemInstance]] = {}
-            for ii in [ItemInstance(state._gen_id, i, p) for i, ps in grp.children.items() for p in ps] + [root_instance]:
+            for ii in [ItemInstance(state._gen_id, i, p, made_by=root_instance) for i, ps in grp.children.items() for p in ps] + [root_instance]:
                 state._register_item_inst(ii)
                 state._given_item_instances.append(ii.GetID())
                 v = children.get(ii.item_name, [])
                 if not isinstance(v, list): v = [v]
                 children[ii.item_name] =  v + [ii]
-                if ii != root_instance: ii.made_by = root_instance
 
         produced: dict[Item, ComputeModule] = {}
         for step in steps:
@@ -227,30 +539,71 @@ class WorkflowState(PrivateInit):
         return state
 
     @classmethod
-    def ResumeIfPossible(cls, workspace: str|Path, steps: list[ComputeModule], given: list[InputGroup]):
+    def ResumeIfPossible(cls, workspace: str|Path, steps: list[ComputeModule], given: list[InputGroup], store: Literal["snapshot", "journal", "sqlite"]="snapshot"):
         workspace = Path(workspace)
-        if os.path.exists(workspace.joinpath(cls._FILE_NAME)):
-            return WorkflowState.LoadFromDisk(workspace, steps)
+        json_exists = os.path.exists(workspace.joinpath(cls._FILE_NAME))
+        db_exists = SqliteStateStore.Exists(workspace.joinpath(SqliteStateStore.FILE_NAME))
+        def _last_saved(source: Literal["json", "sqlite"]):
+            return max(os.path.getmtime(p) for p in cls._save_files(workspace, source) if p.exists())
+        if db_exists and json_exists:
+            # a change of store that crashed before its first save, or a save from an older version, the newer one has the latest changes
+            source = "sqlite" if _last_saved("sqlite") >= _last_saved("json") else "json"
+        elif db_exists:
+            source = "sqlite"
+        elif json_exists:
+            source = "json"
         else:
             assert given is not None
-            return WorkflowState.MakeNew(workspace, steps, given)
+            state = WorkflowState.MakeNew(workspace, steps, given)
+            state._store = store
+            return state
+
+        state = WorkflowState.LoadFromDisk(workspace, steps, source=source)
+        if (source == "sqlite") != (store == "sqlite"):
+            # switching stores, the first save writes everything to the new one, then the old save is moved aside
+            state._needs_snapshot = True
+            state._changed = True
+            state._replaced_saves = cls._save_files(workspace, source)
+        state._store = store
+        return state
 
     def _gen_id(self, id_len: int):
-        while True:
-            id = uuid.uuid4().hex[:id_len]
-            if id not in self._ids: break 
-        self._ids.add(id)
-        return id
+        # counting up is collision free without remembering every id
+        n = self._id_counters.get(id_len, 0)
+        self._id_counters[id_len] = n+1
+        return f"{n:0{id_len}x}"
 
     def _get_signature(self, module_name: str, inputs: Iterable[ItemInstance|list[ItemInstance]]):
-        inputs_list = [ii for g in [g if isinstance(g, list) else [g] for g in inputs] for ii in g]
-        input_keys = sorted(ii.GetID() for ii in inputs_list)
-        signature = "-".join([module_name]+input_keys)
-        return signature
+        return JobSignature(module_name, inputs)
 
     def GetPendingJobs(self):
         return list(self._pending_jobs.values())        
 
+    def GetRoots(self, job: JobInstance) -> frozenset[ItemInstance]:
+        """the roots of the input groups that the job's inputs descend from"""
+        roots = self._job_roots.get(job)
+        if roots is not None: return roots
+        found: set[ItemInstance] = set()
+        for ii in job.ListInputInstances():
+            parent = ii.made_by
+            if parent is None: found.add(ii) # a root
+            elif isinstance(parent, JobInstance): found.update(self.GetRoots(parent))
+            else: found.add(parent) # given with the root
+        roots = frozenset(found)
+        self._job_roots[job] = roots
+        return roots
+
+    def GetRootGroup(self, job: JobInstance) -> ItemInstance|None:
+        """the root of the one input group the job belongs to, None if it combines several"""
+        roots = self.GetRoots(job)
+        return next(iter(roots)) if len(roots) == 1 else None
+
+    def TakeNewPendingJobs(self):
+        """jobs that became pending since the last call"""
+        new = self._new_pending_jobs
+        self._new_pending_jobs = []
+        return new
+
     def _add_dependency_mapping(self, start: str, end: str):
         mapped = self._parent_map.get(start, set())
         mapped.add(end)
@@ -288,17 +641,16 @@ class WorkflowState(PrivateInit):
         path = self._group_by_paths.get((target, by))
         if path is None: return {} # not valid grouping, there is an assert in the constructor
 
+        memo = self._group_memo.get((target, by), {})
+        self._group_memo[(target, by)] = memo
         def _get_group(start: ItemInstance):
-            class Todo:
-                def __init__(self, node: ItemInstance|JobInstance, depth: int) -> None:
-                    self.node = node
-                    self.depth = depth
-
+            if start in memo: return memo[start]
             group: set[ItemInstance] = set()
-            todo = [Todo(start, 0)]
+            visited: list[ItemInstance|JobInstance] = []
+            todo: list[tuple[ItemInstance|JobInstance, int]] = [(start, 0)]
             while len(todo)>0:
-                t = todo.pop(0)
-                instance, depth = t.node, t.depth
+                instance, depth = todo.pop()
+                visited.append(instance)
                 if isinstance(instance, ItemInstance) and instance.item_name == target:
                     group.add(instance)
                     continue # found leaf (target) of @start
@@ -306,22 +658,27 @@ class WorkflowState(PrivateInit):
                 next_name = path[depth+1]
                 if isinstance(instance, ItemInstance):
                     if next_name in self._item_lookup:
-                        for i in self._item_lookup[next_name]:
-                            if i.made_by != instance: continue
-                            todo.append(Todo(i, depth+1))
+                        for i in self._lineage.get(instance, []):
+                            if i.item_name != next_name: continue
+                            todo.append((i, depth+1))
                         continue # item linked via logistical action, not by compute job
                     res = [j for j in self._item_instance_reservations.get(instance, []) if j.step.name == next_name]
                     if len(res) == 0: return [] # item is intermediate and not used, so chain broken
                     for j in res:
-                        todo.append(Todo(j, depth+1))
+                        todo.append((j, depth+1))
                 else:
                     if not instance.complete: return [] # pending job found in group
-                    outs = instance.ListOutputInstances()
-                    if outs is None: continue # was marked complete, so maybe just a failed job
-                    for i in outs:
+                    for i in self._lineage.get(instance, []):
                         if i.item_name != next_name: continue
-                        todo.append(Todo(i, depth+1))
-            return list(group)
+                        todo.append((i, depth+1))
+            # every job in this subtree is complete, so the group only changes if new jobs are added to it
+            complete_group = list(group)
+            memo[start] = complete_group
+            for instance in visited:
+                dependents = self._group_dependents.get(instance, [])
+                dependents.append(((target, by), start))
+                self._group_dependents[instance] = dependents
+            return complete_group
 
         groups: dict[ItemInstance, list[ItemInstance]] = {}
         for s in starting_points:
@@ -337,89 +694,103 @@ class WorkflowState(PrivateInit):
             return True
 
         class _namespace:
-            def __init__(self) -> None:
-                self._space: dict[str, list[ItemInstance]] = {} # key is item
-                self._grouped_by: dict[str, ItemInstance] = {} # key is item
-
-            def Copy(self):
-                new = _namespace()
-                new._space = self._space.copy()
-                new._grouped_by = self._grouped_by.copy()
-                return new
-
-            def Add(self, instances: ItemInstance|list[ItemInstance]):
-                if isinstance(instances, list):
-                    item_name = next(iter(instances)).item_name
-                    to_add = instances
+            # persistent, extending a namespace shares its parent instead of copying it
+            __slots__ = ["parent", "root", "keys"]
+            def __init__(self, parent: _namespace|None, root: ItemInstance, keys: list[str]) -> None:
+                self.parent = parent
+                self.root = root # the "by" in group by
+                self.keys = keys # inputs grouped by root
+
+            def Values(self, input_groups: dict[str, dict[ItemInstance, list[ItemInstance]]]):
+                ns = self
+                while ns is not None:
+                    for k in ns.keys:
+                        yield input_groups[k][ns.root]
+                    ns = ns.parent
+
+            def Compile(self, input_groups: dict[str, dict[ItemInstance, list[ItemInstance]]]):
+                chain: list[_namespace] = []
+                ns = self
+                while ns is not None:
+                    chain.append(ns)
+                    ns = ns.parent
+                space: dict[str, list[ItemInstance]] = {}
+                for ns in reversed(chain):
+                    for k in ns.keys:
+                        space[k] = input_groups[k][ns.root]
+                return space
+
+        def _expand(root_keys: list[list[str]], all_roots: list[list[ItemInstance]], new_roots: list[list[ItemInstance]]):
+            # depth first, one root instance per root item, lazily yielding complete namespaces
+            # prefixes that can no longer include a new root are never extended
+            new_sets = [set(rs) for rs in new_roots]
+            new_after = [False]*(len(root_keys)+1)
+            for j in reversed(range(len(root_keys))):
+                new_after[j] = new_after[j+1] or len(new_roots[j])>0
+
+            def _dfs(j: int, ns: _namespace|None, has_new: bool):
+                if j == len(root_keys):
+                    if ns is not None: yield ns
+                    return
+                if has_new:
+                    choices = all_roots[j]
+                elif new_after[j+1]:
+                    choices = all_roots[j] # old roots here, new ones may come later
                 else:
-                    item_name = instances.item_name
-                    to_add = [instances]
-                self._space[item_name] = self._space.get(item_name, []) + to_add
-
-            # root is the "by" in group by
-            def GetRootInstance(self, item_name: str):
-                return self._grouped_by.get(item_name)
-
-            def RegisterRootInstance(self, instance: ItemInstance):
-                self._grouped_by[instance.item_name] = instance
-
-        class Namespaces:
-            def __init__(self) -> None:
-                self.namespaces: list[_namespace] = [_namespace()]
-
-            def MergeGroup(self, group: dict[ItemInstance, list[ItemInstance]]):
-                root_item_name = next(iter(group)).item_name
-                roots = {r for r in [ns.GetRootInstance(root_item_name) for ns in self.namespaces] if r is not None}
-                roots = roots.intersection(group)
-
-                intersection = []
-                for ns in self.namespaces:
-                    for k in roots:
-                        ns_root = ns.GetRootInstance(root_item_name)
-                        if ns_root is None or ns_root.GetID() != k.GetID(): continue
-                        ns.Add(group[k])
-                        intersection.append(ns)
-                self.namespaces = intersection
-
-            def CrossGroup(self, group: dict[ItemInstance, list[ItemInstance]]):
-                new_nss: list[_namespace] = []
-                for ns in self.namespaces:
-                    for root, iis in group.items():
-                        new = ns.Copy()
-                        new.Add(iis)
-                        new.RegisterRootInstance(root)
-                        new_nss.append(new)
-                self.namespaces = new_nss
-
-            def Compile(self):
-                return [ns._space for ns in self.namespaces]
-
-        def _gather_inputs(module: ComputeModule):
+                    choices = new_roots[j] # last chance to include a new root
+                for root in choices:
+                    yield from _dfs(j+1, _namespace(ns, root, root_keys[j]), has_new or root in new_sets[j])
+
+            if not new_after[0]: return
+            yield from _dfs(0, None, False)
+
+        def _gather_inputs(module: ComputeModule, full: bool):
+            # every input is grouped by a root item (itself if not grouped)
+            # inputs that share a root item are merged, different root items are crossed
             input_groups: dict[str, dict[ItemInstance, list[ItemInstance]]] = {}
+            inputs_by_root: dict[str, list[str]] = {} # root item name to input keys
             for input in module.inputs:
                 group_by = module.Grouped(input)
                 if group_by is None:
                     instances = self._item_lookup.get(input.key)
                     if instances is None: return None
-                    self_group = dict((i, [i]) for i in instances)
-                    input_groups[input.key] = self_group
+                    group = dict((i, [i]) for i in instances)
+                    root_name = input.key
                 else:
                     group = self._group_by(input.key, group_by.key)
                     if len(group)==0: return None
-                    input_groups[input.key] = group
-
-            input_namespaces = Namespaces()
-            seen_roots = set() # item names
-            # print(input_groups)
-            for item_name, group in input_groups.items():
-                root = next(iter(group)).item_name
-                if root in seen_roots:
-                    input_namespaces.MergeGroup(group)
+                    root_name = group_by.key
+                input_groups[input.key] = group
+                inputs_by_root[root_name] = inputs_by_root.get(root_name, [])+[input.key]
+
+            # only namespaces with at least one new or changed group can produce new jobs
+            seen = self._seen_groups.get(module.name, {})
+            all_roots: list[list[ItemInstance]] = []
+            new_roots: list[list[ItemInstance]] = []
+            for keys in inputs_by_root.values():
+                valid = [r for r in input_groups[keys[0]] if all(r in input_groups[k] for k in keys[1:])]
+                if full:
+                    new = valid
                 else:
-                    input_namespaces.CrossGroup(group)
-                    seen_roots.add(root)
-
-            return input_namespaces.Compile()
+                    new = []
+                    for r in valid:
+                        for k in keys:
+                            seen_group = seen.get(k, {}).get(r)
+                            if seen_group is None or len(seen_group) != len(input_groups[k][r]) or not seen_group.issuperset(input_groups[k][r]):
+                                new.append(r)
+                                break
+                all_roots.append(valid)
+                new_roots.append(new)
+
+            if full: seen = {}
+            for k, group in input_groups.items():
+                seen_for_input = seen.get(k, {})
+                for r, iis in group.items():
+                    seen_for_input[r] = frozenset(iis)
+                seen[k] = seen_for_input
+            self._seen_groups[module.name] = seen
+
+            return input_groups, _expand(list(inputs_by_root.values()), all_roots, new_roots)
 
         def _no_single_lists(ii: ItemInstance|list[ItemInstance]):
             if isinstance(ii, ItemInstance):
@@ -427,26 +798,36 @@ class WorkflowState(PrivateInit):
             else:
                 return ii[0] if len(ii)==1 else ii
 
+        full, dirty = self._full_update, self._dirty
+        self._full_update, self._dirty = False, set()
         for module in self._steps:
+            if not full and dirty.isdisjoint(self._module_watch[module.name]): continue
             if not _satisfies(module): continue
-            instances = _gather_inputs(module)
-            if instances is None: continue
-            # print(f"{module.name} {len(instances)}")
-            for space in instances:
-                signature = self._get_signature(module.name, list(space.values()))
-                print(signature)
+            gathered = _gather_inputs(module, full)
+            if gathered is None: continue
+            input_groups, namespaces = gathered
+            for ns in namespaces:
+                signature = self._get_signature(module.name, ns.Values(input_groups))
                 if signature in self._job_signatures: continue
-                # print(module.name, space)
 
+                space = ns.Compile(input_groups)
                 job_inst = JobInstance(self._gen_id, module, dict((k, _no_single_lists(v)) for k, v in space.items()))
-                self._register_job_instance(job_inst)
-            self._changed = True
+                self._register_job_instance(job_inst, signature)
 
-    def _register_job_instance(self, inst: JobInstance):
-        self._job_signatures[self._get_signature(inst.step.name, inst.inputs.values())] = inst
+    def _register_job_instance(self, inst: JobInstance, signature: JobSignature|None=None):
+        # lineage, reservations and groups go by instance, but saves and results go by id, so a reused id would mix up two jobs
+        other = self._job_instances.get(inst.GetID())
+        if other is not None and other is not inst:
+            raise ValueError(f"job id [{inst.GetID()}] of [{inst.step.name}] is already used by a job of [{other.step.name}]")
+        self._changed = True
+        self._unsaved_jobs[inst.GetID()] = inst
+        if signature is None: signature = self._get_signature(inst.step.name, inst.inputs.values())
+        self._job_signatures[signature] = inst
         self._pending_jobs[inst.GetID()] = inst
+        self._new_pending_jobs.append(inst)
         self._job_instances[inst.GetID()] = inst
         for ii in inst.ListInputInstances():
+            self._forget_groups(ii)
             lst = self._item_instance_reservations.get(ii, set())
             lst.add(inst)
             self._item_instance_reservations[ii] = lst
@@ -455,6 +836,10 @@ class WorkflowState(PrivateInit):
         if job_id not in self._pending_jobs: return
         job_inst = self._pending_jobs[job_id]
         del self._pending_jobs[job_id]
+        self._dirty.add(job_inst.step.name)
+        self._unsaved_jobs[job_id] = job_inst
+        self._changed = True
+        self._forget_groups(job_inst)
 
         expected_outputs = job_inst.step.GetUnmaskedOutputs()
         outs: dict[str, ItemInstance|list[ItemInstance]] = {}
@@ -469,8 +854,29 @@ class WorkflowState(PrivateInit):
             outs[item.key] = insts if len(insts)>1 else insts[0]
         job_inst.MarkAsComplete(outs)
 
+    def RegisterJobFailed(self, job_id: str, result: JobResult):
+        """keeps a failed attempt of a pending job, returns how many attempts have failed so far
+        - the job stays pending, RegisterJobComplete ends it if it won't be tried again
+        """
+        job_inst = self._pending_jobs.get(job_id)
+        if job_inst is None: return 0
+        if job_inst.attempts is None: job_inst.attempts = []
+        job_inst.attempts.append({
+            "time": round(time.time()),
+            "exit_code": result.exit_code,
+            "error": None if result.error_message is None else result.error_message[-500:],
+        })
+        self._unsaved_jobs[job_id] = job_inst
+        self._changed = True
+        return len(job_inst.attempts)
+
     def _invalidate(self, job_instances_to_delete: Iterable[JobInstance]):
         self._changed = True
+        self._serialized = None
+        self._full_update = True
+        self._group_memo.clear()
+        self._group_dependents.clear()
+        self._job_roots.clear()
 
         item_instances_to_delete: list[ItemInstance] = []
         # remove job instances
@@ -478,7 +884,7 @@ class WorkflowState(PrivateInit):
             jk = ji.GetID()
             if jk in self._job_instances: del self._job_instances[jk]
             if jk in self._pending_jobs: del self._pending_jobs[jk]
-            sig = self._get_signature(ji.step.name, list(ji.inputs.values()))
+            sig = self._get_signature(ji.step.name, ji.inputs.values())
             if sig in self._job_signatures: del self._job_signatures[sig]
             outs = ji.ListOutputInstances()
             if outs is not None: item_instances_to_delete += outs
@@ -512,14 +918,22 @@ class WorkflowState(PrivateInit):
         NL = '\n'
 
         old_save = self._get_save()
+        # journal of a json save, or the write-ahead log of a database
+        extras = [p for p in [self._workspace.joinpath(self._JOURNAL_NAME), Path(f"{old_save}-wal"), Path(f"{old_save}-shm")] if p.exists()]
         cmd = f"""\
             mkdir -p {previous_folder}
             {NL.join(f"mv {self._workspace.joinpath(f)} {previous_folder.joinpath(f)}" for f in deleted_jobs_folders)}
             mv {old_save} {previous_folder}
+            {NL.join(f"mv {p} {previous_folder}" for p in extras)}
         """
         os.system(cmd)
+        self._needs_snapshot = True
+        self._journal_bytes = 0
+        self._db = None # moved aside, the next save makes a new one
 
     def _get_save(self):
+        if self._store == "sqlite":
+            return self._workspace.joinpath(SqliteStateStore.FILE_NAME)
         return self._workspace.joinpath(self._FILE_NAME)
 
     def _check_can_invalidate(self):
@@ -574,7 +988,7 @@ class WorkflowState(PrivateInit):
 
 class Sync:
     def __init__(self) -> None:
-        self.lock = Condition()
+        self.lock = Condition(RLock()) # reentrant, PushNotify is called from the signal handler
         self.queue = []
 
     def PushNotify(self, item: JobResult|None=None):
@@ -582,15 +996,80 @@ class Sync:
             self.queue.append(item)
             self.lock.notify()
 
-    def WaitAll(self) -> list[JobResult|None]:
+    def WaitAll(self, timeout: float|None=None) -> list[JobResult|None]:
+        """results pushed so far, waiting for at least one or until [timeout] seconds have passed"""
         with self.lock:
             if len(self.queue)==0:
-                self.lock.wait()
+                self.lock.wait(timeout)
 
             results = self.queue.copy()
             self.queue.clear()
             return results
 
+class Checkpointer:
+    """saves a WorkflowState on a background thread
+    - changes are captured while holding [lock], which must also be held while modifying the state,
+    but written to disk without it
+    - requests are coalesced, changes are saved at most [max_staleness] seconds after they are requested
+    """
+    def __init__(self, state: WorkflowState, lock: Lock, max_staleness: float=5) -> None:
+        self.state = state
+        self.lock = lock
+        self.max_staleness = max_staleness
+        self._cv = Condition()
+        self._requested_at: float|None = None
+        self._urgent = False
+        self._stopped = False
+        self._error: Exception|None = None
+        self._thread = Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def Request(self, now: bool=False):
+        """save the changes made so far, soon or, if [now], as soon as possible"""
+        if self._error is not None: raise self._error
+        with self._cv:
+            if self._requested_at is None: self._requested_at = time.monotonic()
+            self._urgent = self._urgent or now
+            self._cv.notify()
+
+    def Stop(self):
+        """waits for the saves in progress then saves whatever is left
+        - raises the first failed save, even if saving everything at the end worked
+        """
+        with self._cv:
+            self._stopped = True
+            self._cv.notify()
+        self._thread.join()
+        with self.lock:
+            write = self.state.CaptureSave()
+        if write is not None: write()
+        if self._error is not None: raise self._error
+
+    def _loop(self):
+        while True:
+            with self._cv:
+                while not self._stopped:
+                    if self._requested_at is not None:
+                        wait = 0 if self._urgent else self._requested_at+self.max_staleness-time.monotonic()
+                        if wait <= 0: break
+                        self._cv.wait(wait)
+                    else:
+                        self._cv.wait()
+                if self._stopped: return
+                self._requested_at = None
+                self._urgent = False
+
+            with self.lock:
+                write = self.state.CaptureSave()
+            try:
+                if write is not None: write()
+            except Exception as e:
+                # the captured changes are lost, later changes can't be saved on top of the gap
+                with self.lock:
+                    self.state.SaveFailed()
+                self._error = e
+                return
+
 class TerminationWatcher:
   kill_now = False
   def __init__(self, sync: Sync):
@@ -599,6 +1078,7 @@ class TerminationWatcher:
     self.sync = sync
 
   def exit_gracefully(self, *args):
+    # runs on the scheduler's thread, possibly while it holds a lock, so only wake it
     print('stop requested')
     self.kill_now = True
     self.sync.PushNotify()
@@ -758,6 +1238,15 @@ class Workflow:
         regenerate: Literal["failures"]|list[Item]=list(),
         max_concurrent: int = 256,
         max_per_module: dict[str, int] = dict(),
+        state_store: Literal["snapshot", "journal", "sqlite"] = "snapshot",
+        max_save_staleness: float = 5,
+        runner: JobRunner|None = None,
+        resource_budget: ResourceBudget|None = None,
+        scheduling_policy: Literal["fifo", "round_robin", "critical_path"] = "fifo",
+        runtime_estimates: dict[str, float] = dict(),
+        runtime_history: bool|str|Path = True,
+        retry: dict[str, RetryPolicy] = dict(),
+        max_open_groups: int|None = None,
         _catch_errors: bool = True,
     ):
         workspace = Path(os.path.abspath(workspace))
@@ -770,20 +1259,95 @@ class Workflow:
 
         result_sync = Sync()
         watcher = TerminationWatcher(result_sync)
-        def _run_job_async(jobi: JobInstance, procedure: Callable[[], JobResult]):
-            def _job():
+        if runner is None: runner = ThreadPerJobRunner()
+        history = None
+        if runtime_history is not False:
+            # in the workspace unless a path is given, since the reference folder can be shared between runs and users
+            history_path = workspace.joinpath(RuntimeHistory.FILE_NAME) if runtime_history is True else Path(os.path.abspath(runtime_history))
+            try:
+                history = RuntimeHistory(history_path)
+            except (sqlite3.Error, OSError) as e:
+                print(f"warning: no runtime history, failed to open [{history_path}]: {e}")
+
+        def _record_history(finished: list[tuple[str, JobResult]]):
+            # the history is only for estimates, a run doesn't stop for it
+            nonlocal history
+            if history is None: return
+            try:
+                history.Record(finished)
+            except (sqlite3.Error, OSError) as e:
+                print(f"warning: stopped keeping runtime history, failed to write to [{history.path}]: {e}")
+                history = None
+
+        def _retry_later(state: WorkflowState, scheduler: Scheduler, job_instance: JobInstance, result: JobResult, sprint: Callable[[str], None]):
+            # true if the failed job will run again, policies given to Run replace those of modules
+            attempts = state.RegisterJobFailed(result.made_by, result)
+            policy = retry.get(job_instance.step.name, job_instance.step.retry)
+            if policy is None or not policy.ShouldRetry(result, attempts): return False
+            delay = policy.Delay(attempts)
+            sprint(f"{Timestamp()} retrying {job_instance.step.name}:{result.made_by} in {delay:.0f}s, attempt {attempts+1} of {policy.max_attempts}")
+            folder = job_instance.GetFolderName()
+            if os.path.exists(folder): # kept for its logs, and so the retry doesn't see the last result
+                os.rename(folder, f"{folder}.attempt{attempts}")
+            scheduler.AddLater(job_instance, delay)
+            return True
+
+        def _schedule(state: WorkflowState, state_lock: Lock, checkpointer: Checkpointer,
+            scheduler: Scheduler, jobs_running: dict[str, JobInstance], sprint: Callable[[str], None]):
+            while not watcher.kill_now:
+                if scheduler.IsIdle(): break
+
+                while True:
+                    job = scheduler.Next()
+                    if job is None: break
+                    if watcher.kill_now:
+                        raise KeyboardInterrupt()
+                    batch = [job]
+                    if executor.CAN_BATCH and job.step.batch_size > 1:
+                        batch += scheduler.TakeBatch(job, job.step.batch_size)
+                    for j in batch:
+                        sprint(f"{Timestamp()} queued {j.step.name}:{j.GetID()}")
+                        jobs_running[j.GetID()] = j
+                    job_params = params.Copy()
+                    if scheduler.budget is not None: job_params.threads, job_params.mem_gb = scheduler.Demand(job)
+                    if len(batch) == 1:
+                        runner.Submit(job, workspace, job_params)
+                    else:
+                        runner.SubmitBatch(batch, workspace, job_params)
+
+                sys.stdout.flush()
+                finished: list[tuple[str, JobResult]] = []
                 try:
-                    result = procedure()
-                except Exception as e:
-                    result = JobResult(
-                        exit_code = 1,
-                        error_message = str(e),
-                        made_by = jobi.GetID(),
-                    )
-                result_sync.PushNotify(result)
-        
-            th = Thread(target=_job, daemon=True)
-            th.start()
+                    results = result_sync.WaitAll(timeout=scheduler.SecondsUntilDue())
+                    with state_lock:
+                        for result in results:
+                            if result is None:
+                                raise KeyboardInterrupt()
+                            job_instance = jobs_running[result.made_by]
+                            del jobs_running[result.made_by]
+                            scheduler.Done(job_instance)
+                            finished.append((job_instance.step.name, result))
+                            header = f"{job_instance.step.name}:{result.made_by}"
+                            if not result.error_message is None:
+                                sprint(f"{Timestamp()} failed {header}: [{result.error_message}]")
+                                if _retry_later(state, scheduler, job_instance, result, sprint): continue
+                                state.RegisterJobComplete(result.made_by, {})
+                            else:
+                                sprint(f"{Timestamp()} completed {header}")
+                                state.RegisterJobComplete(result.made_by, result.manifest)
+                            if result.manifest is not None:
+                                for t in targets:
+                                    if t in result.manifest:
+                                        self._link_output(job_instance, t, result.manifest[t])
+                except KeyboardInterrupt:
+                    print("force stopped")
+                _record_history(finished)
+
+                with state_lock:
+                    state.Update()
+                    scheduler.Add(state.TakeNewPendingJobs())
+                checkpointer.Request(now=watcher.kill_now)
+                sys.stdout.flush()
 
         def _run():
             # make links for inputs in workspace
@@ -819,7 +1383,7 @@ class Workflow:
                 _unique_steps[c.name] = c
             steps: list[ComputeModule] = [s for s in _unique_steps.values()]
             print(f'linearized plan: [{" -> ".join(s.name for s in steps)}]')
-            state = WorkflowState.ResumeIfPossible('./', steps, given)
+            state = WorkflowState.ResumeIfPossible('./', steps, given, store=state_store)
             if regenerate == "failures":
                 state.InvalidateFails()
             elif len(regenerate)>0:
@@ -843,58 +1407,42 @@ class Workflow:
                 with executor._sync:
                     print(x)
 
-            jobs_ran = set() # this may be redundant
             jobs_running: dict[str, JobInstance] = {}
-            running_per_module: dict[str, int] = {}
-            while not watcher.kill_now:
-                pending_jobs = state.GetPendingJobs()
-                if len(pending_jobs) == 0: break
-
-                for job in pending_jobs:
-                    if watcher.kill_now:
-                        raise KeyboardInterrupt()
-                    if len(jobs_running) >= max_concurrent: break
-                    jid = job.GetID()
-                    if jid in jobs_ran: continue
-
-                    module_name = job.step.name
-                    if module_name in max_per_module:
-                        max_for_this_module = max_per_module[module_name]
-                        current_for_this_module = running_per_module.get(module_name, 0)
-                        if current_for_this_module >= max_for_this_module: continue
-                        else: running_per_module[module_name] = current_for_this_module+1
-                    
-                    sprint(f"{Timestamp()} queued {job.step.name}:{jid}")
-                    _run_job_async(job, lambda: executor.Run(job, workspace, params.Copy()))
-                    jobs_running[jid] = job
-                    jobs_ran.add(jid)
-
-                sys.stdout.flush()
+            priority = None
+            if scheduling_policy == "critical_path":
+                # given estimates take precedence over those from previous runs
+                estimates = {} if history is None else history.RuntimeEstimates()
+                estimates.update(runtime_estimates)
+                priority = CriticalPathPriority(steps, targets, estimates)
+            scheduler = Scheduler(
+                max_concurrent=max_concurrent, max_per_module=max_per_module,
+                budget=resource_budget, default_demand=(params.threads, params.mem_gb),
+                priority=priority,
+                max_open_groups=max_open_groups, group_of=state.GetRootGroup,
+                round_robin=scheduling_policy == "round_robin",
+            )
+            if resource_budget is not None: print(f"packing jobs into {resource_budget.cores} cores and {resource_budget.memory_gb:.1f} GB")
+            if max_open_groups is not None: print(f"working on at most {max_open_groups} input groups at a time")
+            scheduler.Add(state.GetPendingJobs())
+            state.TakeNewPendingJobs()
+            # saving happens in the background, the state is locked only while it changes or while changes are captured
+            state_lock = Lock()
+            checkpointer = Checkpointer(state, state_lock, max_staleness=max_save_staleness)
+            runner.Start(executor, result_sync.PushNotify)
+            scheduled = False
+            try:
+                _schedule(state, state_lock, checkpointer, scheduler, jobs_running, sprint)
+                scheduled = True
+            finally:
+                runner.Stop()
+                executor.Close() # worker processes, if any, are started again if the executor is used for another run
                 try:
-                    for result in result_sync.WaitAll():
-                        if result is None:
-                            raise KeyboardInterrupt()
-                        job_instance = jobs_running[result.made_by]
-                        del jobs_running[result.made_by]
-                        mn = job_instance.step.name
-                        if mn in running_per_module: running_per_module[mn] = running_per_module[mn]-1
-                        header = f"{job_instance.step.name}:{result.made_by}"
-                        if not result.error_message is None:
-                            sprint(f"{Timestamp()} failed {header}: [{result.error_message}]")
-                            state.RegisterJobComplete(result.made_by, {})
-                        else:
-                            sprint(f"{Timestamp()} completed {header}")
-                            state.RegisterJobComplete(result.made_by, result.manifest)
-                        if result.manifest is not None:
-                            for t in targets:
-                                if t in result.manifest:
-                                    self._link_output(job_instance, t, result.manifest[t])
-                except KeyboardInterrupt:
-                    print("force stopped")
-
-                state.Update()
-                state.Save()
-                sys.stdout.flush()
+                    checkpointer.Stop()
+                except Exception as e:
+                    if scheduled: raise
+                    print(f"warning: failed to save the workflow state: {e}") # don't hide why scheduling stopped
+                if resource_budget is not None: print(f"utilization: {scheduler.UtilizationReport()}")
+                if len(executor.result_watcher.latencies) > 0: print(f"result.json: {executor.result_watcher.Report()}")
             
             executor.PrepareRun
 
@@ -0,0 +1,657 @@
+import os, sys
+import io
+import time
+import tempfile
+import threading
+import heapq
+import random
+from contextlib import redirect_stdout
+from pathlib import Path
+
+sys.path = [os.path.abspath(Path(__file__).joinpath("../../src"))]+sys.path
+from limes_x import Workflow, InputGroup, Executor, JobResult, Params, Item, RetryPolicy, LoadComputeModules
+from limes_x import JobRunner, ThreadPerJobRunner, ThreadPoolRunner, AsyncioRunner
+from limes_x.execution.instances import JobInstance
+from limes_x.execution.scheduler import Scheduler, ResourceBudget, CriticalPathPriority
+from limes_x.execution.history import RuntimeHistory
+from limes_x.execution.watcher import ResultWatcher
+from limes_x.common.log_sink import LogSink
+from limes_x.workflow import WorkflowState
+from bench_state import make_modules, fake_outputs, SAMPLE, USER, STATS, TAX, _module
+
+#########################################################################################
+# dispatch cost, jobs finish one at a time as soon as they are started
+
+def _fake_jobs(throttled: int, others: int):
+    download, work = _module("download_sra", [SAMPLE], [USER]), _module("work", [USER], [STATS])
+    n = 0
+    def _id(w):
+        nonlocal n; n += 1
+        return f"{n:0{w}x}"
+    # the throttled jobs come first, as they would for a workflow's first step
+    return [JobInstance(_id, download, {}) for _ in range(throttled)]+[JobInstance(_id, work, {}) for _ in range(others)]
+
+def _scan_dispatch(jobs: list[JobInstance], max_concurrent: int, max_per_module: dict[str, int]):
+    # the loop Workflow.Run used before the scheduler: look at every pending job after each completion
+    pending = dict((j.GetID(), j) for j in jobs)
+    jobs_ran, jobs_running, running_per_module = set(), {}, {}
+    while len(pending)>0:
+        for job in list(pending.values()):
+            if len(jobs_running) >= max_concurrent: break
+            jid = job.GetID()
+            if jid in jobs_ran: continue
+            module_name = job.step.name
+            if module_name in max_per_module:
+                current = running_per_module.get(module_name, 0)
+                if current >= max_per_module[module_name]: continue
+                running_per_module[module_name] = current+1
+            jobs_running[jid] = job
+            jobs_ran.add(jid)
+        jid, job = next(iter(jobs_running.items()))
+        del jobs_running[jid]
+        del pending[jid]
+        mn = job.step.name
+        if mn in running_per_module: running_per_module[mn] -= 1
+
+def _scheduler_dispatch(jobs: list[JobInstance], max_concurrent: int, max_per_module: dict[str, int]):
+    scheduler = Scheduler(max_concurrent=max_concurrent, max_per_module=max_per_module)
+    scheduler.Add(jobs)
+    running: dict[str, JobInstance] = {}
+    while not scheduler.IsIdle():
+        while True:
+            job = scheduler.Next()
+            if job is None: break
+            running[job.GetID()] = job
+        jid, job = next(iter(running.items()))
+        del running[jid]
+        scheduler.Done(job)
+
+def bench_dispatch(sizes: list[int]=[2_000, 5_000, 50_000], scan_limit: int=5_000):
+    limits = {"download_sra": 4}
+    for n in sizes:
+        jobs = _fake_jobs(n//2, n-n//2)
+        line = f"dispatch: {n:>6} pending,"
+        t0 = time.perf_counter(); _scheduler_dispatch(jobs, 256, limits); dt = time.perf_counter()-t0
+        line += f" scheduler {n/dt:,.0f} jobs/s"
+        if n <= scan_limit:
+            t0 = time.perf_counter(); _scan_dispatch(jobs, 256, limits); dt = time.perf_counter()-t0
+            line += f", scan {n/dt:,.0f} jobs/s"
+        print(line)
+
+def check_dispatch_order():
+    # one at a time, jobs start in the order they were added unless round robin is asked for
+    jobs = _fake_jobs(3, 2)
+    for round_robin, expected in [(False, "ddd ww"), (True, "dwdwd")]:
+        scheduler = Scheduler(max_concurrent=1, round_robin=round_robin)
+        scheduler.Add(jobs)
+        started = []
+        while (job := scheduler.Next()) is not None:
+            started.append(job.step.name[0])
+            scheduler.Done(job)
+        assert "".join(started) == expected.replace(" ", ""), (round_robin, started)
+    print("dispatch order: fifo by default, round robin if asked")
+
+#########################################################################################
+# whole Workflow.Run with an executor that does nothing
+
+class NoOpExecutor(Executor):
+    def Run(self, instance: JobInstance, workspace: Path, params) -> JobResult:
+        return JobResult(made_by=instance.GetID(), manifest=fake_outputs(instance))
+
+    async def RunAsync(self, instance: JobInstance, workspace: Path, params) -> JobResult:
+        return self.Run(instance, workspace, params)
+
+def bench_run(samples: int=200, max_per_module: dict[str, int]={"download": 4}, runner: JobRunner|None=None):
+    given = [InputGroup(group_by=(SAMPLE, f"S{i:05}"), children={USER: "user"}) for i in range(samples)]
+    with tempfile.TemporaryDirectory() as ref, tempfile.TemporaryDirectory() as ws:
+        wf = Workflow(make_modules(), ref)
+        log = io.StringIO()
+        t0 = time.perf_counter()
+        with redirect_stdout(log):
+            wf.Run(ws, [STATS, TAX], given, executor=NoOpExecutor(), max_per_module=max_per_module, runner=runner, _catch_errors=False)
+        dt = time.perf_counter()-t0
+        completed = log.getvalue().count(" completed ")
+        assert completed == samples*7, f"expected {samples*7} jobs, {completed} completed"
+        print(f"run: {samples} samples, {completed} jobs in {dt:.1f}s, {completed/dt:,.0f} jobs/s with {type(runner).__name__ if runner is not None else 'ThreadPerJobRunner'}")
+
+#########################################################################################
+# many long jobs in flight, each one is a subprocess that sleeps
+
+def _run_all(runner: JobRunner, jobs: list[JobInstance], workspace: Path, executor: Executor):
+    done = []
+    cv = threading.Condition()
+    def _on_done(r: JobResult):
+        with cv:
+            done.append(r)
+            cv.notify()
+    runner.Start(executor, _on_done)
+    peak_threads = threading.active_count()
+    t0 = time.perf_counter()
+    for j in jobs:
+        runner.Submit(j, workspace, Params(file_system_wait_sec=0))
+    with cv:
+        while len(done) < len(jobs):
+            cv.wait(0.05)
+            peak_threads = max(peak_threads, threading.active_count())
+    dt = time.perf_counter()-t0
+    runner.Stop()
+    return dt, peak_threads, done
+
+def bench_runners(jobs: int=300, seconds: float=1, pool_size: int=32):
+    executor = Executor(
+        execute_procedure=lambda j: j.Shell(f"sleep {seconds}"),
+        async_execute_procedure=lambda j: j.ShellAsync(f"sleep {seconds}"),
+    )
+    original_dir = os.getcwd()
+    for runner in [ThreadPerJobRunner(), ThreadPoolRunner(workers=pool_size), AsyncioRunner()]:
+        with tempfile.TemporaryDirectory() as ws:
+            os.chdir(ws)
+            try:
+                dt, peak, results = _run_all(runner, _fake_jobs(0, jobs), Path(ws), executor)
+            finally:
+                os.chdir(original_dir)
+            assert len(results) == jobs
+            print(f"runner: {type(runner).__name__:>18}, {jobs} jobs of {seconds}s, {dt:.1f}s, peak {peak} threads")
+
+def check_long_lines():
+    # the asyncio runner's shell used to fail on output lines over 64 KiB
+    import asyncio
+    from limes_x.common.utils import LiveShellAsync
+    expected = "a"*200_000+"\n"+"é"*70_000+"\nno newline at the end"
+    out, err = [], []
+    cmd = f"""python -c "import sys; sys.stdout.write('a'*200_000+'\\n'+'é'*70_000+'\\nno newline at the end'); sys.stderr.write('b'*100_000)"; exit 3"""
+    code = asyncio.run(LiveShellAsync(cmd, onOut=out.append, onErr=err.append, echo_cmd=False))
+    assert code == 3 and "".join(out) == expected and "".join(err) == "b"*100_000, (code, [len(x) for x in out])
+    assert len(out) == 3, [len(x) for x in out]
+    print(f"long lines: {len(expected)} characters in {len(out)} lines read back whole")
+
+#########################################################################################
+# simulated time, each job takes as long as its module says
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+def simulate_schedule(scheduler: Scheduler, clock: _Clock, durations: dict[str, float], jobs: list[JobInstance], successors=None):
+    # returns the makespan, [successors] gives the jobs that a finished job makes pending
+    scheduler.Add(jobs)
+    running: list[tuple[float, int, JobInstance]] = []
+    n = 0
+    while not scheduler.IsIdle():
+        while True:
+            job = scheduler.Next()
+            if job is None: break
+            n += 1
+            heapq.heappush(running, (clock.now+durations[job.step.name], n, job))
+        assert len(running)>0, "no job can start"
+        end, _, job = heapq.heappop(running)
+        clock.now = end
+        scheduler.Done(job)
+        if successors is not None: scheduler.Add(successors(job))
+    return clock.now
+
+def _sized_module(name: str, threads: int, memory_gb: int):
+    m = _module(name, [SAMPLE], [Item(f"{name} out")])
+    m.threads, m.memory_gb = threads, memory_gb
+    return m
+
+def bench_packing(cores: int=64, memory_gb: int=256):
+    # a mix of large assemblies and small per-bin jobs on one node, limited by job count vs by resources
+    modules = {
+        "assembly": (_sized_module("assembly", 16, 100), 3600, 20),
+        "checkm": (_sized_module("checkm", 2, 8), 600, 200),
+        "taxonomy": (_sized_module("taxonomy", 1, 4), 300, 400),
+    }
+    durations = dict((k, d) for k, (_, d, _) in modules.items())
+    def _jobs():
+        n = 0
+        def _id(w):
+            nonlocal n; n += 1
+            return f"{n:0{w}x}"
+        return [JobInstance(_id, m, {}) for m, _, count in modules.values() for _ in range(count)]
+
+    unlimited = ResourceBudget(cores=10**6, memory_gb=10**6) # only to track usage
+    for label, max_concurrent, budget in [
+        ("count, memory safe", memory_gb//100, unlimited),
+        ("count, core sized", cores, unlimited),
+        ("resource budget", 10**6, ResourceBudget(cores, memory_gb)),
+    ]:
+        clock = _Clock()
+        scheduler = Scheduler(max_concurrent=max_concurrent, budget=budget, clock=clock)
+        makespan = simulate_schedule(scheduler, clock, durations, _jobs())
+        u = scheduler._usage
+        print(f"packing: {label:>18}, makespan {makespan/3600:.2f}h, cores {100*u.core_seconds/makespan/cores:.0f}% used, peak memory {u.peak_memory_gb:.0f}/{memory_gb} GB")
+
+def _random_dag(rng: random.Random, n_modules: int):
+    # module i uses the outputs of up to 2 earlier modules, most are quick logistics, a few are long
+    parents: dict[int, list[int]] = {}
+    modules, durations = [], {}
+    for i in range(n_modules):
+        parents[i] = rng.sample(range(i), k=min(i, rng.randint(1, 2))) if i>0 else []
+        inputs = [Item(f"out{p}") for p in parents[i]] if i>0 else [SAMPLE]
+        modules.append(_module(f"m{i}", inputs, [Item(f"out{i}")]))
+        durations[f"m{i}"] = rng.choice([60, 120, 300]) if rng.random()<0.7 else rng.choice([1800, 3600, 7200])
+    children = dict((i, [c for c in range(n_modules) if i in parents[c]]) for i in range(n_modules))
+    sinks = [Item(f"out{i}") for i in range(n_modules) if len(children[i]) == 0]
+    return modules, durations, parents, children, sinks
+
+def check_critical_path():
+    # a -> b -> c -> target, with b <-> loop a cycle, priorities must not depend on the order modules are given in
+    A, B, C, L, T = Item("a out"), Item("b out"), Item("c out"), Item("loop out"), Item("target")
+    modules = [
+        _module("a", [SAMPLE], [A]),
+        _module("b", [A, L], [B]),
+        _module("loop", [B], [L]),
+        _module("c", [B], [T]),
+        _module("unused", [A], [Item("unused out")]),
+    ]
+    runtimes = {"a": 1, "b": 10, "loop": 100, "c": 1000, "unused": 5}
+    expected = {"a": 1111, "b": 1110, "loop": 1110, "c": 1000, "unused": 0}
+    for order in [modules, modules[::-1], modules[2:]+modules[:2]]:
+        p = CriticalPathPriority(order, [T], runtimes)
+        assert p == expected, p
+    print("critical path ok")
+
+def bench_priority(seeds: int=10, n_modules: int=12, samples: int=20, max_concurrent: int=8):
+    # makespan of the same synthetic workflows with modules in ready order vs by remaining critical path
+    totals = {"fifo": 0.0, "critical_path": 0.0}
+    for seed in range(seeds):
+        modules, durations, parents, children, sinks = _random_dag(random.Random(seed), n_modules)
+        for policy in totals:
+            n = 0
+            def _id(w):
+                nonlocal n; n += 1
+                return f"{n:0{w}x}"
+            sample_of: dict[JobInstance, int] = {}
+            done: dict[int, set[int]] = dict((s, set()) for s in range(samples))
+            def _job(i: int, sample: int):
+                j = JobInstance(_id, modules[i], {})
+                sample_of[j] = sample
+                return j
+            def _successors(job: JobInstance):
+                i, sample = int(job.step.name[1:]), sample_of[job]
+                done[sample].add(i)
+                return [_job(c, sample) for c in children[i] if all(p in done[sample] for p in parents[c])]
+
+            clock = _Clock()
+            priority = CriticalPathPriority(modules, sinks, durations) if policy == "critical_path" else None
+            scheduler = Scheduler(max_concurrent=max_concurrent, clock=clock, priority=priority)
+            totals[policy] += simulate_schedule(scheduler, clock, durations, [_job(0, s) for s in range(samples)], _successors)
+    fifo, cp = totals["fifo"]/seeds, totals["critical_path"]/seeds
+    print(f"priority: {seeds} random workflows of {n_modules} modules x {samples} samples, {max_concurrent} slots, makespan fifo {fifo/3600:.1f}h, critical path {cp/3600:.1f}h ({100*(1-cp/fifo):.0f}% shorter)")
+
+def bench_open_groups(samples: int=200, max_concurrent: int=16, max_open_groups: int=16):
+    # a quick download then long steps for each sample, downloaded reads stay on disk until the sample is done
+    chain = [("download", 300), ("extract", 300), ("assembly", 3600), ("binning", 1200), ("annotation", 1800)]
+    modules = [_module(name, [SAMPLE if i == 0 else Item(f"{chain[i-1][0]} out")], [Item(f"{name} out")]) for i, (name, _) in enumerate(chain)]
+    durations = dict(chain)
+    for label, limit in [("breadth first", None), ("sample major", max_open_groups)]:
+        n = 0
+        def _id(w):
+            nonlocal n; n += 1
+            return f"{n:0{w}x}"
+        sample_of: dict[JobInstance, int] = {}
+        on_disk, peak, first_finished = set(), 0, None
+        def _job(i: int, sample: int):
+            j = JobInstance(_id, modules[i], {})
+            sample_of[j] = sample
+            return j
+        def _successors(job: JobInstance):
+            nonlocal peak, first_finished
+            i, sample = [m.name for m in modules].index(job.step.name), sample_of[job]
+            on_disk.add(sample)
+            peak = max(peak, len(on_disk))
+            if i+1 == len(modules):
+                on_disk.remove(sample)
+                if first_finished is None: first_finished = clock.now
+                return []
+            return [_job(i+1, sample)]
+        clock = _Clock()
+        scheduler = Scheduler(max_concurrent=max_concurrent, clock=clock, max_open_groups=limit, group_of=sample_of.get)
+        makespan = simulate_schedule(scheduler, clock, durations, [_job(0, s) for s in range(samples)], _successors)
+        print(f"open groups: {label:>13}, {samples} samples, {max_concurrent} slots, makespan {makespan/3600:.1f}h, first sample done at {first_finished/3600:.1f}h, peak {peak} samples on disk")
+
+def check_open_groups(samples: int=12, max_open_groups: int=3):
+    # every job's sample, in the order they were started, never more than the limit between a sample's first and last job
+    given = [InputGroup(group_by=(SAMPLE, f"S{i:05}"), children={USER: "user"}) for i in range(samples)]
+    started: list[str] = []
+    class _Recording(NoOpExecutor):
+        def Run(self, instance: JobInstance, workspace: Path, params) -> JobResult:
+            started.append(next(str(ii.value) for ii in instance.ListInputInstances() if str(ii.value).startswith("S")).split(".")[0].split("+")[0])
+            time.sleep(0.005)
+            return super().Run(instance, workspace, params)
+    with tempfile.TemporaryDirectory() as ref, tempfile.TemporaryDirectory() as ws:
+        with redirect_stdout(io.StringIO()):
+            Workflow(make_modules(), ref).Run(ws, [STATS, TAX], given, executor=_Recording(), max_open_groups=max_open_groups, _catch_errors=False)
+    last = dict((s, i) for i, s in enumerate(started))
+    first = dict((s, i) for i, s in reversed(list(enumerate(started))))
+    peak = max(sum(1 for s in first if first[s] <= i <= last[s]) for i in range(len(started)))
+    assert len(started) == samples*7 and peak <= max_open_groups, (len(started), peak)
+    print(f"open groups: Workflow.Run with {samples} samples, at most {peak} samples in progress at once")
+
+#########################################################################################
+# many light jobs, each one a real local.py process unless batched
+
+_LIGHT_MODULE = '''\
+from limes_x import ModuleBuilder, Item, JobContext, JobResult
+def procedure(context: JobContext) -> JobResult:
+    out = context.output_folder.joinpath("stats.txt")
+    with open(out, "w") as f: f.write(str(context.manifest[Item("bin")]))
+    return JobResult(manifest={Item("bin stats"): out})
+MODULE = ModuleBuilder().SetProcedure(procedure).AddInput(Item("bin"), groupby=Item("bin")).PromiseOutput(Item("bin stats")).SetHome(__file__)'''
+
+def _light_modules(folder: Path, batch_size: int, parallel: int):
+    lib = folder.joinpath("bin_stats/lib")
+    os.makedirs(lib)
+    with open(lib.joinpath("definition.py"), "w") as f:
+        f.write(_LIGHT_MODULE+(f".BatchJobs({batch_size}, {parallel})" if batch_size > 1 else "")+".Build()\n")
+    return folder
+
+def bench_batching(jobs: int=64, configs: list[tuple[int, int]]=[(1, 1), (16, 1), (16, 4)], runner: JobRunner|None=None):
+    given = [InputGroup(group_by=(Item("bin"), f"bin{i:04}"), children={}) for i in range(jobs)]
+    for batch_size, parallel in configs:
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            wf = Workflow(LoadComputeModules(_light_modules(tmp.joinpath("modules"), batch_size, parallel)), tmp.joinpath("ref"))
+            log = io.StringIO()
+            t0 = time.perf_counter()
+            with redirect_stdout(log):
+                wf.Run(tmp.joinpath("ws"), [Item("bin stats")], given, executor=Executor(), max_concurrent=8, runner=runner, _catch_errors=False)
+            dt = time.perf_counter()-t0
+            completed = log.getvalue().count(" completed ")
+            assert completed == jobs, log.getvalue()[-2000:]
+            print(f"batching: {jobs} light jobs, batches of {batch_size}, {parallel} at a time, {dt:.1f}s, {1000*dt/jobs:.0f}ms per job")
+
+def check_batch_failure(jobs: int=8):
+    # the batch's process dies at the 3rd job, the jobs it got through keep their results
+    given = [InputGroup(group_by=(Item("bin"), f"bin{i:04}"), children={}) for i in range(jobs)]
+    for runner in [None, AsyncioRunner()]:
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            folder = _light_modules(tmp.joinpath("modules"), jobs, 1)
+            definition = folder.joinpath("bin_stats/lib/definition.py")
+            definition.write_text(definition.read_text().replace(
+                '    out = context.output_folder', '    if context.manifest[Item("bin")] == "bin0002": import os; os._exit(1)\n    out = context.output_folder',
+            ))
+            wf = Workflow(LoadComputeModules(folder), tmp.joinpath("ref"))
+            log = io.StringIO()
+            with redirect_stdout(log):
+                wf.Run(tmp.joinpath("ws"), [Item("bin stats")], given, executor=Executor(), runner=runner, _catch_errors=False)
+            out = log.getvalue()
+            assert out.count(" completed ") == 2 and out.count(" failed ") == jobs-2, out[-3000:]
+    print(f"batch failure: {jobs} jobs in a batch that died at the 3rd, the first 2 completed")
+
+def bench_workers(jobs: int=64, concurrent: list[int]=[1, 8]):
+    # per job overhead of a new local.py process against warm worker processes, for jobs that do next to nothing
+    given = [InputGroup(group_by=(Item("bin"), f"bin{i:04}"), children={}) for i in range(jobs)]
+    for n in concurrent:
+        for workers, runner in [(0, None), (n, None), (n, AsyncioRunner())]:
+            with tempfile.TemporaryDirectory() as tmp:
+                tmp = Path(tmp)
+                wf = Workflow(LoadComputeModules(_light_modules(tmp.joinpath("modules"), 1, 1)), tmp.joinpath("ref"))
+                executor = Executor(workers=workers)
+                log = io.StringIO()
+                t0 = time.perf_counter()
+                with redirect_stdout(log):
+                    wf.Run(tmp.joinpath("ws"), [Item("bin stats")], given, executor=executor, max_concurrent=n, runner=runner, _catch_errors=False)
+                dt = time.perf_counter()-t0
+                if workers > 0: assert all(w is None for w in executor._pool._idle.queue), "Run left workers running" # type: ignore
+                completed = log.getvalue().count(" completed ")
+                assert completed == jobs, log.getvalue()[-2000:]
+                mode = "new process per job" if workers == 0 else f"{workers} warm workers{'' if runner is None else ', asyncio'}"
+                print(f"workers: {jobs} no-op jobs, {n} at a time, {mode:>26}, {dt:.1f}s, {1000*dt/jobs:.0f}ms per job")
+
+class _CountingExecutor(Executor):
+    # counts results that came back over the pipe, instead of from result.json,
+    # piping is left to the default so that it is what gets checked
+    def __init__(self, pipe_results: bool=True) -> None:
+        super().__init__()
+        if not pipe_results: self.pipe_results = False
+        self.piped = 0
+
+    def _checked_result(self, d, context, job, remove_log: bool=True):
+        if not remove_log: self.piped += 1
+        return super()._checked_result(d, context, job, remove_log)
+
+def bench_result_pipe(jobs: int=64, concurrent: int=8, results: int=2_000):
+    # the orchestrator's cost of taking in a result, read back from result.json against sent over a pipe,
+    # then short jobs end to end, in batches so that process starts don't drown out the difference
+    import json
+    assert Executor().pipe_results and not Executor(execute_procedure=lambda j: j.Shell(j.run_command)).pipe_results
+    original_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        executor = Executor()
+        instances = _fake_jobs(0, results)
+        params = Params(file_system_wait_sec=0)
+        made = []
+        for inst in instances:
+            job = executor._make_job(inst, Path(tmp), params, _save=False)
+            folder = job.context.output_folder
+            os.makedirs(folder)
+            out = folder.joinpath("stats.txt"); out.write_text("x")
+            d = JobResult(manifest={STATS: out}, out_log=[f"line {i}" for i in range(50)], commands=["echo"], exit_code=0, wall_sec=0.1).ToDict()
+            with open(folder.joinpath("result.json"), "w") as f: json.dump(d, f, indent=4)
+            made.append((job, json.loads(json.dumps([str(folder), d]))[1]))
+        for mode in ["result.json", "pipe"]:
+            for job, _ in made: job.context.output_folder.joinpath("realtime.log").write_text("x")
+            t0 = time.perf_counter()
+            for job, d in made:
+                if mode == "pipe":
+                    r = executor._compile_result(job, True, "", _result=d, _piped=True)
+                else:
+                    r = executor._compile_result(job, True, "")
+                assert r.error_message is None and r.manifest[STATS] is not None, r.error_message
+            dt = time.perf_counter()-t0
+            print(f"result pipe: {results} results taken in from {mode:>11}, {1e6*dt/results:.0f}us each")
+        os.chdir(original_dir)
+
+    given = [InputGroup(group_by=(Item("bin"), f"bin{i:04}"), children={}) for i in range(jobs)]
+    for runner in [None, AsyncioRunner()]:
+        for pipe in [False, True]:
+            with tempfile.TemporaryDirectory() as tmp:
+                tmp = Path(tmp)
+                wf = Workflow(LoadComputeModules(_light_modules(tmp.joinpath("modules"), 16, 4)), tmp.joinpath("ref"))
+                executor = _CountingExecutor() if pipe else _CountingExecutor(pipe_results=False)
+                log = io.StringIO()
+                t0 = time.perf_counter()
+                with redirect_stdout(log):
+                    wf.Run(tmp.joinpath("ws"), [Item("bin stats")], given, executor=executor, max_concurrent=concurrent, runner=runner, _catch_errors=False)
+                dt = time.perf_counter()-t0
+                assert log.getvalue().count(" completed ") == jobs, log.getvalue()[-2000:]
+                assert executor.piped == (jobs if pipe else 0), executor.piped
+                assert len(list(tmp.joinpath("ws").rglob("result.json"))) == jobs # still written
+                mode = f"{'pipe' if pipe else 'result.json'}, {'threads' if runner is None else 'asyncio'}"
+                print(f"result pipe: {jobs} short jobs in batches of 16, {mode:>20}, {dt:.2f}s, {jobs/dt:.0f} jobs/s")
+
+#########################################################################################
+# waiting for result.json on a slow file system
+
+def bench_result_wait(delays: list[float]=[0.002, 0.05, 0.3, 1.5], timeout_sec: float=5):
+    # result.json shows up [delay] after the job is done, the executor used to sleep [timeout_sec] whenever it wasn't there yet
+    import asyncio
+    def _appear_later(path: Path, delay: float):
+        def _write():
+            time.sleep(delay)
+            with open(path, "w") as f: f.write("{}")
+        threading.Thread(target=_write).start()
+    for mode in ["inotify", "polling", "asyncio"]:
+        watcher = ResultWatcher()
+        if mode == "polling": watcher._watch = lambda path, callback: None # type: ignore
+        seen = []
+        with tempfile.TemporaryDirectory() as tmp:
+            for i, d in enumerate(delays):
+                path = Path(tmp).joinpath(f"result-{i}.json")
+                _appear_later(path, d)
+                if mode == "asyncio":
+                    latency = asyncio.run(watcher.WaitAsync(path, timeout_sec))
+                else:
+                    latency = watcher.Wait(path, timeout_sec)
+                assert latency is not None and latency >= d*0.9, (d, latency)
+                seen.append(max(0, latency-d))
+            assert watcher.Wait(Path(tmp).joinpath("never.json"), 0.2) is None
+        late = ", ".join(f"{1000*x:.0f}ms" for x in seen)
+        print(f"result wait: {mode:>7}, written after {delays}s, seen late by {late}, was {timeout_sec}s each; {watcher.Report()}")
+
+#########################################################################################
+# realtime.log of chatty tools
+
+def bench_log_sink(lines: int=200_000):
+    # the runners used to open realtime.log for every line a tool printed
+    import gzip
+    text = [f"04:05:06> [M::worker] processed {i} reads in 0.01 CPU sec" for i in range(lines)]
+    with tempfile.TemporaryDirectory() as tmp:
+        old = Path(tmp).joinpath("old.log")
+        t0 = time.perf_counter()
+        for line in text:
+            with open(old, "a") as f: f.write(line+"\n")
+        dt_old = time.perf_counter()-t0
+
+        new = Path(tmp).joinpath("new.log")
+        t0 = time.perf_counter()
+        with LogSink(new) as sink:
+            for line in text: sink.Write(line)
+        dt_new = time.perf_counter()-t0
+        assert new.read_text() == old.read_text()
+        print(f"log sink: {lines:,} lines, open per line {dt_old:.2f}s, one handle {dt_new:.2f}s ({dt_old/dt_new:.0f}x)")
+
+        # a line written after a quiet stretch shows up for tail -f within flush_sec, without another write or Close
+        quiet = Path(tmp).joinpath("quiet.log")
+        sink = LogSink(quiet, flush_sec=0.2)
+        sink.Write("first")
+        sink.Write("second, right after")
+        time.sleep(0.5)
+        assert quiet.read_text() == "first\nsecond, right after\n", quiet.read_text()
+        sink.Close()
+
+        # nothing written, no file
+        with LogSink(Path(tmp).joinpath("silent.log")) as sink: pass
+        assert not Path(tmp).joinpath("silent.log").exists()
+
+        # rotation keeps the newest [keep] pieces, gzipped
+        rotated = Path(tmp).joinpath("rotated.log")
+        with LogSink(rotated, flush_bytes=1<<12, rotate_bytes=1<<16, keep=2, compress=True) as sink:
+            for line in text[:20_000]: sink.Write(line)
+        pieces = sorted(p.name for p in Path(tmp).glob("rotated.log*"))
+        assert pieces == ["rotated.log", "rotated.log.1.gz", "rotated.log.2.gz"], pieces
+        kept = b"".join(gzip.decompress(Path(tmp).joinpath(n).read_bytes()) for n in ["rotated.log.2.gz", "rotated.log.1.gz"])+rotated.read_bytes()
+        assert ("\n".join(text[:20_000])+"\n").encode().endswith(kept)
+        print(f"log sink: rotation at 64KB kept {len(kept):,} of the last bytes in {pieces}")
+
+#########################################################################################
+# failed jobs retried within the run
+
+class FlakyExecutor(NoOpExecutor):
+    # downloads time out the first [transient] times, assembly always fails
+    def __init__(self, transient: int) -> None:
+        super().__init__()
+        self.transient = transient
+        self.calls: dict[str, int] = {}
+
+    def Run(self, instance: JobInstance, workspace: Path, params) -> JobResult:
+        jid = instance.GetID()
+        self.calls[jid] = self.calls.get(jid, 0)+1
+        if instance.step.name == "download" and self.calls[jid] <= self.transient:
+            return JobResult(made_by=jid, exit_code=1, error_message="TimeoutError: read timed out")
+        if instance.step.name == "assemble":
+            return JobResult(made_by=jid, exit_code=2, error_message="ValueError: bad reads")
+        return super().Run(instance, workspace, params)
+
+def check_retry(samples: int=20):
+    given = [InputGroup(group_by=(SAMPLE, f"S{i:05}"), children={USER: "user"}) for i in range(samples)]
+    policy = RetryPolicy(max_attempts=3, backoff_sec=0.05, on_errors=["TimeoutError"])
+    for transient, downloaded in [(2, samples), (3, 0)]:
+        with tempfile.TemporaryDirectory() as ref, tempfile.TemporaryDirectory() as ws:
+            wf = Workflow(make_modules(), ref)
+            executor = FlakyExecutor(transient)
+            log = io.StringIO()
+            t0 = time.perf_counter()
+            with redirect_stdout(log):
+                wf.Run(ws, [STATS, TAX], given, executor=executor, retry={"download": policy, "assemble": policy}, _catch_errors=False)
+            dt = time.perf_counter()-t0
+            out = log.getvalue()
+            assert out.count(" completed download") == downloaded, out
+            assert out.count(" retrying download") == samples*2
+            assert out.count(" retrying assemble") == 0 # not a matching error
+            state = WorkflowState.ResumeIfPossible(Path(ws), make_modules(), given)
+            downloads = [j for j in state._job_instances.values() if j.step.name == "download"]
+            attempts = sorted(len(j.attempts or []) for j in downloads)
+            assert attempts == [min(transient, 3)]*samples, attempts
+            print(f"retry: {samples} downloads failing {transient} times, {out.count(' completed download')} completed after {sum(attempts)} failed attempts in {dt:.1f}s")
+
+#########################################################################################
+# runtime history from previous runs
+
+def check_history(jobs: int=2_000):
+    # wall time grows linearly with input size plus noise, a few jobs fail
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as ref:
+        history = RuntimeHistory(Path(ref).joinpath(RuntimeHistory.FILE_NAME))
+        finished = []
+        for i in range(jobs):
+            size = rng.randint(10**6, 10**9)
+            ok = rng.random() > 0.05
+            finished.append(("assembly", JobResult(
+                made_by=f"{i:08x}", exit_code=0 if ok else 1, input_bytes=size,
+                wall_sec=60+size/10**6*rng.uniform(0.9, 1.1), cpu_sec=size/10**5, max_rss_mb=size/10**6,
+            )))
+        t0 = time.perf_counter()
+        for i in range(0, jobs, 50): history.Record(finished[i:i+50])
+        dt_record = time.perf_counter()-t0
+
+        history = RuntimeHistory(Path(ref).joinpath(RuntimeHistory.FILE_NAME)) # as in the next run
+        assert history.Count("assembly") == jobs
+        slope, intercept, n = history.Regression("assembly")
+        assert abs(slope*10**6-1) < 0.05 and abs(intercept-60) < 20, (slope, intercept)
+        p = history.Percentiles("assembly", "wall_sec")
+        assert p is not None and p[50] < p[90] < p[99]
+        assert 0.03 < history.FailureRate("assembly") < 0.07
+        assert history.Percentiles("missing") is None
+        for n, expected in [(6, {50: 3, 90: 6, 99: 6}), (10, {50: 5, 90: 9, 99: 10}), (100, {50: 50, 90: 90, 99: 99})]:
+            history.Record([(f"ranks{n}", JobResult(made_by=f"{i:08x}", exit_code=0, wall_sec=i)) for i in range(1, n+1)])
+            assert history.Percentiles(f"ranks{n}") == expected, (n, history.Percentiles(f"ranks{n}")) # nearest rank
+        estimate = history.Estimate("assembly", input_bytes=5*10**8)
+        assert estimate is not None and abs(estimate-560) < 30, estimate
+        print(f"history: {jobs} jobs recorded in {dt_record*1000:.0f}ms, {n} fit at {slope*10**6:.2f}s/MB + {intercept:.0f}s, wall p50/p90/p99 {p[50]:.0f}/{p[90]:.0f}/{p[99]:.0f}s")
+
+    # kept in the workspace by default, and a history that can't be opened doesn't stop the run
+    given = [InputGroup(group_by=(Item("bin"), f"bin{i}"), children={}) for i in range(4)]
+    for runtime_history in [True, "missing/folder/history.db"]:
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            wf = Workflow(LoadComputeModules(_light_modules(tmp.joinpath("modules"), 1, 1)), tmp.joinpath("ref"))
+            log = io.StringIO()
+            with redirect_stdout(log):
+                wf.Run(tmp.joinpath("ws"), [Item("bin stats")], given, executor=Executor(), runtime_history=runtime_history, _catch_errors=False)
+            assert log.getvalue().count(" completed ") == len(given), log.getvalue()[-2000:]
+            assert not tmp.joinpath("ref", RuntimeHistory.FILE_NAME).exists()
+            if runtime_history is True:
+                assert RuntimeHistory(tmp.joinpath("ws", RuntimeHistory.FILE_NAME)).Count("bin_stats") == len(given)
+            else:
+                assert "warning: no runtime history" in log.getvalue(), log.getvalue()[-2000:]
+    print("history: in the workspace, run goes on without it")
+
+if __name__ == "__main__":
+    check_dispatch_order()
+    check_long_lines()
+    check_history()
+    check_retry()
+    bench_dispatch()
+    bench_packing()
+    check_critical_path()
+    bench_priority()
+    bench_open_groups()
+    check_open_groups()
+    bench_batching()
+    check_batch_failure()
+    bench_workers()
+    bench_result_wait()
+    bench_result_pipe()
+    bench_log_sink()
+    bench_runners()
+    samples = int(sys.argv[1]) if len(sys.argv)>1 else 200
+    bench_run(samples=samples)
+    bench_run(samples=samples, runner=AsyncioRunner())
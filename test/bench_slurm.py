@@ -0,0 +1,206 @@
+import os, sys
+import time
+import tempfile
+import threading
+from pathlib import Path
+
+HERE = Path(os.path.abspath(__file__)).parent
+sys.path = [str(HERE.parent.joinpath("src"))]+sys.path
+from limes_x.execution.slurm import SlurmArraySubmitter, SlurmPoller, SubmitAndWait
+from limes_x.execution.executors import TokenBucket, HpcExecutor
+from limes_x.execution.instances import JobInstance
+from limes_x import ComputeModule, Item, Params
+
+def _with_mock_slurm(fn):
+    # the mock sbatch and squeue in test/mock, as dev.sh --test uses them, with their own queue
+    def _wrapped(*args, **kwargs):
+        original = dict(os.environ)
+        with tempfile.TemporaryDirectory() as tmp:
+            os.environ["PATH"] = f"{HERE.joinpath('mock')}:{os.environ['PATH']}"
+            os.environ["MOCK_SLURM_DIR"] = tmp
+            try:
+                return fn(Path(tmp), *args, **kwargs)
+            finally:
+                os.environ.clear()
+                os.environ.update(original)
+    return _wrapped
+
+def _count_submissions(tmp: Path):
+    counter = tmp.joinpath("last_id")
+    return 0 if not counter.exists() else int(counter.read_text())-999
+
+@_with_mock_slurm
+def check_array_submitter(tmp: Path, jobs: int=60):
+    # every 7th job fails, jobs ask for 1 of 3 resource sizes so they should go out as 3 arrays
+    submitter = SlurmArraySubmitter(tmp.joinpath("arrays"), gather_sec=0.5, poller=SlurmPoller(min_interval_sec=0.2, max_interval_sec=1))
+    results: dict[int, tuple[bool, str, dict]] = {}
+    def _job(i: int):
+        out = tmp.joinpath(f"out-{i}")
+        results[i] = submitter.Submit(f"{i:08x}", f"echo {i} > {out} && exit {3 if i%7 == 0 else 0}", 1+i%3, 4, "01:00:00")
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=_job, args=(i,)) for i in range(jobs)]
+    for th in threads: th.start()
+    for th in threads: th.join()
+    dt = time.perf_counter()-t0
+
+    assert len(results) == jobs
+    for i, (ok, msg, accounting) in results.items():
+        assert ok == (i%7 != 0), (i, ok, msg)
+        assert tmp.joinpath(f"out-{i}").read_text().strip() == str(i)
+        assert accounting["exit_code"] == (3 if i%7 == 0 else 0), accounting
+        assert accounting["state"] == ("FAILED" if i%7 == 0 else "COMPLETED"), accounting
+        if not ok: assert "exit code 3" in msg, msg
+    submissions = _count_submissions(tmp)
+    assert submissions == 3, submissions
+    print(f"slurm arrays: {jobs} jobs in {submissions} sbatch calls, {sum(not ok for ok, _, _ in results.values())} failed as expected, {dt:.1f}s")
+
+@_with_mock_slurm
+def check_poller(tmp: Path, jobs: int=100):
+    # jobs submitted without --wait, all followed by one poller instead of a waiting thread or sbatch process each
+    poller = SlurmPoller(min_interval_sec=0.2, max_interval_sec=1)
+    threads_before = threading.active_count()
+    t0 = time.perf_counter()
+    submitted = []
+    for i in range(jobs):
+        job, err = poller.Submit([f"--wrap=sleep 0.{i%5} && exit {2 if i%9 == 0 else 0}", f"--output={tmp}/slurm-%j.out"])
+        assert job is not None, err
+        submitted.append((i, job))
+    assert threading.active_count() == threads_before+1, threading.active_count() # just the poller's
+    for i, job in submitted:
+        a = job.Wait()
+        assert a["slurm_id"] == job.slurm_id
+        assert a["exit_code"] == (2 if i%9 == 0 else 0), a
+        assert a["state"] == ("FAILED" if i%9 == 0 else "COMPLETED"), a
+        assert a["elapsed_sec"] is not None and a["max_rss_mb"] is not None, a
+    dt = time.perf_counter()-t0
+    assert poller.CountTracked() == 0
+    print(f"slurm poller: {jobs} jobs followed with {poller.calls} squeue/sacct calls, {dt:.1f}s")
+
+@_with_mock_slurm
+def check_poll_errors(tmp: Path):
+    # a failing squeue or sacct must not stop the poller's thread, waiting jobs would never finish
+    bin = tmp.joinpath("bin")
+    os.makedirs(bin)
+    def _wrap(name: str, script: str):
+        bin.joinpath(name).write_text(f"#!/bin/sh\n{script}\n")
+        bin.joinpath(name).chmod(0o755)
+    mock = lambda name: f'exec {HERE.joinpath("mock", name)} "$@"'
+    _wrap("sbatch", mock("sbatch"))
+    _wrap("squeue", "echo 'squeue: error: slurm_load_jobs' >&2; exit 1")
+    _wrap("sacct", "echo 'x|COMPLETED|a:b|1:x|?|??'; "+mock("sacct")) # a line that doesn't parse, then the real output
+    os.environ["PATH"] = f"{bin}:{os.environ['PATH'].replace(str(HERE.joinpath('mock'))+':', '', 1)}"
+
+    poller = SlurmPoller(min_interval_sec=0.1, max_interval_sec=0.2)
+    job, err = poller.Submit(["--wrap=sleep 0.3", f"--output={tmp}/slurm-%j.out"])
+    assert job is not None, err
+    time.sleep(0.5)
+    _wrap("squeue", mock("squeue"))
+    a = job.Wait()
+    assert a["state"] == "COMPLETED" and a["exit_code"] == 0, a
+
+    # without squeue at all, tracked jobs are done instead of waited on forever
+    job, err = poller.Submit(["--wrap=sleep 5", f"--output={tmp}/slurm-%j.out"])
+    assert job is not None, err
+    bin.joinpath("squeue").unlink()
+    a = job.Wait()
+    assert a["state"] == "UNKNOWN" and "squeue" in a["error"], a
+
+    # an array whose files can't be written fails its tasks instead of the submitter's thread
+    blocked = tmp.joinpath("blocked")
+    blocked.write_text("")
+    submitter = SlurmArraySubmitter(blocked.joinpath("arrays"), gather_sec=0.1, poller=poller)
+    for i in range(2):
+        ok, msg, _ = submitter.Submit(f"{i:08x}", "true", 1, 1, "01:00:00")
+        assert not ok and "failed to submit array" in msg, msg
+    print("slurm poll errors ok")
+
+def bench_token_bucket(jobs: int=300, threads: int=16, rate: float=100, burst: int=20):
+    # the preset used to sleep a random 0-10s before each submission, 5s per job on average
+    bucket = TokenBucket(rate=rate, burst=burst)
+    times: list[float] = []
+    waits: list[float] = []
+    lock = threading.Lock()
+    def _submitter(n: int):
+        for _ in range(n):
+            w = bucket.Acquire()
+            with lock:
+                times.append(time.monotonic())
+                waits.append(w)
+    t0 = time.monotonic()
+    pool = [threading.Thread(target=_submitter, args=(jobs//threads+(1 if i < jobs%threads else 0),)) for i in range(threads)]
+    for th in pool: th.start()
+    for th in pool: th.join()
+    dt = time.monotonic()-t0
+
+    times.sort()
+    busiest = max(sum(1 for t in times[i:] if t-start < 1) for i, start in enumerate(times))
+    assert len(times) == jobs
+    assert busiest <= rate+burst+1, busiest
+    assert dt >= (jobs-burst)/rate*0.95, dt
+    no_wait = sum(1 for w in waits if w == 0)
+    print(f"token bucket: {jobs} submissions from {threads} threads in {dt:.1f}s at {rate:.0f}/s with bursts of {burst}, busiest second {busiest}, {no_wait} went without waiting, mean wait {sum(waits)/jobs:.2f}s")
+
+@_with_mock_slurm
+def check_push_back(tmp: Path, jobs: int=40, busy: float=0.3):
+    # a busy controller refuses some submissions, they are tried again after the bucket backs off,
+    # only the sbatch call is limited and retried, not the wait for the job
+    os.environ["MOCK_SLURM_BUSY"] = str(busy)
+    bucket = TokenBucket(rate=50, burst=5, backoff_sec=0.1, max_backoff_sec=1)
+    poller = SlurmPoller(min_interval_sec=0.2, max_interval_sec=1, submission_limit=bucket)
+    results = []
+    def _job(i: int):
+        if i%2 == 0:
+            submitted, err = poller.Submit([f"--wrap=true", f"--output={tmp}/slurm-%j.out"])
+            results.append((submitted is not None and submitted.Wait()["exit_code"] == 0, err))
+        else:
+            results.append(SubmitAndWait([f"--wrap=true"], bucket))
+    t0 = time.perf_counter()
+    pool = [threading.Thread(target=_job, args=(i,)) for i in range(jobs)]
+    for th in pool: th.start()
+    for th in pool: th.join()
+    dt = time.perf_counter()-t0
+
+    assert all(ok for ok, _ in results), [msg for ok, msg in results if not ok]
+    assert bucket.push_backs > 0
+    submissions = _count_submissions(tmp)
+    assert submissions == jobs, submissions
+    print(f"push back: {jobs} jobs submitted through a controller refusing {busy:.0%}, {bucket.push_backs} push backs, rate ended at {bucket.rate:.1f}/s, {dt:.1f}s")
+
+    # a failed job whose error looks like a refusal is not submitted again
+    os.environ["MOCK_SLURM_BUSY"] = "0"
+    pushed_back = bucket.push_backs
+    ok, msg = SubmitAndWait(["--wrap=echo 'Resource temporarily unavailable' >&2; exit 3"], bucket)
+    assert not ok and "temporarily unavailable" in msg, msg
+    assert bucket.push_backs == pushed_back and _count_submissions(tmp) == jobs+1
+
+    # an array is one sbatch call and takes one token
+    taken = []
+    acquire = bucket.Acquire
+    bucket.Acquire = lambda: taken.append(1) or acquire() # type: ignore
+    submitter = SlurmArraySubmitter(tmp.joinpath("arrays"), gather_sec=0.3, poller=poller)
+    pool = [threading.Thread(target=submitter.Submit, args=(f"{i:08x}", "true", 1, 4, "01:00:00")) for i in range(jobs)]
+    for th in pool: th.start()
+    for th in pool: th.join()
+    assert len(taken) == submitter.submissions == 1, (len(taken), submitter.submissions)
+
+    # HpcExecutor gives its bucket to the procedures
+    module = ComputeModule(_key=ComputeModule._initializer_key, procedure=lambda c: None, inputs={Item("x")}, group_by={}, outputs={Item("y")}, location="./", name="m")
+    seen = []
+    def _procedure(job):
+        seen.append(job.submission_limit)
+        return SubmitAndWait(["--wrap=true"], job.submission_limit)
+    executor = HpcExecutor(hpc_procedure=_procedure, submission_limit=bucket)
+    original_dir = os.getcwd()
+    os.chdir(tmp)
+    try:
+        executor.Run(JobInstance(lambda w: f"{1:0{w}x}", module, {}), tmp, Params(file_system_wait_sec=0))
+    finally:
+        os.chdir(original_dir)
+    assert seen == [bucket], seen
+
+if __name__ == "__main__":
+    check_array_submitter()
+    check_poller()
+    check_poll_errors()
+    bench_token_bucket()
+    check_push_back()
@@ -0,0 +1,562 @@
+import os, sys
+import time
+import tempfile
+import tracemalloc
+from pathlib import Path
+from threading import Lock
+
+sys.path = [os.path.abspath(Path(__file__).joinpath("../../src"))]+sys.path
+from limes_x import Item, ComputeModule, InputGroup
+from limes_x.workflow import WorkflowState, Checkpointer
+from limes_x.execution.instances import ItemInstance, JobInstance, JobSignature
+from limes_x.execution.state_store import SqliteStateStore
+
+#########################################################################################
+# synthetic metagenomics-like workflow, jobs are "run" by making up outputs
+
+SAMPLE = Item("sample")
+USER = Item("user")
+READS = Item("reads")
+ASM = Item("assembly")
+BIN = Item("bin")
+STATS = Item("bin stats")
+TAX = Item("bin taxonomy")
+
+BINS_PER_SAMPLE = 3
+
+def _module(name: str, inputs: list[Item], outputs: list[Item], group_by: dict[Item, Item]=dict()):
+    return ComputeModule(
+        _key=ComputeModule._initializer_key,
+        procedure=lambda c: None,
+        inputs=set(inputs),
+        group_by=group_by,
+        outputs=set(outputs),
+        location="./",
+        name=name,
+    )
+
+def make_modules():
+    return [
+        _module("download", [SAMPLE, USER], [READS], group_by={USER: SAMPLE}),
+        _module("assemble", [READS], [ASM]),
+        _module("binning", [ASM, READS], [BIN], group_by={ASM: SAMPLE, READS: SAMPLE}),
+        _module("checkm", [BIN], [STATS]),
+        _module("taxonomy", [BIN, ASM], [TAX], group_by={BIN: ASM}),
+    ]
+
+def make_state(workspace: Path, samples: int):
+    given = [InputGroup(group_by=(SAMPLE, f"S{i:05}"), children={USER: "user"}) for i in range(samples)]
+    return WorkflowState.MakeNew(workspace, make_modules(), given)
+
+def fake_outputs(job) -> dict:
+    tag = "+".join(sorted(str(ii.value) for ii in job.ListInputInstances() if ii.item_name != USER.key))
+    name = job.step.name
+    if name == "binning":
+        return {BIN: [f"{tag}.bin{i}" for i in range(BINS_PER_SAMPLE)]}
+    out = next(iter(job.step.outputs))
+    return {out: f"{tag}.{name}"}
+
+def job_keys(state: WorkflowState):
+    # instance ids differ between states, so compare by values
+    return {
+        (ji.step.name, tuple(sorted(str(ii.value) for ii in ji.ListInputInstances())))
+        for ji in state._job_instances.values()
+    }
+
+def simulate(state: WorkflowState, force_full: bool, on_update=None, per_round: int|None=None, on_save=None, max_rounds: int|None=None):
+    state.Update()
+    rounds = 0
+    while max_rounds is None or rounds < max_rounds:
+        pending = state.GetPendingJobs()
+        if len(pending) == 0: break
+        for ji in pending[:per_round]:
+            state.RegisterJobComplete(ji.GetID(), fake_outputs(ji))
+        if force_full: state._full_update = True
+        t0 = time.perf_counter()
+        state.Update()
+        if on_update is not None: on_update(time.perf_counter()-t0)
+        if on_save is not None:
+            t0 = time.perf_counter()
+            state.Save()
+            on_save(time.perf_counter()-t0)
+        rounds += 1
+    return rounds
+
+def state_keys(state: WorkflowState):
+    done = {(ji.step.name, tuple(sorted(str(ii.value) for ii in ji.ListInputInstances())), ji.complete) for ji in state._job_instances.values()}
+    items = {(ii.item_name, str(ii.value)) for iis in state._item_lookup.values() for ii in iis}
+    return done, items, len(state.GetPendingJobs())
+
+#########################################################################################
+
+def check_incremental_update(samples: int=30):
+    # incremental discovery must find the same jobs as a full recompute
+    with tempfile.TemporaryDirectory() as ws:
+        inc = make_state(Path(ws), samples)
+        full = make_state(Path(ws), samples)
+        simulate(inc, force_full=False, per_round=7)
+        simulate(full, force_full=True, per_round=7)
+        a, b = job_keys(inc), job_keys(full)
+        assert a == b, f"incremental and full updates differ: {len(a)} vs {len(b)}"
+        expected = samples*(4+BINS_PER_SAMPLE)
+        assert len(a) == expected, f"expected {expected} jobs, got {len(a)}"
+        for target, by in inc._group_by_paths:
+            memoized = inc._group_by(target, by)
+            inc._group_memo.clear()
+            fresh = inc._group_by(target, by)
+            assert {k: set(v) for k, v in memoized.items()} == {k: set(v) for k, v in fresh.items()}, f"stale groups for {target} by {by}"
+    print(f"incremental update ok: {len(a)} jobs for {samples} samples")
+
+def bench_update(samples: int=500, per_round: int=1):
+    # time spent in Update between job completions
+    for force_full in [True, False]:
+        with tempfile.TemporaryDirectory() as ws:
+            state = make_state(Path(ws), samples)
+            times = []
+            t0 = time.perf_counter()
+            simulate(state, force_full=force_full, on_update=times.append, per_round=per_round)
+            total = time.perf_counter()-t0
+            label = "full" if force_full else "incremental"
+            print(f"{label:>12}: {samples} samples, {len(times)} updates, {1000*sum(times)/len(times):.2f} ms/update, {total:.1f}s total")
+
+def bench_group_by(sample_counts: list[int]=[250, 500, 1000, 2000]):
+    # per-root cost of resolving groups should not depend on the number of samples
+    for samples in sample_counts:
+        with tempfile.TemporaryDirectory() as ws:
+            state = make_state(Path(ws), samples)
+            simulate(state, force_full=False)
+            state._group_memo.clear()
+            t0 = time.perf_counter()
+            cold = state._group_by(BIN.key, ASM.key)
+            t_cold = time.perf_counter()-t0
+            t0 = time.perf_counter()
+            warm = state._group_by(BIN.key, ASM.key)
+            t_warm = time.perf_counter()-t0
+            assert len(cold) == len(warm) == samples
+            print(f"group by: {samples:>5} samples, cold {1e6*t_cold/samples:.2f} us/root, memoized {1e6*t_warm/samples:.2f} us/root")
+
+def bench_cross(roots: int=6, group_size: int=500):
+    # 3 list inputs, each grouped by a different root, crossed into roots^3 jobs of 3*group_size instances
+    dims = [(Item(f"root {d}"), Item(f"part {d}")) for d in "xyz"]
+    modules = [_module(f"split_{r.key}", [r], [p]) for r, p in dims]
+    modules.append(_module("combine", [p for _, p in dims], [Item("combined")], group_by=dict((p, r) for r, p in dims)))
+    given = [InputGroup(group_by=(r, f"{r.key}{i}"), children={}) for r, _ in dims for i in range(roots)]
+    with tempfile.TemporaryDirectory() as ws:
+        state = WorkflowState.MakeNew(Path(ws), modules, given)
+        state.Update()
+        for ji in state.GetPendingJobs():
+            out = next(iter(ji.step.outputs))
+            state.RegisterJobComplete(ji.GetID(), {out: [f"{ji.GetID()}.{i}" for i in range(group_size)]})
+
+        for label, force_full in [("discover", False), ("all known", True)]:
+            state._full_update = force_full
+            tracemalloc.start()
+            t0 = time.perf_counter()
+            state.Update()
+            elapsed = time.perf_counter()-t0
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"3-way cross ({label}): {roots}^3 namespaces of {group_size}-instance groups, {elapsed:.2f}s, peak {peak/1024**2:.1f} MB")
+        assert len(state.GetPendingJobs()) == roots**3
+
+def bench_signatures(fan_in: int=5000, repeats: int=200):
+    # signature of a fan-in job over thousands of bins, old string join vs JobSignature
+    ids = iter(range(10**9))
+    bins = [ItemInstance(lambda n: f"{next(ids):0{n}x}", BIN, f"bin{i}") for i in range(fan_in)]
+    asm = ItemInstance(lambda n: f"{next(ids):0{n}x}", ASM, "asm")
+    def _legacy():
+        return "-".join(["taxonomy"]+sorted(ii.GetID() for ii in bins+[asm]))
+    for label, make in [("string", _legacy), ("JobSignature", lambda: JobSignature("taxonomy", [bins, asm]))]:
+        lookup = {make(): None}
+        t0 = time.perf_counter()
+        for _ in range(repeats):
+            assert make() in lookup
+        print(f"signature ({label}): {fan_in} inputs, {1000*(time.perf_counter()-t0)/repeats:.2f} ms per build+lookup")
+
+def check_journal(samples: int=20):
+    # snapshot + journal replay must give back the same state, even if the last record was cut off
+    with tempfile.TemporaryDirectory() as ws:
+        state = make_state(Path(ws), samples)
+        state._store = "journal"
+        simulate(state, force_full=False, per_round=5, on_save=lambda _: None, max_rounds=20)
+        journal = Path(ws).joinpath(WorkflowState._JOURNAL_NAME)
+        assert journal.exists()
+        loaded = WorkflowState.LoadFromDisk(ws, make_modules())
+        assert state_keys(loaded) == state_keys(state), "journal replay differs from saved state"
+
+        with open(journal, 'a') as j:
+            j.write('{"job": ["assemble", "abc') # crash mid-write
+        loaded = WorkflowState.LoadFromDisk(ws, make_modules())
+        assert state_keys(loaded) == state_keys(state), "cut off journal record was not ignored"
+
+        loaded._store = "journal"
+        simulate(loaded, force_full=False, per_round=5, on_save=lambda _: None)
+        done = WorkflowState.LoadFromDisk(ws, make_modules())
+        assert state_keys(done) == state_keys(loaded)
+        assert done.GetPendingJobs() == []
+
+    # compaction rebuilds the snapshot from snapshot + journal on disk, without a full copy of the state in memory
+    with tempfile.TemporaryDirectory() as ws:
+        state = make_state(Path(ws), samples)
+        state._store = "journal"
+        state._JOURNAL_MIN_COMPACT_BYTES = 0
+        journal = Path(ws).joinpath(WorkflowState._JOURNAL_NAME)
+        sizes = []
+        def _on_save(_):
+            assert state._serialized is None
+            sizes.append(os.path.getsize(journal) if journal.exists() else 0)
+        simulate(state, force_full=False, per_round=5, on_save=_on_save)
+        assert any(b < a for a, b in zip(sizes, sizes[1:])), "journal was never compacted"
+        loaded = WorkflowState.LoadFromDisk(ws, make_modules())
+        assert state_keys(loaded) == state_keys(state), "compacted save differs from state"
+    print(f"journal ok")
+
+def check_sqlite(samples: int=20):
+    # the database must load back the same state, and convert to and from json
+    with tempfile.TemporaryDirectory() as ws:
+        state = make_state(Path(ws), samples)
+        state._store = "sqlite"
+        simulate(state, force_full=False, per_round=5, on_save=lambda _: None, max_rounds=20)
+        loaded = WorkflowState.ResumeIfPossible(ws, make_modules(), [], store="sqlite")
+        assert state_keys(loaded) == state_keys(state), "database differs from saved state"
+
+        WorkflowState.ConvertSave(ws, "json")
+        from_json = WorkflowState.LoadFromDisk(ws, make_modules(), source="json")
+        assert state_keys(from_json) == state_keys(state), "json converted from database differs"
+
+        loaded._store = "sqlite"
+        stores = set()
+        simulate(loaded, force_full=False, per_round=5, on_save=lambda _: stores.add(id(loaded._db)))
+        done = WorkflowState.LoadFromDisk(ws, make_modules(), source="sqlite")
+        assert state_keys(done) == state_keys(loaded)
+        assert len(stores) == 1, "database store was made again for a save"
+
+        # indexed lookups give the same rows as the whole state
+        db = SqliteStateStore(Path(ws).joinpath(SqliteStateStore.FILE_NAME))
+        whole = db.Read()
+        assert db.ReadItems(BIN.key) == whole["item_instances"][BIN.key]
+        assert db.ReadJobs("checkm") == whole["module_executions"]["checkm"]
+        jid = next(iter(whole["module_executions"]["binning"]))
+        assert set(db.ReadItemsMadeBy(jid)) == set(whole["module_executions"]["binning"][jid]["outputs"][BIN.key])
+        assert set(db.ReadPendingJobs()) == set(whole["pending_jobs"])
+
+    # switching stores moves the old save aside once the new one has everything, so switching back doesn't load it
+    with tempfile.TemporaryDirectory() as ws:
+        db = Path(ws).joinpath(SqliteStateStore.FILE_NAME)
+        state = make_state(Path(ws), samples)
+        state._store = "sqlite"
+        simulate(state, force_full=False, per_round=5, on_save=lambda _: None, max_rounds=5)
+        stale = db.read_bytes()
+        as_json = WorkflowState.ResumeIfPossible(ws, make_modules(), [], store="snapshot")
+        simulate(as_json, force_full=False, per_round=5, on_save=lambda _: None, max_rounds=5)
+        assert not db.exists() and db.with_name(f"{db.name}.replaced").exists()
+        back = WorkflowState.ResumeIfPossible(ws, make_modules(), [], store="sqlite")
+        assert state_keys(back) == state_keys(as_json), "switching back loaded the old database"
+
+        # both saves there, as an older version left them, the newer is loaded
+        db.write_bytes(stale)
+        os.utime(db, (0, 0))
+        loaded = WorkflowState.ResumeIfPossible(ws, make_modules(), [], store="sqlite")
+        assert state_keys(loaded) == state_keys(as_json), "loaded the older of two saves"
+    print(f"sqlite ok")
+
+def _synthetic_serialized(instances: int):
+    # half items, half jobs, each job uses one item and makes one item
+    items, jobs, reservations = {}, {}, {}
+    for i in range(instances//4):
+        given, made, job = f"{i:012x}", f"{i+10**9:012x}", f"{i:06x}"
+        items[given] = {"value": f"sample{i}", "type": "<class 'str'>"}
+        items[made] = {"value": f"out/{i}", "type": "<class 'pathlib.PosixPath'>", "made_by": job}
+        jobs[job] = {"complete": True, "inputs": {"x": given}, "outputs": {"y": made}}
+        reservations[given] = [job]
+    return {
+        "modules": {"m": {"in": ["x"], "out": ["y"]}},
+        "parent_map": {"x": ["m"], "m": ["y"]},
+        "module_executions": {"m": jobs},
+        "completed_modules": [],
+        "item_instances": {"x": dict((k, v) for k, v in items.items() if "made_by" not in v), "y": dict((k, v) for k, v in items.items() if "made_by" in v)},
+        "given": [],
+        "item_instance_reservations": reservations,
+        "pending_jobs": [],
+    }
+
+def bench_store(sizes: list[int]=[10_000, 100_000, 1_000_000]):
+    # whole-state save and load for json vs sqlite, plus saving a batch of 100 changes
+    for n in sizes:
+        serialized = _synthetic_serialized(n)
+        with tempfile.TemporaryDirectory() as ws:
+            ws = Path(ws)
+            t0 = time.perf_counter(); WorkflowState._write_snapshot(ws, serialized); json_save = time.perf_counter()-t0
+            t0 = time.perf_counter(); WorkflowState._read_serialized(ws, "json"); json_load = time.perf_counter()-t0
+
+            db = SqliteStateStore(ws.joinpath(SqliteStateStore.FILE_NAME))
+            t0 = time.perf_counter(); db.Replace(serialized); db_save = time.perf_counter()-t0
+            t0 = time.perf_counter(); db.Read(); db_load = time.perf_counter()-t0
+            changes = [("m", f"{i:06x}", {"complete": False, "inputs": {"x": f"{i:012x}"}}, True) for i in range(100)]
+            t0 = time.perf_counter(); db.Write(items=[], jobs=changes); db_delta = time.perf_counter()-t0
+            print(f"store: {n:>9} instances, json save {json_save:.2f}s load {json_load:.2f}s, sqlite save {db_save:.2f}s load {db_load:.2f}s, 100 changes {1000*db_delta:.1f} ms")
+
+def bench_save(samples: int=300, per_round: int=5):
+    # time spent saving after each batch of completions
+    for store in ["snapshot", "journal", "sqlite"]:
+        with tempfile.TemporaryDirectory() as ws:
+            state = make_state(Path(ws), samples)
+            state._store = store
+            times = []
+            simulate(state, force_full=False, per_round=per_round, on_save=times.append)
+            print(f"save ({store:>8}): {samples} samples, {len(times)} saves, {1000*sum(times)/len(times):.2f} ms/save")
+
+def _chained_serialized(instances: int, chain: int=1000):
+    # m1: x->y and m2: y->x alternate, so lineage is long chains of item, job, item, job...
+    items: dict[str, dict] = {"x": {}, "y": {}}
+    jobs: dict[str, dict] = {"m1": {}, "m2": {}}
+    reservations = {}
+    n = 0
+    for c in range(instances//(2*chain)):
+        prev = f"{n:012x}"; n += 1
+        items["x"][prev] = {"value": f"start{c}", "type": "<class 'str'>"}
+        for i in range(chain):
+            mod, inp, out = ("m1", "x", "y") if i%2==0 else ("m2", "y", "x")
+            job, made = f"{n:012x}", f"{n+1:012x}"; n += 2
+            jobs[mod][job] = {"complete": True, "inputs": {inp: prev}, "outputs": {out: made}}
+            items[out][made] = {"value": f"{c}.{i}", "type": "<class 'str'>", "made_by": job}
+            reservations[prev] = [job]
+            prev = made
+    # newest first, the worst case for loading in order of appearance
+    items = dict((k, dict(reversed(v.items()))) for k, v in items.items())
+    jobs = dict((k, dict(reversed(v.items()))) for k, v in jobs.items())
+    return {
+        "modules": {"m1": {"in": ["x"], "out": ["y"]}, "m2": {"in": ["y"], "out": ["x"]}},
+        "parent_map": {"x": ["m1"], "m1": ["y"], "y": ["m2"], "m2": ["x"]},
+        "module_executions": jobs,
+        "completed_modules": [],
+        "item_instances": items,
+        "given": [],
+        "item_instance_reservations": reservations,
+        "pending_jobs": [],
+    }
+
+def _chain_modules():
+    X, Y = Item("x"), Item("y")
+    return [_module("m1", [X], [Y]), _module("m2", [Y], [X])]
+
+def bench_resume(sizes: list[int]=[50_000, 500_000]):
+    # LoadFromDisk on deep lineage chains should grow linearly with the number of instances
+    for n in sizes:
+        with tempfile.TemporaryDirectory() as ws:
+            WorkflowState._write_snapshot(Path(ws), _chained_serialized(n))
+            t0 = time.perf_counter()
+            state = WorkflowState.LoadFromDisk(ws, _chain_modules())
+            dt = time.perf_counter()-t0
+            assert sum(len(v) for v in state._item_lookup.values()) > n//2-n//1000
+            print(f"resume: {n:>9} instances in chains, {dt:.2f}s, {1e6*dt/n:.1f} us/instance")
+
+def check_corrupt_save():
+    # a save with missing or circular references is reported, with the ids involved
+    def _load(serialized: dict):
+        with tempfile.TemporaryDirectory() as ws:
+            WorkflowState._write_snapshot(Path(ws), serialized)
+            try:
+                WorkflowState.LoadFromDisk(ws, _chain_modules())
+            except ValueError as e:
+                return str(e)
+        return None
+
+    s = _chained_serialized(40, chain=4)
+    jid = next(iter(s["module_executions"]["m1"]))
+    del s["module_executions"]["m1"][jid]
+    err = _load(s)
+    assert err is not None and jid in err and "missing" in err, err
+
+    s = _chained_serialized(40, chain=4)
+    jid, job = next(iter(s["module_executions"]["m1"].items()))
+    made = job["outputs"]["y"]
+    job["inputs"]["x"] = made # job now needs its own output
+    err = _load(s)
+    assert err is not None and jid in err and made in err and "cyclic" in err, err
+
+    # an id given to two instances would have one silently replace the other
+    s = _chained_serialized(40, chain=4)
+    iid, item = next(iter(s["item_instances"]["x"].items()))
+    s["item_instances"]["y"][iid] = dict(item)
+    err = _load(s)
+    assert err is not None and iid in err and "[x]" in err and "[y]" in err, err
+    with tempfile.TemporaryDirectory() as ws:
+        state = make_state(Path(ws), 4)
+        state.Update()
+        existing = state.GetPendingJobs()[0]
+        try:
+            state._register_job_instance(JobInstance(lambda _: existing.GetID(), existing.step, dict(existing.inputs)))
+            err = None
+        except ValueError as e:
+            err = str(e)
+        assert err is not None and existing.GetID() in err, err
+
+    # a crash after the new snapshot replaced the old one, but before the journal was removed
+    with tempfile.TemporaryDirectory() as ws:
+        state = make_state(Path(ws), 20)
+        state._store = "journal"
+        simulate(state, force_full=False, per_round=5, on_save=lambda _: None, max_rounds=5)
+        journal = Path(ws).joinpath(WorkflowState._JOURNAL_NAME)
+        stale = journal.read_bytes() # has jobs as pending that the next snapshot completes
+        state._needs_snapshot = True
+        simulate(state, force_full=False, per_round=5, on_save=lambda _: None, max_rounds=2)
+        journal.write_bytes(stale+(journal.read_bytes() if journal.exists() else b""))
+        loaded = WorkflowState.LoadFromDisk(ws, make_modules())
+        assert state_keys(loaded) == state_keys(state), "journal records older than the snapshot were replayed"
+    print("corrupt save ok")
+
+def _run_with_checkpointer(state: WorkflowState, checkpointer: Checkpointer|None, lock: Lock, per_round: int=5):
+    # returns the time from each batch of completions to being ready to queue the next jobs
+    times = []
+    with lock:
+        state.Update()
+    while True:
+        t0 = time.perf_counter()
+        with lock:
+            pending = state.GetPendingJobs()
+            if len(pending) == 0: break
+            for ji in pending[:per_round]:
+                state.RegisterJobComplete(ji.GetID(), fake_outputs(ji))
+            state.Update()
+        if checkpointer is None:
+            state.Save()
+        else:
+            checkpointer.Request()
+        times.append(time.perf_counter()-t0)
+    if checkpointer is not None: checkpointer.Stop()
+    return times
+
+def check_checkpointer(samples: int=20):
+    # everything saved in the background must be on disk after Stop
+    for store in ["snapshot", "journal", "sqlite"]:
+        with tempfile.TemporaryDirectory() as ws:
+            state = make_state(Path(ws), samples)
+            state._store = store
+            lock = Lock()
+            _run_with_checkpointer(state, Checkpointer(state, lock, max_staleness=0.01), lock)
+            loaded = WorkflowState.LoadFromDisk(ws, make_modules(), source="sqlite" if store == "sqlite" else "json")
+            assert state_keys(loaded) == state_keys(state), f"background saves ({store}) differ from state"
+
+    # a failed write loses the changes it captured, the save at Stop must not build on top of the gap
+    for store in ["journal", "sqlite"]:
+        with tempfile.TemporaryDirectory() as ws:
+            state = make_state(Path(ws), samples)
+            state._store = store
+            state.Update()
+            state.Save()
+            capture, captures = state.CaptureSave, []
+            def _failing_capture():
+                write = capture()
+                captures.append(write)
+                if write is None or len(captures) != 2: return write
+                def _fail(): raise OSError("disk full")
+                return _fail
+            state.CaptureSave = _failing_capture
+            lock = Lock()
+            checkpointer = Checkpointer(state, lock, max_staleness=0)
+            failed = False
+            for _ in range(6):
+                with lock:
+                    pending = state.GetPendingJobs()
+                    for ji in pending[:5]:
+                        state.RegisterJobComplete(ji.GetID(), fake_outputs(ji))
+                    state.Update()
+                try:
+                    checkpointer.Request(now=True)
+                except OSError:
+                    failed = True
+                time.sleep(0.05)
+            try:
+                checkpointer.Stop()
+            except OSError:
+                failed = True
+            assert failed, "failed write was not reported"
+            loaded = WorkflowState.LoadFromDisk(ws, make_modules(), source="sqlite" if store == "sqlite" else "json")
+            assert state_keys(loaded) == state_keys(state), f"save after a failed write ({store}) differs from state"
+    print("checkpointer ok")
+
+def bench_checkpoint(sample_counts: list[int]=[100, 200, 400]):
+    # completion to next queue, saving inline vs in the background
+    for samples in sample_counts:
+        results = []
+        for background in [False, True]:
+            with tempfile.TemporaryDirectory() as ws:
+                state = make_state(Path(ws), samples)
+                lock = Lock()
+                times = _run_with_checkpointer(state, Checkpointer(state, lock, max_staleness=0.5) if background else None, lock)
+                times = times[len(times)//2:] # once the state is large
+                results.append(f"{'background' if background else 'inline'} {1000*sum(times)/len(times):.2f} ms (max {1000*max(times):.1f})")
+        print(f"checkpoint: {samples:>5} samples, " + ", ".join(results))
+
+class _DictLayout:
+    # how instances were laid out before __slots__: a __dict__ each, string ids and a stored type
+    def __init__(self, id: str, handle: int, **attrs) -> None:
+        self._with_hashable_id__id = id
+        self._handle = handle
+        for k, v in attrs.items(): setattr(self, k, v)
+
+def _traced(make):
+    tracemalloc.start()
+    kept = make()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current, kept
+
+def bench_memory(instances: int=200_000):
+    # bytes per instance for a chain of items and the jobs between them, excluding values
+    m1, _ = _chain_modules()
+    def _slotted():
+        made: list = [ItemInstance(lambda n: f"{0:0{n}x}", Item("x"), "v")]
+        for i in range(instances//2):
+            ji = JobInstance(lambda n: f"{i:0{n}x}", m1, {"x": made[-1]})
+            ii = ItemInstance(lambda n: f"{i:0{n}x}", Item("y"), "v", made_by=ji)
+            ji.MarkAsComplete({"y": ii})
+            made += [ji, ii]
+        return made
+    def _dicts():
+        made: list = [_DictLayout(f"{0:012x}", 0, item_name="x", value="v", type=str, made_by=None)]
+        for i in range(instances//2):
+            inputs = {"x": made[-1]}
+            ji = _DictLayout(f"{i:06x}", 2*i+1, step=m1, inputs=inputs, _input_instances=[made[-1]], complete=True) # flattened inputs and outputs were stored
+            ii = _DictLayout(f"{i:012x}", 2*i+2, item_name="y", value="v", type=str, made_by=ji)
+            ji.outputs, ji._output_instances = dict({"y": ii}), [ii]
+            made += [ji, ii]
+        return made
+    before, _ = _traced(_dicts)
+    after, _ = _traced(_slotted)
+    print(f"memory: {instances} instances, {before/instances:.0f} bytes/instance with __dict__, {after/instances:.0f} with __slots__ ({100*(1-after/before):.0f}% less)")
+
+def check_legacy_ids():
+    # 6 and 12 character ids from older saves are kept as is, new ids can't collide with them
+    serialized = _synthetic_serialized(1000)
+    with tempfile.TemporaryDirectory() as ws:
+        WorkflowState._write_snapshot(Path(ws), serialized)
+        state = WorkflowState.LoadFromDisk(ws, [_module("m", [Item("x")], [Item("y")])])
+        assert set(state._job_instances) == set(serialized["module_executions"]["m"])
+        assert {ii.GetID() for iis in state._item_lookup.values() for ii in iis} == {k for d in serialized["item_instances"].values() for k in d}
+        new_ids = [state._gen_id(JobInstance.ID_WIDTH) for _ in range(1000)]+[state._gen_id(ItemInstance.ID_WIDTH) for _ in range(1000)]
+        assert len(set(new_ids)) == len(new_ids)
+        assert not any(id in state._job_instances for id in new_ids)
+        state._changed = True
+        state.Save()
+        reloaded = WorkflowState.LoadFromDisk(ws, [_module("m", [Item("x")], [Item("y")])])
+        assert reloaded._id_counters == state._id_counters, "id counters were not saved"
+    print("legacy ids ok")
+
+if __name__ == "__main__":
+    check_incremental_update()
+    bench_group_by()
+    bench_cross()
+    bench_signatures()
+    check_journal()
+    check_sqlite()
+    check_corrupt_save()
+    check_legacy_ids()
+    check_checkpointer()
+    bench_save()
+    bench_resume()
+    bench_checkpoint()
+    bench_memory()
+    bench_store()
+    bench_update(samples=int(sys.argv[1]) if len(sys.argv)>1 else 200)